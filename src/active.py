@@ -0,0 +1,173 @@
+"""
+active.py
+
+This file implements adaptive evaluation (main.py --target-ci-width), in
+which only as many question-criterion pairs are evaluated as it takes to
+know each criterion's accuracy against the gold labels to a given
+precision.
+
+Pairs with a gold label are evaluated in a randomized order that is
+stratified by criterion and gold label: within a criterion, every gold label
+is sampled in proportion to how common it is, so the pairs evaluated so far
+are always a representative sample. Accuracy is estimated per criterion as
+the stratified mean of the per-label accuracies, with a normal confidence
+interval that includes the finite population correction (its width is 0
+once every pair is evaluated). A criterion stops being sampled once its
+interval is narrower than the target width.
+
+The following are implemented:
+  - ActiveSampler: Sampling order, accuracy estimates and stopping rule.
+"""
+
+###############################################################################
+
+import numpy as np
+from statistics import NormalDist
+from typing import *
+
+# Evaluated pairs each gold label needs before a criterion may stop (fewer
+# if the label has fewer pairs)
+MIN_PER_LABEL = 5
+
+class ActiveSampler:
+    """
+    Chooses which pairs to evaluate next and decides when each criterion's
+    accuracy is known precisely enough.
+    """
+
+    def __init__(self,
+                 population: Dict[str, List[Tuple[str, str]]],
+                 target_width: float,
+                 confidence: float = 0.95,
+                 seed: int = 0) -> None:
+        """
+        Initializes the sampler for every pair that may be evaluated.
+
+        Args:
+            population (Dict[str, List[Tuple[str, str]]]): (questionID, gold
+                                                           label) of every
+                                                           pair, by
+                                                           criterion.
+            target_width (float): Width of the confidence interval at which
+                                  a criterion stops, e.g. 0.1 for +-0.05.
+            confidence (float, optional): Confidence level of the interval.
+                                          Defaults to 0.95.
+            seed (int, optional): Random seed of the order. The same seed
+                                  gives the same order, so an interrupted
+                                  run resumes it. Defaults to 0.
+        """
+        self.target_width = target_width
+        self.confidence = confidence
+        self._z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self._population = population
+        self._rng = np.random.default_rng(seed)
+
+        # Pairs and correct ratings so far, by criterion and gold label
+        self._sizes = {crit: {} for crit in population}
+        for crit, pairs in population.items():
+            for _, gold in pairs:
+                self._sizes[crit][gold] = self._sizes[crit].get(gold, 0) + 1
+        self._rated = {crit: {gold: 0 for gold in sizes} for crit, sizes in self._sizes.items()}
+        self._correct = {crit: {gold: 0 for gold in sizes} for crit, sizes in self._sizes.items()}
+
+    def order(self) -> List[Tuple[str, str]]:
+        """
+        Returns every pair in sampling order. Within a criterion, the pairs
+        of each gold label are shuffled and spread evenly (the i-th of n
+        pairs goes at a random point in the i-th n-th of the order), so
+        every prefix of the order holds each label in proportion. The
+        criteria are interleaved so they progress together.
+
+        Returns:
+            List[Tuple[str, str]]: (questionID, criterion) pairs.
+        """
+        keyed = []
+        for crit, pairs in sorted(self._population.items()):
+            labels = np.array([gold for _, gold in pairs], dtype=object)
+            keys = np.empty(len(pairs))
+            for gold, size in self._sizes[crit].items():
+                members = np.flatnonzero(labels == gold)
+                positions = self._rng.permutation(size)
+                keys[members] = (positions + self._rng.random(size)) / size
+            keyed += [(key, crit, questionID) for key, (questionID, _) in zip(keys, pairs)]
+        keyed.sort()
+        return [(questionID, crit) for _, crit, questionID in keyed]
+
+    def add(self,
+            crit: str,
+            gold: str,
+            rating: str) -> None:
+        """
+        Counts the rating of an evaluated pair.
+
+        Args:
+            crit (str): Criterion that was rated.
+            gold (str): Gold label of the pair.
+            rating (str): Rating given.
+        """
+        if gold not in self._rated.get(crit, {}):
+            return
+        self._rated[crit][gold] += 1
+        self._correct[crit][gold] += int(rating == gold)
+
+    def estimate(self, crit: str) -> dict:
+        """
+        Estimates a criterion's accuracy from the pairs evaluated so far.
+        The variance of each label's accuracy uses (correct + 1) / (rated +
+        2) so that labels with all-correct or all-wrong ratings so far don't
+        look certain.
+
+        Args:
+            crit (str): Criterion.
+
+        Returns:
+            dict: "accuracy", "ci" ([lower, upper], None until every label
+                  has a rated pair), "width", "rated" and "population".
+        """
+        sizes, rated, correct = self._sizes[crit], self._rated[crit], self._correct[crit]
+        population = sum(sizes.values())
+        estimate = {"accuracy": None, "ci": None, "width": None,
+                    "rated": sum(rated.values()), "population": population}
+        if population == 0 or any(rated[gold] == 0 for gold in sizes):
+            return estimate
+
+        accuracy, variance = 0.0, 0.0
+        for gold, size in sizes.items():
+            weight = size / population
+            accuracy += weight * correct[gold] / rated[gold]
+            smoothed = (correct[gold] + 1) / (rated[gold] + 2)
+            correction = (size - rated[gold]) / size
+            variance += weight ** 2 * smoothed * (1 - smoothed) / rated[gold] * correction
+
+        half_width = self._z * variance ** 0.5
+        estimate.update({"accuracy": accuracy,
+                         "ci": [max(0.0, accuracy - half_width), min(1.0, accuracy + half_width)],
+                         "width": 2 * half_width})
+        return estimate
+
+    def done(self, crit: str) -> bool:
+        """
+        Checks whether a criterion needs no more evaluations: every gold
+        label has MIN_PER_LABEL rated pairs (or all of its pairs) and the
+        confidence interval is narrower than the target width.
+
+        Args:
+            crit (str): Criterion.
+
+        Returns:
+            bool: True if the criterion should stop being sampled.
+        """
+        sizes, rated = self._sizes[crit], self._rated[crit]
+        if any(rated[gold] < min(MIN_PER_LABEL, size) for gold, size in sizes.items()):
+            return False
+        estimate = self.estimate(crit)
+        return estimate["width"] is not None and estimate["width"] <= self.target_width
+
+    def estimates(self) -> Dict[str, dict]:
+        """
+        Returns the estimate of every criterion, and whether it is done.
+
+        Returns:
+            Dict[str, dict]: Estimates by criterion.
+        """
+        return {crit: {**self.estimate(crit), "done": self.done(crit)} for crit in sorted(self._sizes)}
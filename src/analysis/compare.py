@@ -0,0 +1,291 @@
+"""
+compare.py
+
+This file implements the comparison of many experiment runs at once. Every
+run's "evaluation.csv" is loaded into one array of ratings keyed by the
+questionID of the gold labels, and accuracy, per-class f1 scores, confusion
+matrices and Cohen's kappa against the gold labels are computed for every
+run and criterion together, in a single pass over that array.
+
+This file is structured as follows:
+  Helper Functions:
+    - find_runs: Lists the runs given as directories or glob patterns.
+    - to_labels: Converts rating columns to integer labels.
+    - load_runs: Loads the gold labels and every run's ratings into arrays.
+    - confusion_matrices: Counts the confusion matrix of every run and
+                          criterion.
+    - score_runs: Computes every score from the confusion matrices.
+    - build_table: Lays the scores out as one comparison table.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python src/analysis/compare.py --help"
+  for a list of required parameters. Required parameters are:
+    - run_paths: Runs to compare. Each is a run directory (containing an
+                 evaluation.csv), a directory of run directories, or a glob
+                 pattern of either.
+
+  Example:
+    "python
+     src/analysis/compare.py
+     data/model_labels
+     --results-path data/model_labels/comparison.csv
+    "
+    Would compare every run under data/model_labels/ (GPT, Claude and
+    Llama 3) against the initial publication gold labels, print the table
+    and save it to "data/model_labels/comparison.csv".
+"""
+
+###############################################################################
+
+import typer
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+from typing import *
+
+###############################################################################
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def find_runs(run_paths: List[str]) -> Dict[str, str]:
+    """
+    Lists the runs to compare. A path (or glob match) is a run if it holds
+    an evaluation.csv; otherwise each of its subdirectories holding one is
+    a run. Runs are named by their path relative to the deepest directory
+    holding all of them, so runs of the same name in different directories
+    stay apart (e.g. "claude/run_1" and "gpt/run_1").
+
+    Args:
+        run_paths (List[str]): Run directories, directories of runs, or
+                               glob patterns of either.
+
+    Raises:
+        FileNotFoundError: If no run is found.
+        ValueError: If a run is given more than once.
+
+    Returns:
+        Dict[str, str]: Path to each run's evaluation.csv by run name.
+    """
+    run_dirs = []
+    for pattern in run_paths:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if os.path.isfile(os.path.join(path, "evaluation.csv")):
+                run_dirs.append(os.path.abspath(path))
+            elif os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    if os.path.isfile(os.path.join(path, name, "evaluation.csv")):
+                        run_dirs.append(os.path.abspath(os.path.join(path, name)))
+    if len(run_dirs) == 0:
+        raise FileNotFoundError(f"No evaluation.csv found in {run_paths}.")
+
+    # A run found twice would be scored (and named) twice
+    duplicates = sorted({path for path in run_dirs if run_dirs.count(path) > 1})
+    if len(duplicates) > 0:
+        raise ValueError(f"Runs given more than once: {duplicates}.")
+
+    root = os.path.commonpath([os.path.dirname(path) for path in run_dirs])
+    return {os.path.relpath(path, root).replace(os.sep, "/"): os.path.join(path, "evaluation.csv")
+            for path in run_dirs}
+
+def to_labels(df: pd.DataFrame,
+              columns: List[str]) -> np.ndarray:
+    """
+    Converts rating columns to integer labels. Missing and unreadable
+    ratings (and columns the dataframe doesn't have) become 0.
+
+    Args:
+        df (pd.DataFrame): Gold labels or evaluations.
+        columns (List[str]): Rating columns, one per criterion.
+
+    Returns:
+        np.ndarray: Labels, shape (questions, criteria).
+    """
+    labels = np.zeros((len(df), len(columns)), dtype=np.int64)
+    for c, col in enumerate(columns):
+        if col in df.columns:
+            values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+            labels[:, c] = np.where(np.isfinite(values) & (values > 0), values, 0)
+    return labels
+
+def load_runs(runs: Dict[str, str],
+              gold_path: str,
+              num_criteria: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Loads the gold labels and the ratings of every run, aligned on the
+    questionIDs of the gold labels. A run's ratings for questions it
+    doesn't have are missing.
+
+    Args:
+        runs (Dict[str, str]): Path to each run's evaluation.csv by name.
+        gold_path (str): Path to gold labels CSV.
+        num_criteria (int): Number of criteria.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Gold labels, shape (questions,
+                                       criteria), and ratings, shape
+                                       (runs, questions, criteria). 0 marks
+                                       a missing label.
+    """
+    gold_df = pd.read_csv(gold_path, dtype=str).drop_duplicates("questionID")
+    gold = to_labels(gold_df, [f"criteria {crit}" for crit in range(1, num_criteria + 1)])
+
+    ratings = np.zeros((len(runs), len(gold_df), num_criteria), dtype=np.int64)
+    for r, evaluation_path in enumerate(runs.values()):
+        df = pd.read_csv(evaluation_path, dtype=str).drop_duplicates("questionID")
+        df = df.set_index("questionID").reindex(gold_df["questionID"]).reset_index()
+        ratings[r] = to_labels(df, [f"auto {crit}" for crit in range(1, num_criteria + 1)])
+    return gold, ratings
+
+def confusion_matrices(gold: np.ndarray,
+                       ratings: np.ndarray) -> np.ndarray:
+    """
+    Counts the confusion matrix of every run and criterion at once, over the
+    questions with both a gold label and a rating.
+
+    Args:
+        gold (np.ndarray): Gold labels, shape (questions, criteria).
+        ratings (np.ndarray): Ratings, shape (runs, questions, criteria).
+
+    Returns:
+        np.ndarray: Counts, shape (runs, criteria, labels, labels), indexed
+                    [run, criterion, gold label - 1, rating - 1].
+    """
+    num_runs, _, num_criteria = ratings.shape
+    num_labels = int(max(gold.max(initial=0), ratings.max(initial=0)))
+
+    # One flat bin per (run, criterion, gold label, rating)
+    gold = np.broadcast_to(gold, ratings.shape)
+    valid = (gold > 0) & (ratings > 0)
+    run = np.broadcast_to(np.arange(num_runs)[:, None, None], ratings.shape)
+    crit = np.broadcast_to(np.arange(num_criteria)[None, None, :], ratings.shape)
+    bins = ((run * num_criteria + crit) * num_labels + gold - 1) * num_labels + ratings - 1
+
+    counts = np.bincount(bins[valid], minlength=num_runs * num_criteria * num_labels * num_labels)
+    return counts.reshape(num_runs, num_criteria, num_labels, num_labels)
+
+def score_runs(confusion: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Computes the scores of every run and criterion from their confusion
+    matrices. As in sklearn, per-class f1 scores are only defined for labels
+    that appear in the gold labels or the ratings, and undefined scores are
+    NaN.
+
+    Args:
+        confusion (np.ndarray): Counts from confusion_matrices.
+
+    Returns:
+        Dict[str, np.ndarray]: "n", "accuracy", "kappa" and "macro_f1",
+                               shape (runs, criteria), and "f1", shape
+                               (runs, criteria, labels).
+    """
+    confusion = confusion.astype(float)
+    n = confusion.sum(axis=(2, 3))
+    correct = np.trace(confusion, axis1=2, axis2=3)
+    gold_totals = confusion.sum(axis=3)
+    rating_totals = confusion.sum(axis=2)
+    true_positives = np.diagonal(confusion, axis1=2, axis2=3)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        accuracy = correct / n
+
+        # Cohen's kappa: agreement beyond what the marginals give by chance
+        expected = (gold_totals * rating_totals).sum(axis=2) / n ** 2
+        kappa = (accuracy - expected) / (1 - expected)
+
+        # f1 of a class is 2TP / (gold count + rating count)
+        support = gold_totals + rating_totals
+        defined = support > 0
+        f1 = np.where(defined, 2 * true_positives / support, np.nan)
+        macro_f1 = np.where(defined, f1, 0).sum(axis=2) / defined.sum(axis=2)
+
+    return {"n": n, "accuracy": accuracy, "kappa": kappa, "f1": f1, "macro_f1": macro_f1}
+
+def build_table(run_names: List[str],
+                scores: Dict[str, np.ndarray],
+                confusion: np.ndarray) -> pd.DataFrame:
+    """
+    Lays the scores out as one table with a row per run and criterion.
+
+    Args:
+        run_names (List[str]): Names of the runs, in array order.
+        scores (Dict[str, np.ndarray]): Scores from score_runs.
+        confusion (np.ndarray): Counts from confusion_matrices.
+
+    Returns:
+        pd.DataFrame: Comparison table. Confusion matrices are json lists
+                      of rows (gold labels) of counts per rating.
+    """
+    num_runs, num_criteria, num_labels, _ = confusion.shape
+    table = pd.DataFrame({
+        "run": np.repeat(run_names, num_criteria),
+        "criterion": np.tile(np.arange(1, num_criteria + 1), num_runs),
+        "n": scores["n"].reshape(-1).astype(int),
+        "accuracy": scores["accuracy"].reshape(-1),
+        "kappa": scores["kappa"].reshape(-1),
+        "macro_f1": scores["macro_f1"].reshape(-1),
+    })
+    for label in range(num_labels):
+        table[f"f1 {label + 1}"] = scores["f1"][:, :, label].reshape(-1)
+    table["confusion"] = [json.dumps(matrix.tolist()) for matrix in confusion.reshape(-1, num_labels, num_labels)]
+    return table
+
+###############################################################################
+
+#################
+# Main function #
+#################
+
+app = typer.Typer()
+
+@app.command()
+def main(run_paths: List[str],
+         gold_path: str = "./data/gold_labels/initial_publication_labels.csv",
+         num_criteria: int = 5,
+         results_path: Optional[str] = None
+         ) -> None:
+    """
+    Compares many runs against the gold labels: accuracy, Cohen's kappa,
+    per-class and macro f1 scores and confusion matrices for every run and
+    criterion, as one table.
+
+    USAGE:
+      From the mcq-eval/ directory, run
+        "python src/analysis/compare.py --help"
+      for a list of required parameters. Required parameters are:
+        - run_paths: Runs to compare (run directories, directories of runs,
+                     or glob patterns).
+
+      Example:
+        "python
+        src/analysis/compare.py
+        "data/model_labels/*"
+        --results-path data/model_labels/comparison.csv
+        "
+
+    Args:
+        run_paths (List[str]): Runs to compare.
+        gold_path (str, optional): Path to gold labels CSV. Defaults to
+                                   "./data/gold_labels/initial_publication_labels.csv".
+        num_criteria (int, optional): Number of criteria. Defaults to 5.
+        results_path (Optional[str], optional): Path to also save the table
+                                                as csv. Defaults to None.
+    """
+
+    # Load every run into one array and score them together
+    runs = find_runs(run_paths)
+    gold, ratings = load_runs(runs, gold_path, num_criteria)
+    confusion = confusion_matrices(gold, ratings)
+    table = build_table(list(runs), score_runs(confusion), confusion)
+
+    # Print the table, then save it
+    print(table.drop(columns="confusion").to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    if results_path is not None:
+        table.to_csv(results_path, index=False)
+
+if __name__ == "__main__":
+    app()
@@ -6,34 +6,60 @@ between raters for the initial publication labels.
 Interrater agreement is computed using Krippendorff's Alpha.
 Results are saved in "./data/gold_labels/interrater_agreement/scores.json".
 
+Alpha is computed from the coincidence matrix of each criterion's ratings,
+which handles any number of raters, items and label values, at the nominal
+or ordinal level of measurement. The coincidence matrix is a sum over items,
+so bootstrap resamples of the items are weighted sums of per-item matrices.
+
 This file is structured as follows:
   Helper Functions:
     - read_csv: Given a path, returns a 2D list of a CSV file's contents.
-    - get_ratings: Returns a dictionary of rater ratings.
+    - get_ratings: Returns each criterion's ratings as an items x raters
+                   table.
+    - add_model_ratings: Adds a model's ratings as an extra rater.
 
   Interrater Agreement Functions:
+    - value_counts: Counts each item's ratings of every label value.
+    - coincidence_matrix: Computes the coincidence matrix of ratings.
+    - distance_matrix: Squared distances between label values.
+    - alpha_from_coincidence: Computes alpha from coincidence matrices.
+    - bootstrap_alpha: Bootstrap confidence interval of alpha.
     - compute_krippendorff_alpha: Computes krippendorff's alpha across all
-                                  raters for each criterion. 
+                                  raters for each criterion.
     - main: Executes interrater agreement functions and compiles results into
             output file.
 
 USAGE:
-  From the mcq-eval/ directory, run 
-    "python src/analysis/interrater.py --help" 
+  From the mcq-eval/ directory, run
+    "python src/analysis/interrater.py --help"
   for a list of optional parameters.
   By default, rater ratings come from
     "./data/gold_labels/interrater_agreement/rater_ratings.csv"
   and results are stored in
     "./data/gold_labels/interrater_agreement/scores.json"
+
+  Example:
+    "python
+     src/analysis/interrater.py
+     --output-path data/temp/scores.json
+     --model-path data/model_labels/gpt-4-0613/evaluation.csv
+     --bootstrap 1000
+    "
+    Would also compute alpha with GPT's ratings as a fourth rater, with
+    95% bootstrap confidence intervals.
 """
 
 ###############################################################################
 
 import typer
 import numpy as np
+import pandas as pd
 import csv
-import krippendorff
 import json
+from typing import *
+
+# Levels of measurement supported by distance_matrix
+LEVELS = ("nominal", "ordinal")
 
 ###############################################################################
 
@@ -62,88 +88,264 @@ def read_csv(path: str) -> list:
     return result
 
 
-def get_ratings(ratings_path: str) -> dict:
+def get_ratings(ratings_path: str) -> Dict[str, pd.DataFrame]:
     """
-    Returns a dictionary of rater ratings given path to ratings CSV.
+    Returns each criterion's ratings given path to ratings CSV. Two layouts
+    are read:
+      - Side-by-side blocks, as in rater_ratings.csv: the first row names
+        the criterion above each block, the second row holds "questionID"
+        followed by the raters' names, for any number of criteria and
+        raters.
+      - One rating per row, with "questionID", "criterion", "rater" and
+        "rating" columns.
     Missing values are represented using np.nan.
 
     Args:
         ratings_path (str): Path to CSV file of rater ratings.
-    
+
     Returns:
-        dict: Dictionary of ratings in the following format:
-                {
-                    "criteria 1":
-                        {
-                        "rater 1": [#, #, #, #, ...],
-                        "rater 2": [#, #, #, #, ...],
-                        ...
-                        },
-                    "criteria 2":
-                        ...
-                }
-    """
-    # Read off raw data and initialize useful locals
+        Dict[str, pd.DataFrame]: Ratings of each criterion ("criteria k"),
+                                 indexed by questionID, one column per
+                                 rater.
+    """
+    # Read off raw data
     ratings_sheet = read_csv(ratings_path)
-    criteria = [1,2,3,4,5]
-    raters = [1,2,3]
-
-    # Initialize ratings dictionary
-    ratings = {f"criteria {i}": 
-                {f"rater {j}": [] for j in raters} 
-              for i in criteria}
-    
-    # Iterate through each row and add data to ratings dictionary
-    for row in ratings_sheet[2:]:
-        for crit in criteria:
-            for rater in raters:
-
-                # Compute index in row corresponding to criterion and rater
-                rating_index = 4*(crit-1) + rater
-
-                # Empty cells are represented by np.nan
-                rating = row[rating_index] if row[rating_index] != '' else np.nan
-                
-                # Add data to ratings dictionary
-                ratings[f"criteria {crit}"][f"rater {rater}"].append(rating)
-    
+    header = [cell.strip() for cell in ratings_sheet[0]]
+
+    # One rating per row
+    if {"questionID", "criterion", "rater", "rating"} <= set(header):
+        df = pd.DataFrame(ratings_sheet[1:], columns=header).replace('', np.nan)
+        df["criterion"] = [f"criteria {crit}" if crit.isdigit() else crit for crit in df["criterion"].str.strip()]
+        df = df.dropna(subset=["questionID", "rating"])
+        return {crit: crit_df.pivot_table(index="questionID", columns="rater", values="rating", aggfunc="first")
+                for crit, crit_df in df.groupby("criterion", sort=True)}
+
+    # Side-by-side blocks, each starting at a "questionID" column
+    names = [cell.strip() for cell in ratings_sheet[1]]
+    starts = [i for i, name in enumerate(names) if name == "questionID"]
+    ratings = {}
+    for start, end in zip(starts, starts[1:] + [len(names)]):
+        raters = [i for i in range(start + 1, end) if names[i] != '']
+        rows = [row for row in ratings_sheet[2:] if len(row) > start and row[start] != '']
+
+        # Empty cells are represented by np.nan
+        table = pd.DataFrame([[row[i] if i < len(row) and row[i] != '' else np.nan for i in raters] for row in rows],
+                             index=pd.Index([row[start] for row in rows], name="questionID"),
+                             columns=[names[i] for i in raters])
+        ratings[header[start].lower()] = table
+
     return ratings
 
+def add_model_ratings(ratings: Dict[str, pd.DataFrame],
+                      evaluation_path: str,
+                      rater: str = "model") -> Dict[str, pd.DataFrame]:
+    """
+    Adds a model's ratings (the "auto k" columns of a run's evaluation.csv)
+    to each criterion's ratings as an extra rater, matched on questionID.
+
+    Args:
+        ratings (Dict[str, pd.DataFrame]): Ratings from get_ratings.
+        evaluation_path (str): Path to the run's evaluations csv.
+        rater (str, optional): Name of the model's column. Defaults to
+                               "model".
+
+    Returns:
+        Dict[str, pd.DataFrame]: Ratings with the model's column added.
+    """
+    evaluations = pd.read_csv(evaluation_path, dtype=str).drop_duplicates("questionID").set_index("questionID")
+    with_model = {}
+    for crit, table in ratings.items():
+        column = f"auto {crit.split()[-1]}"
+        model_ratings = evaluations[column] if column in evaluations.columns else pd.Series(dtype=str)
+        with_model[crit] = table.assign(**{rater: model_ratings.reindex(table.index).to_numpy()})
+    return with_model
+
 ###############################################################################
 
 ##################################
 # INTERRATER AGREEMENT FUNCTIONS #
 ##################################
 
-def compute_krippendorff_alpha(ratings_path: str) -> dict:
+def value_counts(table: pd.DataFrame) -> Tuple[np.ndarray, List[str]]:
     """
-    Computes krippendorff's alpha across all raters for each criterion. 
+    Counts how many raters gave each item each label value.
 
     Args:
-        ratings_path (str): Path to CSV file of rater ratings.
+        table (pd.DataFrame): Ratings, one row per item and one column per
+                              rater.
 
     Returns:
-        dict: Dictionary mapping criteria to krppendorff's alpha.
+        Tuple[np.ndarray, List[str]]: Counts, shape (items, values), and
+                                      the label values in order (numeric
+                                      order if all are numbers).
+    """
+    values = pd.Series(table.to_numpy().reshape(-1)).dropna().astype(str).str.strip().unique().tolist()
+    try:
+        values.sort(key=float)
+    except ValueError:
+        values.sort()
+
+    # One bin per (item, value)
+    codes = table.apply(lambda column: column.astype("string").str.strip()
+                        .map({value: i for i, value in enumerate(values)})).to_numpy(dtype=float)
+    items = np.broadcast_to(np.arange(len(table))[:, None], codes.shape)
+    rated = ~np.isnan(codes)
+    counts = np.bincount(items[rated] * len(values) + codes[rated].astype(np.int64),
+                         minlength=len(table) * len(values))
+    return counts.reshape(len(table), len(values)).astype(float), values
+
+def coincidence_matrix(counts: np.ndarray) -> np.ndarray:
     """
-    # Fetch annotator ratings
-    full_ratings = get_ratings(ratings_path)
+    Computes the coincidence matrix of ratings: entry (c, k) counts the
+    pairs of ratings c and k given to the same item by different raters,
+    each item weighted by 1 / (its number of ratings - 1). Items with fewer
+    than two ratings are not pairable and don't count.
 
-    # Initialize results dictionary
-    results = {}
+    Args:
+        counts (np.ndarray): Ratings per item and value, shape (items,
+                             values).
 
-    # Iterate over each criterion to compute krippendorff's alpha
-    for crit in range(1, 6):
+    Returns:
+        np.ndarray: Coincidence matrix, shape (values, values).
+    """
+    ratings_per_item = counts.sum(axis=1)
+    weights = np.where(ratings_per_item >= 2, 1 / np.maximum(ratings_per_item - 1, 1), 0)
+    weighted = counts * weights[:, None]
+    return weighted.T @ counts - np.diag(weighted.sum(axis=0))
+
+def distance_matrix(marginals: np.ndarray,
+                    level: str = "nominal") -> np.ndarray:
+    """
+    Squared distances between label values. Nominal values are either the
+    same (0) or different (1). Ordinal distances grow with the number of
+    ratings between the two values.
 
-        # Build up 2D list where rows represent raters, columns are questions
-        ratings_formatted = []
-        for _, ratings in full_ratings[f"criteria {crit}"].items():
-            ratings_formatted.append(ratings)
-        
-        # Compute krippendorff's alpha and add to results dictionary
-        alpha = krippendorff.alpha(reliability_data=ratings_formatted, level_of_measurement="nominal")
-        results[f"criteria {crit}"] = alpha
+    Args:
+        marginals (np.ndarray): Number of pairable ratings of each value,
+                                shape (..., values).
+        level (str, optional): "nominal" or "ordinal". Defaults to
+                               "nominal".
 
-    return results
+    Raises:
+        ValueError: If level is unknown.
+
+    Returns:
+        np.ndarray: Squared distances, shape (..., values, values).
+    """
+    num_values = marginals.shape[-1]
+    if level == "nominal":
+        return np.broadcast_to(1 - np.eye(num_values), marginals.shape + (num_values,))
+    if level == "ordinal":
+        # Ratings of the values from c to k, minus half of those of c and k
+        low = np.minimum.outer(np.arange(num_values), np.arange(num_values))
+        high = np.maximum.outer(np.arange(num_values), np.arange(num_values))
+        cumulative = np.cumsum(marginals, axis=-1)
+        between = cumulative[..., high] - cumulative[..., low] + marginals[..., low]
+        ends = (marginals[..., :, None] + marginals[..., None, :]) / 2
+        return (between - ends) ** 2
+    raise ValueError(f"Unknown level of measurement '{level}'. Choose from {list(LEVELS)}.")
+
+def alpha_from_coincidence(coincidence: np.ndarray,
+                           level: str = "nominal") -> np.ndarray:
+    """
+    Computes Krippendorff's alpha, 1 - observed / expected disagreement,
+    from one or more coincidence matrices.
+
+    Args:
+        coincidence (np.ndarray): Coincidence matrices, shape (..., values,
+                                  values).
+        level (str, optional): "nominal" or "ordinal". Defaults to
+                               "nominal".
+
+    Returns:
+        np.ndarray: Alpha of each matrix (NaN if there is no expected
+                    disagreement, e.g. a single value was ever given).
+    """
+    marginals = coincidence.sum(axis=-1)
+    total = marginals.sum(axis=-1)
+    distances = distance_matrix(marginals, level)
+    observed = (coincidence * distances).sum(axis=(-2, -1))
+    expected = (marginals[..., :, None] * marginals[..., None, :] * distances).sum(axis=(-2, -1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 1 - (total - 1) * observed / expected
+
+def bootstrap_alpha(counts: np.ndarray,
+                    level: str = "nominal",
+                    resamples: int = 1000,
+                    confidence: float = 0.95,
+                    seed: int = 0) -> List[float]:
+    """
+    Percentile bootstrap confidence interval of alpha, resampling items.
+    Each resample's coincidence matrix is a weighted sum of the items'
+    shares, so resamples are computed as one matrix product per chunk.
+
+    Args:
+        counts (np.ndarray): Ratings per item and value, shape (items,
+                             values).
+        level (str, optional): "nominal" or "ordinal". Defaults to
+                               "nominal".
+        resamples (int, optional): Number of resamples. Defaults to 1000.
+        confidence (float, optional): Confidence level. Defaults to 0.95.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        List[float]: Lower and upper bound.
+    """
+    num_items, num_values = counts.shape
+
+    # Each item's share of the coincidence matrix, flattened
+    ratings_per_item = counts.sum(axis=1)
+    weights = np.where(ratings_per_item >= 2, 1 / np.maximum(ratings_per_item - 1, 1), 0)
+    shares = (counts[:, :, None] * counts[:, None, :] - counts[:, :, None] * np.eye(num_values)) * weights[:, None, None]
+    shares = shares.reshape(num_items, -1)
+
+    # Resamples as item multiplicities, in chunks of bounded size
+    rng = np.random.default_rng(seed)
+    chunk = max(1, min(resamples, 10_000_000 // max(num_items, 1)))
+    alphas = []
+    for start in range(0, resamples, chunk):
+        size = min(chunk, resamples - start)
+        multiplicities = rng.multinomial(num_items, np.full(num_items, 1 / num_items), size=size)
+        coincidence = (multiplicities @ shares).reshape(size, num_values, num_values)
+        alphas.append(alpha_from_coincidence(coincidence, level))
+
+    tail = (1 - confidence) / 2 * 100
+    return np.nanpercentile(np.concatenate(alphas), [tail, 100 - tail]).tolist()
+
+def compute_krippendorff_alpha(ratings: Dict[str, pd.DataFrame],
+                               level: str = "nominal",
+                               bootstrap: int = 0,
+                               confidence: float = 0.95,
+                               seed: int = 0) -> Tuple[dict, dict]:
+    """
+    Computes krippendorff's alpha across all raters for each criterion.
+
+    Args:
+        ratings (Dict[str, pd.DataFrame]): Ratings from get_ratings.
+        level (str, optional): "nominal" or "ordinal". Defaults to
+                               "nominal".
+        bootstrap (int, optional): Number of bootstrap resamples for
+                                   confidence intervals. Defaults to 0
+                                   (none).
+        confidence (float, optional): Confidence level. Defaults to 0.95.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        dict: Dictionary mapping criteria to krppendorff's alpha.
+        dict: Dictionary mapping criteria to confidence intervals (empty
+              without bootstrap).
+    """
+    # Initialize results dictionaries
+    results, intervals = {}, {}
+
+    # Iterate over each criterion to compute krippendorff's alpha
+    for crit, table in ratings.items():
+        counts, _ = value_counts(table)
+        results[crit] = float(alpha_from_coincidence(coincidence_matrix(counts), level))
+        if bootstrap > 0:
+            intervals[crit] = bootstrap_alpha(counts, level, bootstrap, confidence, seed)
+
+    return results, intervals
 
 ###############################################################################
 
@@ -152,30 +354,65 @@ def compute_krippendorff_alpha(ratings_path: str) -> dict:
 #################
 
 app = typer.Typer()
-    
+
 @app.command()
 def main(ratings_path: str = "./data/gold_labels/interrater_agreement/rater_ratings.csv",
-         output_path: str = "./data/gold_labels/interrater_agreement/scores.json") -> None:
+         output_path: str = "./data/gold_labels/interrater_agreement/scores.json",
+         level: str = "nominal",
+         model_path: Optional[str] = None,
+         bootstrap: int = 0,
+         confidence: float = 0.95,
+         seed: int = 0) -> None:
     """
     Executes interrater agreement functions using rater ratings at ratings_path
     and compiles results into output file at output_path.
 
     USAGE:
-    From the mcq-eval/ directory, run 
-        "python src/analysis/interrater.py --help" 
+    From the mcq-eval/ directory, run
+        "python src/analysis/interrater.py --help"
     for a list of optional parameters.
     By default, rater ratings come from
         "./data/gold_labels/interrater_agreement/rater_ratings.csv"
     and results are stored in
         "./data/gold_labels/interrater_agreement/scores.json"
+
+    Args:
+        ratings_path (str, optional): Path to CSV file of rater ratings.
+        output_path (str, optional): Path to save the results.
+        level (str, optional): Level of measurement of the ratings,
+                               "nominal" or "ordinal". Defaults to
+                               "nominal".
+        model_path (Optional[str], optional): Path to a run's
+                                              evaluation.csv, whose ratings
+                                              are added as an extra rater.
+                                              Defaults to None.
+        bootstrap (int, optional): Number of bootstrap resamples for
+                                   confidence intervals. Defaults to 0.
+        confidence (float, optional): Confidence level. Defaults to 0.95.
+        seed (int, optional): Random seed of the resampling. Defaults to 0.
     """
+    if level not in LEVELS:
+        raise ValueError(f"Unknown level of measurement '{level}'. Choose from {list(LEVELS)}.")
+
     # Compute krippendorff's alpha for each criterion
-    krippendorff_results = compute_krippendorff_alpha(ratings_path)
+    ratings = get_ratings(ratings_path)
+    krippendorff_results, krippendorff_intervals = compute_krippendorff_alpha(ratings, level, bootstrap,
+                                                                              confidence, seed)
+    results = {"krippendorff": krippendorff_results}
+    if bootstrap > 0:
+        results["krippendorff_ci"] = krippendorff_intervals
+
+    # Agreement with the model as one more rater
+    if model_path is not None:
+        model_results, model_intervals = compute_krippendorff_alpha(add_model_ratings(ratings, model_path),
+                                                                    level, bootstrap, confidence, seed)
+        results["krippendorff_with_model"] = model_results
+        if bootstrap > 0:
+            results["krippendorff_with_model_ci"] = model_intervals
 
     # Write results to output file
-    results = {"krippendorff": krippendorff_results}
     with open(output_path, 'w', encoding="utf-8") as outfile:
         json.dump(results, outfile, indent=4)
 
 if __name__ == "__main__":
-    app()
\ No newline at end of file
+    app()
@@ -20,15 +20,38 @@ USAGE:
     Would computethe accuracy and f1 scores of GPT's label predictions
     at "data/model_labels/gpt-4-0613/evaluation.csv " and store the results in
     "data/model_labels/gpt-4-0613/prediction_scores.json".
+
+  For a run in cascade mode, the results also compare the cascade with the
+  cheap model alone, and with the expensive model alone if its evaluations
+  are given with --baseline-path.
+
+  With --bootstrap N, every score also gets a bootstrap confidence interval
+  from N resamples of the questions, and with --compare-path, a paired
+  bootstrap test tells whether another run's scores (e.g. after a prompt
+  change) differ from this run's by more than resampling noise:
+    "python
+     src/analysis/predictions.py
+     data/temp/evaluation.csv
+     data/temp/prediction_scores.json
+     --bootstrap 10000
+     --compare-path data/model_labels/gpt-4-0613/evaluation.csv
+    "
 """
 
 ###############################################################################
 
 import typer
 import pandas as pd
+import numpy as np
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.metrics import f1_score
 from sklearn.metrics import accuracy_score
+from typing import *
+
+# Resamples drawn per chunk (and random stream) of the bootstrap
+BOOTSTRAP_CHUNK = 250
 
 ###############################################################################
 
@@ -80,6 +103,302 @@ def compute_scores(evaluation_path: str,
 
     return results
 
+def compute_cascade_scores(evaluation_path: str,
+                           num_criteria: int,
+                           baseline_path: Optional[str] = None) -> dict:
+    """
+    For a run in cascade mode (main.py --cascade-model), compares the
+    accuracy and f1 scores of the cascade's ratings with those of the cheap
+    model alone and, given the evaluations of a run of the experiment's
+    model alone (baseline_path), with those of that model. All scores of a
+    criterion are computed on the same questions, namely those the cheap
+    model rated readably.
+
+    Args:
+        evaluation_path (str): Path to evaluations csv file of the cascade
+                               run.
+        num_criteria (int): Number of criteria.
+        baseline_path (Optional[str], optional): Path to evaluations csv of
+                                                 the experiment's model run
+                                                 without a cascade. Defaults
+                                                 to None.
+
+    Returns:
+        dict: For every criterion evaluated with a cascade, the share of
+              escalated ratings and the scores of the cascade, the cheap
+              model and (if given) the baseline.
+    """
+
+    # Initialize dataframe from evaluation csv, joined with the baseline
+    df = pd.read_csv(evaluation_path)
+    if baseline_path is not None:
+        baseline = pd.read_csv(baseline_path).drop_duplicates("questionID")
+        baseline = baseline[["questionID"] + [f"auto {crit}" for crit in range(1, num_criteria + 1)
+                                              if f"auto {crit}" in baseline.columns]]
+        df = df.merge(baseline, on="questionID", how="left", suffixes=("", " baseline"))
+
+    results = {}
+    for crit in range(1, num_criteria + 1):
+        if f"cascade {crit}" not in df.columns:
+            continue
+
+        # Questions rated by the cascade with a gold label
+        columns = [f"criteria {crit}", f"auto {crit}", f"cheap {crit}", f"cascade {crit}"]
+        crit_df = df[columns].dropna()
+        gold = crit_df[f"criteria {crit}"]
+
+        results[f"criteria {crit}"] = {
+            "escalation_rate": float((crit_df[f"cascade {crit}"] == "escalated").mean()),
+            "cascade": {"accuracy": accuracy_score(gold, crit_df[f"auto {crit}"]),
+                        "f1": f1_score(gold, crit_df[f"auto {crit}"], average=None).tolist()},
+            "cheap": {"accuracy": accuracy_score(gold, crit_df[f"cheap {crit}"]),
+                      "f1": f1_score(gold, crit_df[f"cheap {crit}"], average=None).tolist()},
+        }
+
+        # The experiment's model alone, where the baseline rated the question
+        if f"auto {crit} baseline" in df.columns:
+            baseline_df = df.loc[crit_df.index, [f"criteria {crit}", f"auto {crit} baseline"]].dropna()
+            results[f"criteria {crit}"]["baseline"] = {
+                "accuracy": accuracy_score(baseline_df[f"criteria {crit}"], baseline_df[f"auto {crit} baseline"]),
+                "f1": f1_score(baseline_df[f"criteria {crit}"], baseline_df[f"auto {crit} baseline"],
+                               average=None).tolist()}
+    return results
+
+###############################################################################
+
+#######################
+# BOOTSTRAP FUNCTIONS #
+#######################
+
+def resampled_scores(gold: np.ndarray,
+                     predictions: np.ndarray,
+                     labels: np.ndarray,
+                     indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the accuracy and per-class f1 scores of one or more runs on
+    every resample of the questions at once. All runs are scored on the
+    same resamples, which pairs them.
+
+    Args:
+        gold (np.ndarray): Gold labels, shape (questions,).
+        predictions (np.ndarray): Predicted labels, shape (runs, questions).
+        labels (np.ndarray): Classes to compute f1 scores for.
+        indices (np.ndarray): Resampled question indices, shape
+                              (resamples, questions).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Accuracy, shape (runs, resamples),
+                                       and f1 scores, shape (runs,
+                                       resamples, labels). f1 is NaN for a
+                                       class absent from a resample.
+    """
+    gold_resampled = gold[indices] # (resamples, questions)
+    predicted = predictions[:, indices] # (runs, resamples, questions)
+    accuracy = (predicted == gold_resampled).mean(axis=2)
+
+    # Per class: 2TP / (gold count + predicted count)
+    is_gold = gold_resampled[..., None] == labels # (resamples, questions, labels)
+    is_predicted = predicted[..., None] == labels # (runs, resamples, questions, labels)
+    true_positives = (is_gold & is_predicted).sum(axis=2)
+    support = is_gold.sum(axis=1) + is_predicted.sum(axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        f1 = np.where(support > 0, 2 * true_positives / support, np.nan)
+    return accuracy, f1
+
+def _bootstrap_chunk(gold: np.ndarray,
+                     predictions: np.ndarray,
+                     labels: np.ndarray,
+                     resamples: int,
+                     seed: np.random.SeedSequence) -> Tuple[np.ndarray, np.ndarray]:
+    # One worker's share of the resamples, drawn as a single index matrix
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, len(gold), size=(resamples, len(gold)))
+    return resampled_scores(gold, predictions, labels, indices)
+
+def bootstrap_scores(gold: np.ndarray,
+                     predictions: np.ndarray,
+                     labels: np.ndarray,
+                     resamples: int,
+                     seed: int = 0,
+                     processes: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Scores one or more runs on `resamples` bootstrap resamples of the
+    questions. The resamples are split into chunks of BOOTSTRAP_CHUNK that
+    are drawn and scored in parallel processes. Each chunk has its own
+    random stream derived from seed, and the chunks don't depend on the
+    number of processes, so results only depend on seed and resamples.
+
+    Args:
+        gold (np.ndarray): Gold labels, shape (questions,).
+        predictions (np.ndarray): Predicted labels, shape (runs, questions).
+        labels (np.ndarray): Classes to compute f1 scores for.
+        resamples (int): Number of resamples.
+        seed (int, optional): Random seed. Defaults to 0.
+        processes (Optional[int], optional): Number of worker processes.
+                                             Defaults to None (one per CPU).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Accuracy, shape (runs, resamples),
+                                       and f1 scores, shape (runs,
+                                       resamples, labels).
+    """
+    # Small chunks keep the index matrices small and spread over the processes
+    processes = processes or os.cpu_count() or 1
+    sizes = [min(BOOTSTRAP_CHUNK, resamples - start) for start in range(0, resamples, BOOTSTRAP_CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    arguments = [(gold, predictions, labels, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+
+    if processes == 1:
+        results = [_bootstrap_chunk(*args) for args in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_bootstrap_chunk, *zip(*arguments)))
+    return (np.concatenate([accuracy for accuracy, _ in results], axis=1),
+            np.concatenate([f1 for _, f1 in results], axis=1))
+
+def criterion_labels(df: pd.DataFrame,
+                     crit: int,
+                     prediction_columns: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Gets a criterion's gold labels and the predictions of one or more
+    columns, on the questions where all of them are present, as compute_scores
+    does.
+
+    Args:
+        df (pd.DataFrame): Evaluations.
+        crit (int): Criterion.
+        prediction_columns (List[str]): Columns of predicted labels.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Gold labels, shape
+            (questions,), predictions, shape (columns, questions), and the
+            classes appearing in either (the classes sklearn reports f1
+            scores for).
+    """
+    crit_df = df[[f"criteria {crit}"] + prediction_columns].apply(pd.to_numeric, errors="coerce").dropna()
+    gold = crit_df[f"criteria {crit}"].to_numpy(dtype=float)
+    predictions = crit_df[prediction_columns].to_numpy(dtype=float).T
+    labels = np.union1d(gold, predictions.reshape(-1))
+    return gold, predictions, labels
+
+def interval(samples: np.ndarray,
+             confidence: float) -> List[float]:
+    """
+    Percentile interval of bootstrap samples, ignoring undefined ones.
+
+    Args:
+        samples (np.ndarray): Bootstrap samples of a score.
+        confidence (float): Confidence level, e.g. 0.95.
+
+    Returns:
+        List[float]: Lower and upper bound.
+    """
+    tail = (1 - confidence) / 2 * 100
+    return np.nanpercentile(samples, [tail, 100 - tail]).tolist()
+
+def compute_bootstrap_intervals(evaluation_path: str,
+                                num_criteria: int,
+                                resamples: int,
+                                confidence: float = 0.95,
+                                seed: int = 0,
+                                processes: Optional[int] = None) -> dict:
+    """
+    Computes percentile bootstrap confidence intervals of the accuracy and
+    f1 scores of compute_scores, resampling the questions of each criterion.
+
+    Args:
+        evaluation_path (str): Path to evaluations csv file.
+        num_criteria (int): Number of criteria.
+        resamples (int): Number of bootstrap resamples.
+        confidence (float, optional): Confidence level. Defaults to 0.95.
+        seed (int, optional): Random seed. Defaults to 0.
+        processes (Optional[int], optional): Number of worker processes.
+                                             Defaults to None (one per CPU).
+
+    Returns:
+        dict: "accuracy_ci" and "f1_ci" (one interval per class, in the
+              order of compute_scores' f1) for every criterion.
+    """
+    df = pd.read_csv(evaluation_path)
+    results = {}
+    for crit in range(1, num_criteria + 1):
+        gold, predictions, labels = criterion_labels(df, crit, [f"auto {crit}"])
+        accuracy, f1 = bootstrap_scores(gold, predictions, labels, resamples, seed, processes)
+        results[f"criteria {crit}"] = {
+            "accuracy_ci": interval(accuracy[0], confidence),
+            "f1_ci": [interval(f1[0, :, label], confidence) for label in range(len(labels))],
+        }
+    return results
+
+def compute_paired_tests(evaluation_path: str,
+                         compare_path: str,
+                         num_criteria: int,
+                         resamples: int,
+                         confidence: float = 0.95,
+                         seed: int = 0,
+                         processes: Optional[int] = None) -> dict:
+    """
+    Paired bootstrap test of the difference in accuracy and macro f1 score
+    between two runs (compare_path minus evaluation_path). Both runs are
+    scored on the same resamples of the questions both of them rated. The
+    two-sided p-value is twice the share of resampled differences on the
+    other side of zero than the observed one.
+
+    Args:
+        evaluation_path (str): Path to evaluations csv file.
+        compare_path (str): Path to evaluations csv file of the other run.
+        num_criteria (int): Number of criteria.
+        resamples (int): Number of bootstrap resamples.
+        confidence (float, optional): Confidence level of the difference's
+                                      interval. Defaults to 0.95.
+        seed (int, optional): Random seed. Defaults to 0.
+        processes (Optional[int], optional): Number of worker processes.
+                                             Defaults to None (one per CPU).
+
+    Returns:
+        dict: For every criterion, the number of questions and for accuracy
+              and macro f1 the two runs' scores, their difference, its
+              interval and p-value.
+    """
+    # Join the other run's ratings on questionID
+    df = pd.read_csv(evaluation_path)
+    other = pd.read_csv(compare_path).drop_duplicates("questionID")
+    other = other[["questionID"] + [f"auto {crit}" for crit in range(1, num_criteria + 1)
+                                    if f"auto {crit}" in other.columns]]
+    df = df.merge(other, on="questionID", how="left", suffixes=("", " other"))
+
+    results = {}
+    for crit in range(1, num_criteria + 1):
+        if f"auto {crit} other" not in df.columns:
+            continue
+        gold, predictions, labels = criterion_labels(df, crit, [f"auto {crit}", f"auto {crit} other"])
+        if len(gold) == 0:
+            continue
+
+        # Observed scores (the identity resample) and bootstrap samples
+        observed_accuracy, observed_f1 = resampled_scores(gold, predictions, labels, np.arange(len(gold))[None, :])
+        accuracy, f1 = bootstrap_scores(gold, predictions, labels, resamples, seed, processes)
+        with np.errstate(invalid="ignore"):
+            scores = {"accuracy": (observed_accuracy[:, 0], accuracy),
+                      "macro_f1": (np.nanmean(observed_f1[:, 0], axis=1), np.nanmean(f1, axis=2))}
+
+        results[f"criteria {crit}"] = {"n": int(len(gold))}
+        for name, (observed, samples) in scores.items():
+            difference = observed[1] - observed[0]
+            differences = samples[1] - samples[0]
+            if difference >= 0:
+                p_value = 2 * np.mean(differences <= 0)
+            else:
+                p_value = 2 * np.mean(differences >= 0)
+            results[f"criteria {crit}"][name] = {
+                "run": float(observed[0]),
+                "compare": float(observed[1]),
+                "difference": float(difference),
+                "difference_ci": interval(differences, confidence),
+                "p_value": float(min(1.0, p_value)),
+            }
+    return results
+
 ###############################################################################
 
 #################
@@ -91,7 +410,13 @@ app = typer.Typer()
 @app.command()
 def main(evaluation_path: str,
          results_path: str,
-         num_criteria: int = 5
+         num_criteria: int = 5,
+         baseline_path: Optional[str] = None,
+         bootstrap: int = 0,
+         confidence: float = 0.95,
+         compare_path: Optional[str] = None,
+         seed: int = 0,
+         processes: Optional[int] = None
          ) -> None:
     """
     Given prediction labels at evaluation_path, computes accuracy scores and
@@ -118,11 +443,48 @@ def main(evaluation_path: str,
         evaluation_path (str): Path to evaluations csv file.
         results_path (str): Path to save the accuracy and f1 scores.
         num_criteria (int, optional): Number of criteria
+        baseline_path (Optional[str], optional): For a cascade run, path to
+                                                 the evaluations csv of the
+                                                 expensive model run alone,
+                                                 to compare against.
+        bootstrap (int, optional): Number of bootstrap resamples for
+                                   confidence intervals and paired tests.
+                                   Defaults to 0 (none).
+        confidence (float, optional): Confidence level of the intervals.
+                                      Defaults to 0.95.
+        compare_path (Optional[str], optional): Path to the evaluations csv
+                                                of another run to test
+                                                against (needs bootstrap).
+                                                Defaults to None.
+        seed (int, optional): Random seed of the resampling. Defaults to 0.
+        processes (Optional[int], optional): Number of processes to resample
+                                             in. Defaults to None (one per
+                                             CPU).
+
+    Raises:
+        ValueError: If compare_path is given without bootstrap resamples.
     """
+    if compare_path is not None and bootstrap <= 0:
+        raise ValueError("--compare-path needs --bootstrap resamples.")
     
     # Calculate accuracy score and f1 scores
     results = compute_scores(evaluation_path, num_criteria)
 
+    # Compare a cascade with its models alone
+    cascade_results = compute_cascade_scores(evaluation_path, num_criteria, baseline_path)
+    if cascade_results:
+        results["cascade"] = cascade_results
+
+    # Bootstrap confidence intervals, and a paired test against another run
+    if bootstrap > 0:
+        intervals = compute_bootstrap_intervals(evaluation_path, num_criteria, bootstrap,
+                                                confidence, seed, processes)
+        for crit, crit_intervals in intervals.items():
+            results[crit].update(crit_intervals)
+    if compare_path is not None:
+        results["paired"] = compute_paired_tests(evaluation_path, compare_path, num_criteria,
+                                                 bootstrap, confidence, seed, processes)
+
     # Save the results
     with open(results_path, 'w', encoding="utf-8") as outfile:
         json.dump(results, outfile, indent=4)
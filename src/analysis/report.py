@@ -0,0 +1,233 @@
+"""
+report.py
+
+This file implements the run report, which summarizes the per-request
+metrics recorded by main.py in "output_path/metrics.jsonl": latency
+percentiles, throughput, token usage, retries, rate-limit waits and cost,
+per criterion and for the whole run. Requests spent re-asking for a rating
+the model didn't give in a readable form are counted separately, with
+their share of requests and their cost.
+
+This file is structured as follows:
+  Helper Functions:
+    - load_metrics: Reads a metrics file into a dataframe.
+    - request_costs: Computes the cost of every request from a price list.
+    - summarize: Aggregates the metrics of a group of requests.
+    - build_report: Summarizes a run per criterion and overall.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python src/analysis/report.py --help"
+  for a list of required parameters. Required parameters are:
+    - metrics_path: Path to the run's metrics.jsonl.
+
+  Example:
+    "python
+     src/analysis/report.py
+     data/temp/metrics.jsonl
+     --prices-path config/prices.yaml
+     --results-path data/temp/report.json
+    "
+    Would print the report of the run in data/temp, with costs from
+    config/prices.yaml, and save it to data/temp/report.json.
+"""
+
+###############################################################################
+
+import typer
+import json
+import yaml
+import numpy as np
+import pandas as pd
+from typing import *
+
+###############################################################################
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def load_metrics(metrics_path: str) -> pd.DataFrame:
+    """
+    Reads a metrics file, skipping incomplete lines from interrupted runs.
+    A file without requests (e.g. of a dry run, a run answered from the
+    response cache or one decided by the pre-filters) gives an empty
+    dataframe with the same columns.
+
+    Args:
+        metrics_path (str): Path to metrics.jsonl.
+
+    Returns:
+        pd.DataFrame: One row per request.
+    """
+    records = []
+    with open(metrics_path, 'r', encoding="utf-8") as metrics_file:
+        for line in metrics_file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    df = pd.DataFrame.from_records(records, columns=None if records else ["time", "latency", "cached_response"])
+
+    # Columns only some backends report
+    for col in ["input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens",
+                "retries", "rate_limit_wait"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0) if col in df.columns else 0.0
+    for col in ["criterion", "model_name"]:
+        df[col] = df[col].fillna("none").astype(str) if col in df.columns else "none"
+    df["cached_response"] = df["cached_response"].fillna(False).astype(bool)
+
+    # Requests made because an earlier reply had no valid rating: later
+    # conversations of a pair (attempt > 1) and re-asked principle turns
+    attempt = pd.to_numeric(df["attempt"], errors="coerce").fillna(1) if "attempt" in df.columns else 1
+    reask = df["reask"].notna() if "reask" in df.columns else False
+    df["rating_retry"] = (attempt > 1) | reask
+    return df
+
+def request_costs(df: pd.DataFrame,
+                  prices: Dict[str, dict]) -> np.ndarray:
+    """
+    Computes the cost of every request from per-million-token prices by
+    model name (see config/prices.yaml). Requests served from the response
+    cache and models without a price cost nothing.
+
+    Args:
+        df (pd.DataFrame): Metrics from load_metrics.
+        prices (Dict[str, dict]): Prices by model name.
+
+    Returns:
+        np.ndarray: Cost of each request.
+    """
+    costs = np.zeros(len(df))
+    for model_name, price in prices.items():
+        rows = ((df["model_name"] == model_name) & ~df["cached_response"]).to_numpy()
+
+        # (input_tokens don't include cache reads or writes, see Completion)
+        cost = (df["input_tokens"].to_numpy(dtype=float) * price.get("input", 0) +
+                df["output_tokens"].to_numpy(dtype=float) * price.get("output", 0) +
+                df["cache_read_tokens"].to_numpy(dtype=float) * price.get("cache_read", price.get("input", 0)) +
+                df["cache_write_tokens"].to_numpy(dtype=float) * price.get("cache_write", price.get("input", 0))) / 1e6
+        costs[rows] = cost[rows]
+    return costs
+
+def summarize(group: pd.DataFrame) -> dict:
+    """
+    Aggregates the metrics of a group of requests. Latency percentiles only
+    cover requests that reached the model (not the response cache).
+
+    Args:
+        group (pd.DataFrame): Metrics of the requests.
+
+    Returns:
+        dict: Summary of the group.
+    """
+    latency = group.loc[~group["cached_response"], "latency"].to_numpy(dtype=float)
+    p50, p95, p99 = np.percentile(latency, [50, 95, 99]) if len(latency) else (None, None, None)
+    return {
+        "requests": int(len(group)),
+        "cached_responses": int(group["cached_response"].sum()),
+        "latency_p50": p50,
+        "latency_p95": p95,
+        "latency_p99": p99,
+        "latency_total": float(latency.sum()),
+        "retries": int(group["retries"].sum()),
+        "rate_limit_wait": float(group["rate_limit_wait"].sum()),
+        "input_tokens": int(group["input_tokens"].sum()),
+        "output_tokens": int(group["output_tokens"].sum()),
+        "cache_read_tokens": int(group["cache_read_tokens"].sum()),
+        "cost": float(group["cost"].sum()),
+        "rating_retries": int(group["rating_retry"].sum()),
+        "rating_retry_share": float(group["rating_retry"].mean()) if len(group) else None,
+        "rating_retry_cost": float(group.loc[group["rating_retry"], "cost"].sum()),
+    }
+
+def build_report(df: pd.DataFrame) -> dict:
+    """
+    Summarizes a run per criterion and overall, including throughput over
+    the run's wall-clock span.
+
+    Args:
+        df (pd.DataFrame): Metrics with a "cost" column.
+
+    Returns:
+        dict: {"overall": {...}, "criteria": {criterion: {...}}}
+    """
+    overall = summarize(df)
+
+    # Wall-clock span from the first request's start to the last one's end
+    span = float(df["time"].max() - (df["time"] - df["latency"]).min()) if len(df) else 0.0
+    overall["wall_seconds"] = span
+    overall["requests_per_minute"] = overall["requests"] / span * 60 if span > 0 else None
+    overall["tokens_per_minute"] = ((overall["input_tokens"] + overall["output_tokens"]) / span * 60
+                                    if span > 0 else None)
+
+    criteria = {str(crit): summarize(group) for crit, group in df.groupby("criterion", sort=True)}
+    return {"overall": overall, "criteria": criteria}
+
+###############################################################################
+
+#################
+# Main function #
+#################
+
+app = typer.Typer()
+
+@app.command()
+def main(metrics_path: str,
+         prices_path: Optional[str] = None,
+         results_path: Optional[str] = None
+         ) -> None:
+    """
+    Prints a summary of the metrics of a run: latency percentiles (p50,
+    p95, p99), throughput, token usage, retries, rate-limit waits, cost and
+    rating retries, per criterion and overall.
+
+    USAGE:
+      From the mcq-eval/ directory, run
+        "python src/analysis/report.py --help"
+      for a list of required parameters. Required parameters are:
+        - metrics_path: Path to the run's metrics.jsonl.
+
+      Example:
+        "python
+        src/analysis/report.py
+        data/temp/metrics.jsonl
+        --prices-path config/prices.yaml
+        "
+
+    Args:
+        metrics_path (str): Path to the metrics.jsonl of a run.
+        prices_path (Optional[str], optional): Path to a yaml of prices per
+                                               million tokens by model name.
+                                               Defaults to None (no costs).
+        results_path (Optional[str], optional): Path to also save the report
+                                                as json. Defaults to None.
+    """
+
+    # Load metrics and price every request
+    df = load_metrics(metrics_path)
+    prices = {}
+    if prices_path is not None:
+        with open(prices_path, 'r') as file:
+            prices = yaml.safe_load(file) or {}
+    df["cost"] = request_costs(df, prices)
+
+    # Summarize
+    report = build_report(df)
+    table = pd.DataFrame.from_dict({**report["criteria"], "overall": report["overall"]}, orient="index")
+    columns = ["requests", "cached_responses", "latency_p50", "latency_p95", "latency_p99",
+               "retries", "rate_limit_wait", "input_tokens", "output_tokens", "cost",
+               "rating_retries", "rating_retry_share", "rating_retry_cost"]
+    print(table[columns].to_string(float_format=lambda value: f"{value:.3f}"))
+    overall = report["overall"]
+    if overall["requests_per_minute"] is not None:
+        print(f"\nThroughput: {overall['requests_per_minute']:.1f} requests/min, "
+              f"{overall['tokens_per_minute']:.0f} tokens/min over {overall['wall_seconds']:.1f} s.")
+
+    # Save the report
+    if results_path is not None:
+        with open(results_path, 'w', encoding="utf-8") as outfile:
+            json.dump(report, outfile, indent=4)
+
+if __name__ == "__main__":
+    app()
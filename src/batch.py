@@ -0,0 +1,223 @@
+"""
+batch.py
+
+This file implements batch mode (main.py --batch), which runs an experiment
+through a provider's asynchronous batch API instead of one synchronous
+request per message. It produces the same "evaluation.csv", journal and
+"responses/criteria_*/" logs as utils.run_model.
+
+A two-turn evaluation is split into two stages of batch jobs:
+  - Question batches: the first user prompt (question_k.txt with the mcq)
+                      of every planned question-criterion pair.
+  - Principle batches: the principle prompt (principle_k.txt), sent with
+                       the reasoning returned by the question batches.
+A stage is submitted as several jobs when it exceeds the provider's limits
+on the requests or bytes of one job (see Model.split_batch).
+
+Batch ids and intermediate reasoning are kept in
+"output_path/batch_state.json" so that an interrupted run picks up polling
+the submitted jobs instead of submitting (and paying for) them again.
+Pairs whose requests fail are left unevaluated for a later run.
+
+The model class must implement batch_entry, submit_batch and poll_batch
+(see models/model_abstract.py). GPT and Claude do.
+
+The following functions are implemented:
+  - run_batch: Performs an experiment in batch mode.
+  - submit_batches: Submits the jobs of a stage that weren't yet.
+  - wait_for_batches: Polls submitted batches until they have all ended.
+"""
+
+###############################################################################
+
+import os
+import time
+import utils
+from mcq_sources import open_mcq_source
+from models.model_abstract import Model
+from typing import *
+
+# Name of the file tracking an in-progress batch run
+STATE_FILE = "batch_state.json"
+
+def run_batch(Model_Class: Type[Model],
+              mcq_path: str,
+              out_directory: str,
+              gold_path: str,
+              criteria_string: str,
+              force_eval: bool,
+              poll_seconds: float = 60,
+              shard: Optional[Tuple[int, int]] = None) -> None:
+    """
+    Batch-mode counterpart of utils.run_model. Plans the pending
+    question-criterion pairs exactly like run_model, submits them as
+    question batches followed by principle batches, and joins the ratings
+    back into the experiment output.
+
+    Args:
+        Model_Class (Type[Model]): Constructor for model to use for experiment.
+        mcq_path (str): Path to the mcqs (directory, .jsonl file or SQLite
+                        database).
+        out_directory (str): Path to directory to store results from experiment.
+        gold_path (str): Path to gold labels CSV.
+        criteria_string (str): String to decide what criteria to evaluate.
+        force_eval (bool): When True, evaluate pairs without a gold label too.
+        poll_seconds (float, optional): Seconds between status checks of a
+                                        submitted batch. Defaults to 60.
+        shard (Optional[Tuple[int, int]], optional): (i, n) to only evaluate
+                                                     shard i of n. Defaults
+                                                     to None.
+
+    Side Effects:
+        Same outputs as utils.run_model, plus "out_directory/batch_state.json"
+        while a batch run is in progress.
+    """
+
+    # Parse criteria string to generate list of criteria to evaluate
+    criteria = sorted(list({c for c in criteria_string if c.isdigit()}))
+    if len(criteria) == 0:
+        return
+    bundles = utils.load_criterion_bundles(criteria)
+    df = utils.load_evaluations(out_directory, gold_path, criteria)
+    source = open_mcq_source(mcq_path)
+
+    # Resume an interrupted batch run, or plan a new one
+    os.makedirs(out_directory, exist_ok=True)
+    state_path = os.path.join(out_directory, STATE_FILE)
+    if os.path.isfile(state_path):
+        state = utils.read_json(state_path)
+        print(f"Resuming batch run from {state_path}.")
+        if "batch_id" in state: # (State of a run that submitted a single job per stage)
+            batch_id = state.pop("batch_id")
+            state["batch_ids"] = [] if batch_id is None else [batch_id]
+    else:
+        tasks = utils.plan_tasks(df, source.ids(), criteria, force_eval, shard)
+        if len(tasks) == 0:
+            print("Nothing to evaluate.")
+            source.close()
+            return
+        state = {"tasks": tasks, "stage": "question", "batch_ids": [], "reasoning": {}}
+    tasks = {f"task-{i}": (questionID, crit) for i, (questionID, crit) in enumerate(state["tasks"])}
+    requests_of = {}
+    for custom_id, (questionID, _) in tasks.items():
+        requests_of.setdefault(questionID, []).append(custom_id)
+
+    # Question prompts are rebuilt from the mcq source for both stages,
+    # streaming each mcq once for all of its criteria
+    prompts = {}
+    for questionID, mcq in source.iter_mcqs(requests_of):
+        for custom_id in requests_of[questionID]:
+            prompts[custom_id] = bundles[tasks[custom_id][1]].render_question(mcq)
+    source.close()
+
+    def first_turn(custom_id: str) -> list:
+        return [{"role": "user", "content": prompts[custom_id]}]
+
+    # Stage 1: reasoning about every question
+    if state["stage"] == "question":
+        requests = [(custom_id, bundles[crit].system, first_turn(custom_id))
+                    for custom_id, (_, crit) in tasks.items()]
+        submit_batches(Model_Class, requests, state, state_path)
+
+        results = wait_for_batches(Model_Class, state["batch_ids"], poll_seconds)
+        state["reasoning"] = {custom_id: response for custom_id, response in results.items()
+                              if custom_id in tasks and response is not None}
+        state["stage"], state["batch_ids"] = "principle", []
+        utils.write_json(state_path, state)
+
+    # Stage 2: criterion rating for every question the model reasoned about
+    def conversation(custom_id: str) -> list:
+        crit = tasks[custom_id][1]
+        return first_turn(custom_id) + [
+            {"role": "assistant", "content": state["reasoning"][custom_id]},
+            {"role": "user", "content": bundles[crit].principle}]
+
+    requests = [(custom_id, bundles[tasks[custom_id][1]].system, conversation(custom_id))
+                for custom_id in state["reasoning"]]
+    if len(requests) == 0:
+        print("No question requests succeeded. Nothing to rate.")
+        os.remove(state_path)
+        return
+    submit_batches(Model_Class, requests, state, state_path)
+
+    results = wait_for_batches(Model_Class, state["batch_ids"], poll_seconds)
+
+    # Join ratings back into the experiment output
+    rows_of = utils.question_rows(df)
+
+    recorded = 0
+    with open(os.path.join(out_directory, "journal.jsonl"), 'a', encoding="utf-8") as journal_file:
+        for custom_id in state["reasoning"]:
+            response = results.get(custom_id)
+            questionID, crit = tasks[custom_id]
+            rating = utils.parse_rating(response, bundles[crit].labels)
+            if rating == "":
+                continue
+
+            # Full message log, in the same form utils.eval produces
+            model_output = ([{"role": "system", "content": bundles[crit].system}] +
+                            conversation(custom_id) +
+                            [{"role": "assistant", "content": response}])
+            utils.write_response_log(out_directory, crit, questionID, model_output)
+
+            utils.append_journal(journal_file, questionID, {f"auto {crit}": rating})
+            utils.write_values(df, rows_of[questionID], {f"auto {crit}": rating})
+            recorded += 1
+
+    utils.write_csv_atomic(df, os.path.join(out_directory, "evaluation.csv"))
+    os.remove(state_path)
+    print(f"Recorded {recorded} of {len(tasks)} planned evaluations.")
+
+def submit_batches(Model_Class: Type[Model],
+                   requests: List[Tuple[str, str, list]],
+                   state: dict,
+                   state_path: str) -> None:
+    """
+    Submits the requests of the current stage as the jobs split_batch
+    divides them into. Each batch id is saved to the state as soon as its
+    job is submitted, so a resumed run only submits the jobs that weren't.
+
+    Args:
+        Model_Class (Type[Model]): Model class to submit the batches with.
+        requests (List[Tuple[str, str, list]]): (custom_id, system prompt,
+                                                messages) of every request
+                                                of the stage.
+        state (dict): Batch run state, updated in place.
+        state_path (str): Path the state is saved to.
+    """
+    jobs = Model_Class.split_batch(requests)
+    for job in jobs[len(state["batch_ids"]):]:
+        state["batch_ids"].append(Model_Class.submit_batch(job))
+        utils.write_json(state_path, state)
+        print(f"Submitted {state['stage']} batch {state['batch_ids'][-1]} with {len(job)} requests "
+              f"({len(state['batch_ids'])} of {len(jobs)}).")
+
+def wait_for_batches(Model_Class: Type[Model],
+                     batch_ids: List[str],
+                     poll_seconds: float) -> Dict[str, Optional[str]]:
+    """
+    Polls submitted batches every poll_seconds until they have all ended.
+
+    Args:
+        Model_Class (Type[Model]): Model class that submitted the batches.
+        batch_ids (List[str]): IDs of the batches.
+        poll_seconds (float): Seconds between status checks.
+
+    Returns:
+        Dict[str, Optional[str]]: Response of every request of every batch
+                                  by custom_id (None for requests that did
+                                  not succeed).
+    """
+    print(f"Waiting for {len(batch_ids)} batches...")
+    start = time.time()
+    results, pending = {}, list(batch_ids)
+    while True:
+        for batch_id in list(pending):
+            batch_results = Model_Class.poll_batch(batch_id)
+            if batch_results is not None:
+                print(f"Batch {batch_id} ended after {(time.time() - start) / 60:.1f} minutes.")
+                results.update(batch_results)
+                pending.remove(batch_id)
+        if len(pending) == 0:
+            return results
+        time.sleep(poll_seconds)
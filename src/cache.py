@@ -0,0 +1,182 @@
+"""
+cache.py
+
+This file implements the on-disk response cache that sits in front of
+Model.get_response. A response is stored under a hash of everything that
+determines it: the model class, the model parameters from
+config/model_params/*.yaml, the system prompt and the full message history.
+Re-running an experiment (for example into a new output directory, or after
+editing one criterion's prompts) then only queries the model for
+conversations whose inputs actually changed.
+
+The cache is a single SQLite file and is safe to share between the worker
+threads of a run. Entries can be bounded by count and by age; the least
+recently used entries are evicted first.
+
+USAGE:
+  Enable it for a run with
+    "python src/main.py models.model_gpt data/temp --cache data/cache.sqlite"
+"""
+
+###############################################################################
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import *
+
+class ResponseCache:
+    """
+    SQLite-backed, content-addressed cache of model responses.
+    """
+
+    # Evict at most once every this many inserts
+    EVICT_EVERY = 100
+
+    def __init__(self,
+                 path: str,
+                 max_entries: Optional[int] = None,
+                 max_age_days: Optional[float] = None) -> None:
+        """
+        Opens (creating if needed) the cache at path.
+
+        Args:
+            path (str): Path to the SQLite cache file.
+            max_entries (Optional[int], optional): Maximum number of stored
+                                                   responses. Defaults to
+                                                   None (unbounded).
+            max_age_days (Optional[float], optional): Responses older than
+                                                      this are treated as
+                                                      missing and evicted.
+                                                      Defaults to None.
+        """
+        self._max_entries = max_entries
+        self._max_age = None if max_age_days is None else max_age_days * 24 * 60 * 60
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "  key TEXT PRIMARY KEY,"
+            "  response TEXT NOT NULL,"
+            "  created REAL NOT NULL,"
+            "  last_used REAL NOT NULL)")
+        self._connection.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self._inserts = 0
+
+    @staticmethod
+    def make_key(model_name: str,
+                 model_params: Any,
+                 system_prompt: str,
+                 messages: list) -> str:
+        """
+        Computes the cache key of a request.
+
+        Args:
+            model_name (str): Name identifying the backend, e.g. the Model
+                              subclass name.
+            model_params (Any): Model parameters (model, temperature, ...).
+            system_prompt (str): System prompt of the conversation.
+            messages (list): Message history, ending with the new user
+                             message.
+
+        Returns:
+            str: Hex digest identifying the request.
+        """
+        payload = json.dumps([model_name, model_params, system_prompt, messages],
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Looks up a response and counts the hit or miss.
+
+        Args:
+            key (str): Key from make_key.
+
+        Returns:
+            Optional[str]: Cached response, or None if absent or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self._max_age is not None and now - row[1] > self._max_age):
+                self.misses += 1
+                return None
+
+            self._connection.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str,
+            response: str) -> None:
+        """
+        Stores a response, evicting old entries every EVICT_EVERY inserts.
+
+        Args:
+            key (str): Key from make_key.
+            response (str): Model's response to cache.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, last_used) "
+                "VALUES (?, ?, ?, ?)", (key, response, now, now))
+            self._connection.commit()
+
+            self._inserts += 1
+            if self._inserts % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    def evict(self) -> None:
+        """
+        Removes expired entries and, if the cache holds more than
+        max_entries responses, the least recently used ones.
+        """
+        with self._lock:
+            self._evict(time.time())
+
+    def _evict(self, now: float) -> None:
+        """
+        Eviction without taking the lock. See evict.
+
+        Args:
+            now (float): Current time in seconds since the epoch.
+        """
+        if self._max_age is not None:
+            self._connection.execute(
+                "DELETE FROM responses WHERE created < ?", (now - self._max_age,))
+        if self._max_entries is not None:
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "  SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,))
+        self._connection.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the hit and miss counters and the number of stored entries.
+
+        Returns:
+            Dict[str, int]: {"hits": #, "misses": #, "entries": #}
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self) -> None:
+        """
+        Applies eviction one last time and closes the cache file.
+        """
+        self.evict()
+        with self._lock:
+            self._connection.close()
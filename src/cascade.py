@@ -0,0 +1,85 @@
+"""
+cascade.py
+
+This file implements the rules of cascade mode (main.py --cascade-model),
+in which a cheap model rates every question-criterion pair first and the
+experiment's model only evaluates the pairs the cheap model is unsure
+about or flags as a problem.
+
+Rules are configured per criterion in config/cascade.yaml:
+  - accept: Ratings of the cheap model that are kept as they are (usually
+            the "no problem" ratings). Any other rating is escalated.
+  - min_confidence: Lowest confidence (0 to 1, as reported by the cheap
+                    model) at which an accepted rating is kept. Optional.
+Criteria without a rule skip the cheap model and go straight to the
+experiment's model.
+
+The following are implemented:
+  - CascadeRule: The rule of one criterion.
+  - load_cascade_rules: Reads the rules from a yaml file.
+  - should_escalate: Decides whether a cheap rating is escalated.
+"""
+
+###############################################################################
+
+import yaml
+from typing import *
+
+class CascadeRule(NamedTuple):
+    """
+    When to keep the cheap model's rating for a criterion.
+    """
+    accept: FrozenSet[str]
+    min_confidence: Optional[float] = None
+
+def load_cascade_rules(path: str = "./config/cascade.yaml") -> Dict[str, CascadeRule]:
+    """
+    Reads the cascade rules of every configured criterion.
+
+    Args:
+        path (str, optional): Path to the rules yaml. Defaults to
+                              "./config/cascade.yaml".
+
+    Raises:
+        ValueError: If a rule has no accepted ratings or an invalid
+                    min_confidence.
+
+    Returns:
+        Dict[str, CascadeRule]: Rules by criterion.
+    """
+    with open(path, 'r') as file:
+        config = yaml.safe_load(file) or {}
+
+    rules = {}
+    for crit, rule in (config.get("criteria") or {}).items():
+        accept = frozenset(str(rating) for rating in rule.get("accept") or [])
+        min_confidence = rule.get("min_confidence")
+        if len(accept) == 0:
+            raise ValueError(f"Cascade rule for criterion {crit} accepts no ratings.")
+        if min_confidence is not None and not 0 <= min_confidence <= 1:
+            raise ValueError(f"Cascade rule for criterion {crit} has min_confidence outside 0 to 1.")
+        rules[str(crit)] = CascadeRule(accept, min_confidence)
+    return rules
+
+def should_escalate(rule: CascadeRule,
+                    rating: str,
+                    confidence: Optional[float]) -> bool:
+    """
+    Decides whether the experiment's model has to evaluate a pair the cheap
+    model rated. Unreadable ratings, ratings outside the rule's accepted
+    ones, and (if the rule sets min_confidence) missing or low confidence
+    all escalate.
+
+    Args:
+        rule (CascadeRule): Rule of the criterion.
+        rating (str): Cheap model's rating ("" if unreadable).
+        confidence (Optional[float]): Cheap model's confidence, if given.
+
+    Returns:
+        bool: True if the pair must be escalated.
+    """
+    if rating not in rule.accept:
+        return True
+    if rule.min_confidence is not None:
+        return confidence is None or confidence < rule.min_confidence
+    return False
@@ -17,14 +17,70 @@ Example usage:
     This will run the Claude model on all questions stored in data/my_mcqs for
     criteria 1, 4, and 5 that have a corresponding gold label, and save the results 
     to data/temp.
+
+  "python src/main.py models.model_gpt data/model_labels/gpt-4-0613 --workers 8"
+    This will run the GPT model with up to 8 conversations in flight at once.
+
+  "python src/main.py models.model_gpt data/model_labels/gpt-4-0613 --dry-run"
+    This will print how many evaluations the run above would make, without
+    calling the model.
+
+  "python src/main.py models.model_gpt data/temp --cache data/cache.sqlite"
+    This will answer requests already seen by an earlier run with the same
+    cache from the cache, and only query GPT for the rest.
+
+  "python src/main.py models.model_claude data/temp --batch"
+    This will submit all evaluations to Claude's Message Batches API and
+    wait for the results.
+
+  "python src/main.py models.model_gpt data/temp --strategy structured"
+    This will ask GPT for reasoning and rating in one request per
+    question-criterion pair instead of two.
+
+  "python src/main.py models.model_gpt data/temp --strategy fused"
+    This will ask GPT to rate all criteria of a question in one request.
+
+  "python src/main.py models.model_gpt data/temp --mcqs data/mcqs.jsonl"
+    This will stream the mcqs from a .jsonl file (one mcq per line) instead
+    of a directory of json files. SQLite databases work the same way.
+
+  "python src/main.py models.model_gpt data/temp/shard_1 --shard 1/4"
+    This will only evaluate the first of four slices of the questions.
+    Running 2/4, 3/4 and 4/4 into their own directories (on other machines,
+    for example) covers the rest; combine the slices with
+    "python src/merge.py data/temp data/temp/shard_1 data/temp/shard_2 ..."
+
+  "python src/main.py models.model_gpt data/temp --cascade-model models.model_llama3"
+    This will let Llama3 rate first and only ask GPT where the rules in
+    config/cascade.yaml escalate Llama3's rating.
+
+  "python src/main.py models.model_gpt data/temp --prefilter"
+    This will rate pairs that simple rules can decide (e.g. questions
+    without code for criterion 5) without asking GPT.
+
+  "python src/main.py models.model_gpt data/temp --samples 5 --criteria 23"
+    This will rate criteria 2 and 3 by majority vote over up to 5 GPT
+    conversations at temperature 0.7, stopping as soon as the vote is
+    decided.
+
+  "python src/main.py models.model_claude data/temp --target-ci-width 0.1"
+    This will evaluate randomly chosen question-criterion pairs (stratified
+    by criterion and gold label) until every criterion's accuracy is known
+    to within a 95% confidence interval of width 0.1.
 """
 
 ###############################################################################
 
 import typer
 from models.model_abstract import Model
+from cache import ResponseCache
+from metrics import MetricsRecorder
+from cascade import load_cascade_rules
+import batch as batch_mode
+from mcq_sources import open_mcq_source
 import utils
 import os
+from typing import *
 
 app = typer.Typer()
 
@@ -34,26 +90,47 @@ def main(model_module_name: str,
          mcqs: str = "./data/mcqs/initial_publication_mcqs",
          gold_path: str = "./data/gold_labels/initial_publication_labels.csv",
          criteria: str = "12345",
-         force_eval: bool = False) -> None:
+         force_eval: bool = False,
+         workers: int = 1,
+         dry_run: bool = False,
+         checkpoint_every: int = 50,
+         cache: Optional[str] = None,
+         cache_max_entries: Optional[int] = None,
+         cache_max_age_days: Optional[float] = None,
+         batch: bool = False,
+         batch_poll_seconds: float = 60,
+         strategy: str = "two-turn",
+         shard: Optional[str] = None,
+         metrics: bool = True,
+         cascade_model: Optional[str] = None,
+         cascade_rules: str = "./config/cascade.yaml",
+         prefilter: bool = False,
+         samples: int = 1,
+         sample_temperature: float = 0.7,
+         target_ci_width: Optional[float] = None,
+         active_seed: int = 0) -> None:
     """
     SUMMARY:
     Main function for running evaluation experiment. Given a
     model and output directory, the model will be run to generate
     ratings for every criterion-question pair that has a corresponding
     gold label (unless run with --force-eval).
-    The input directory of multiple-choice questions (mcqs) can optionally
+    The input multiple-choice questions (mcqs) can optionally
     be changed, and so can the set of criteria to evaluate.
 
     The experiment output will be saved to output_path.
       - Full ratings sheet saved to "output_path/evaluation.csv".
+      - Journal of finished ratings saved to "output_path/journal.jsonl".
       - Full message logs saved to "output_path/responses/criteria_*/".
+      - Per-request metrics saved to "output_path/metrics.jsonl".
 
     Args:
         model_module_name (str): Name of module containing model to use for
                                  experiment. Ex: models.model_gpt.
         output_path (str): Path to output directory where results are saved.
-        mcqs (str, optional): Path to input directory containing mcqs. 
-                              Defaults to "./data/mcqs".
+        mcqs (str, optional): Path to input directory containing mcqs, or
+                              to a .jsonl file or SQLite database of mcqs
+                              (see mcq_sources.py). Defaults to "./data/mcqs".
         gold_path (str, optional): Path to gold labels CSV. Defaults to
                                    "./data/gold_labels/initial_publication_labels.csv".
         criteria (str, optional): Set of criteria to evaluate, represented as a
@@ -64,18 +141,146 @@ def main(model_module_name: str,
                                      for each question, only criteria with a
                                      corresponding gold label will be 
                                      evaluated. Defaults to False.
+        workers (int, optional): Number of question-criterion conversations
+                                 sent to the model in parallel. Defaults to 1.
+        dry_run (bool, optional): If enabled, print how many evaluations
+                                  are planned without calling the model.
+                                  Defaults to False.
+        checkpoint_every (int, optional): Number of ratings between rewrites
+                                          of evaluation.csv. Every rating is
+                                          journaled as soon as it finishes
+                                          regardless. Defaults to 50.
+        cache (Optional[str], optional): Path to a SQLite response cache. 
+                                         Requests identical to ones already
+                                         answered (same model, parameters,
+                                         prompts and history) are served
+                                         from it. Defaults to None (off).
+        cache_max_entries (Optional[int], optional): Keep at most this many
+                                                     cached responses.
+        cache_max_age_days (Optional[float], optional): Ignore and evict
+                                                        cached responses 
+                                                        older than this.
+        batch (bool, optional): If enabled, submit the evaluations through
+                                the provider's batch API (GPT and Claude)
+                                as a question batch followed by a principle
+                                batch, instead of one request at a time.
+                                Defaults to False.
+        batch_poll_seconds (float, optional): Seconds between batch status
+                                              checks. Defaults to 60.
+        strategy (str, optional): How each question-criterion pair is
+                                  evaluated. "two-turn" (default, as in the
+                                  paper) asks for reasoning and then for the
+                                  rating in a second request. "structured"
+                                  asks for both in a single request and
+                                  reads the rating from a json reply.
+                                  "fused" rates all selected criteria of a
+                                  question in a single request.
+        shard (Optional[str], optional): "i/n" to only evaluate the i-th of
+                                         n deterministic slices of the
+                                         questions (1-based), e.g. to spread
+                                         a run over several machines. Each
+                                         shard should use its own
+                                         output_path; combine them with
+                                         src/merge.py. Defaults to None.
+        metrics (bool, optional): If enabled, record the latency, token
+                                  usage, retries and rate-limit waits of
+                                  every model request to
+                                  "output_path/metrics.jsonl" (summarize it
+                                  with src/analysis/report.py). Defaults to
+                                  True.
+        cascade_model (Optional[str], optional): Module of a cheap model
+                                                 (e.g. models.model_llama3)
+                                                 that rates first. The
+                                                 experiment's model only
+                                                 evaluates the pairs the
+                                                 cascade rules escalate.
+                                                 Defaults to None (off).
+        cascade_rules (str, optional): Path to the per-criterion cascade
+                                       rules. Defaults to
+                                       "./config/cascade.yaml".
+        prefilter (bool, optional): If enabled, pairs that deterministic
+                                    rules can decide (duplicate options for
+                                    criterion 3, no code for criterion 5,
+                                    see prefilters.py) are rated without a
+                                    model. Defaults to False.
+        samples (int, optional): Maximum number of sampled conversations
+                                 per pair, whose majority vote is the
+                                 rating (self-consistency). The vote's
+                                 confidence is recorded next to the rating.
+                                 Defaults to 1 (a single conversation at
+                                 the configured temperature).
+        sample_temperature (float, optional): Temperature of the sampled
+                                              conversations when samples
+                                              is above 1. Defaults to 0.7.
+        target_ci_width (Optional[float], optional): If given, only
+            evaluate pairs with a gold label, in a random order stratified
+            by criterion and gold label, until the 95% confidence interval
+            of each criterion's accuracy is narrower than this (e.g. 0.1).
+            The estimates are printed and kept in "output_path/status.json".
+            Defaults to None (evaluate every planned pair).
+        active_seed (int, optional): Random seed of the order of
+                                     --target-ci-width. Keep it when
+                                     resuming a run. Defaults to 0.
 
     Raises:
         FileNotFoundError: If the mcqs path does not exist.
+        ValueError: If the mcqs path is not a supported mcq source.
+        ValueError: If batch mode is combined with another strategy than
+                    "two-turn".
+        ValueError: If shard is not of the form "i/n".
+        ValueError: If a cascade is combined with batch mode or the fused
+                    strategy, or pre-filters or sampling with batch mode.
+        ValueError: If samples is below 1.
+        ValueError: If target_ci_width is combined with batch mode,
+                    force_eval or the fused strategy, or is not above 0.
     """
     
-    # Check if mcq path exists.
-    if not os.path.exists(mcqs):
-        raise FileNotFoundError(f"mcq path '{mcqs}' does not exist.")
+    # Check if mcq path exists and is a supported source.
+    open_mcq_source(mcqs).close()
+    if batch and strategy != "two-turn":
+        raise ValueError("--batch only supports the two-turn strategy.")
+    if batch and (cascade_model is not None or prefilter or samples > 1):
+        raise ValueError("--batch does not support --cascade-model, --prefilter or --samples.")
+    if samples < 1:
+        raise ValueError("--samples must be at least 1.")
+    sampling = (samples, sample_temperature) if samples > 1 else None
+    if target_ci_width is not None and (batch or target_ci_width <= 0):
+        raise ValueError("--target-ci-width must be above 0 and does not support --batch.")
+    active = None if target_ci_width is None else (target_ci_width, active_seed)
+    shard_spec = None if shard is None else utils.parse_shard(shard)
+
+    # Put the response cache in front of every model call
+    response_cache = None
+    if cache is not None and not dry_run:
+        response_cache = ResponseCache(cache, cache_max_entries, cache_max_age_days)
+        Model.set_response_cache(response_cache)
+
+    # Record every model call
+    metrics_recorder = None
+    if metrics and not dry_run and not batch:
+        os.makedirs(output_path, exist_ok=True)
+        metrics_recorder = MetricsRecorder(os.path.join(output_path, "metrics.jsonl"))
+        Model.set_metrics_recorder(metrics_recorder)
 
     # Fetch model constructor and run experiment.
     Model_Class = utils.get_model(model_module_name)
-    utils.run_model(Model_Class, mcqs, output_path, gold_path, criteria, force_eval)
+    cascade = None
+    if cascade_model is not None:
+        cascade = (utils.get_model(cascade_model), load_cascade_rules(cascade_rules))
+    try:
+        if batch and not dry_run:
+            batch_mode.run_batch(Model_Class, mcqs, output_path, gold_path, criteria,
+                                 force_eval, batch_poll_seconds, shard_spec)
+        else:
+            utils.run_model(Model_Class, mcqs, output_path, gold_path, criteria,
+                            force_eval, workers, dry_run, checkpoint_every, strategy,
+                            shard_spec, cascade, prefilter, sampling, active)
+    finally:
+        if metrics_recorder is not None:
+            metrics_recorder.close()
+        if response_cache is not None:
+            print(f"Response cache: {response_cache.stats()}")
+            response_cache.close()
 
 if __name__ == "__main__":
     app()
@@ -0,0 +1,267 @@
+"""
+mcq_sources.py
+
+This file implements the sources multiple-choice questions (mcqs) can be
+read from. Every source can list the questionIDs it holds (used to plan a
+run) and stream mcqs one at a time, so a run never holds more than the
+mcqs currently being evaluated in memory.
+
+The following sources are implemented:
+  - DirectorySource: A directory with one "<questionID>.json" file per mcq
+                     (the layout of data/mcqs/).
+  - JSONLSource: A .jsonl file with one mcq per line. Each line is either
+                 {"questionID": ..., "question": ..., "choices": [...]} or
+                 {"questionID": ..., "mcq": {...}}.
+  - SQLiteSource: A SQLite database with a table
+                  "mcqs(questionID TEXT PRIMARY KEY, mcq TEXT)" holding the
+                  mcq json. Another table can be selected with
+                  "path/to/db.sqlite:table_name".
+
+open_mcq_source picks the source from the path.
+"""
+
+###############################################################################
+
+import json
+import os
+import re
+import sqlite3
+from typing import *
+
+# A jsonl line starting with its questionID (string or number)
+LEADING_ID_PATTERN = re.compile(rb'\s*\{\s*"questionID"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)\s*[,}]')
+
+class MCQSource:
+    """
+    Abstract parent class for mcq sources.
+    """
+
+    # Abstract
+    def ids(self) -> Set[str]:
+        """
+        Returns the questionIDs available from this source.
+
+        Returns:
+            Set[str]: Available questionIDs.
+        """
+        raise NotImplementedError("Subclasses must implement ids()")
+
+    # Abstract
+    def iter_mcqs(self, questionIDs: Collection[str]) -> Iterator[Tuple[str, Any]]:
+        """
+        Lazily yields the requested mcqs, each parsed once. The order is
+        whatever is cheapest for the source; unavailable IDs are skipped.
+
+        Args:
+            questionIDs (Collection[str]): IDs of the mcqs to read.
+
+        Yields:
+            Tuple[str, Any]: questionID and mcq data.
+        """
+        raise NotImplementedError("Subclasses must implement iter_mcqs()")
+
+    # Abstract
+    def get(self, questionID: str) -> Any:
+        """
+        Reads a single mcq.
+
+        Args:
+            questionID (str): ID of the mcq.
+
+        Raises:
+            KeyError: If the source has no such mcq.
+
+        Returns:
+            Any: mcq data.
+        """
+        raise NotImplementedError("Subclasses must implement get()")
+
+    def close(self) -> None:
+        """
+        Releases any resources held by the source.
+        """
+        pass
+
+class DirectorySource(MCQSource):
+    """
+    Reads mcqs from "<questionID>.json" files in a directory.
+    """
+
+    def __init__(self, directory: str) -> None:
+        """
+        Args:
+            directory (str): Path to the mcq directory.
+        """
+        self._directory = directory
+
+    def ids(self) -> Set[str]:
+        # List the directory once instead of checking every file
+        return {name[:-len(".json")] for name in os.listdir(self._directory)
+                if name.endswith(".json")}
+
+    def iter_mcqs(self, questionIDs: Collection[str]) -> Iterator[Tuple[str, Any]]:
+        for questionID in questionIDs:
+            path = os.path.join(self._directory, f"{questionID}.json")
+            if os.path.isfile(path):
+                with open(path, 'r') as file:
+                    yield questionID, json.load(file)
+
+    def get(self, questionID: str) -> Any:
+        path = os.path.join(self._directory, f"{questionID}.json")
+        if not os.path.isfile(path):
+            raise KeyError(questionID)
+        with open(path, 'r') as file:
+            return json.load(file)
+
+class JSONLSource(MCQSource):
+    """
+    Reads mcqs from a file with one json object per line.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path (str): Path to the .jsonl file.
+        """
+        self._path = path
+        self._offsets = None # (questionID -> byte offset of its line, built by ids)
+
+    @staticmethod
+    def _parse(line: bytes) -> Tuple[str, Any]:
+        """
+        Splits a line into its questionID and mcq data.
+
+        Args:
+            line (bytes): One line of the file.
+
+        Returns:
+            Tuple[str, Any]: questionID and mcq data.
+        """
+        record = json.loads(line)
+        questionID = str(record.pop("questionID"))
+        return questionID, record["mcq"] if "mcq" in record else record
+
+    @staticmethod
+    def _line_id(line: bytes) -> str:
+        """
+        Reads the questionID of a line. Lines that start with it (as in the
+        formats listed above) are not decoded past it; others are parsed in
+        full.
+
+        Args:
+            line (bytes): One line of the file.
+
+        Returns:
+            str: questionID.
+        """
+        match = LEADING_ID_PATTERN.match(line)
+        if match is not None:
+            return str(json.loads(match.group(1)))
+        return str(json.loads(line)["questionID"])
+
+    def ids(self) -> Set[str]:
+        # One pass over the file, remembering where each line starts
+        self._offsets = {}
+        with open(self._path, 'rb') as file:
+            offset = 0
+            for line in file:
+                if line.strip():
+                    questionID = self._line_id(line)
+                    self._offsets.setdefault(questionID, offset)
+                offset += len(line)
+        return set(self._offsets)
+
+    def iter_mcqs(self, questionIDs: Collection[str]) -> Iterator[Tuple[str, Any]]:
+        # Only the wanted lines are decoded in full
+        wanted = set(questionIDs)
+        with open(self._path, 'rb') as file:
+            for line in file:
+                if len(wanted) == 0:
+                    return
+                if not line.strip():
+                    continue
+                questionID = self._line_id(line)
+                if questionID in wanted:
+                    wanted.discard(questionID) # (First occurrence wins)
+                    yield questionID, self._parse(line)[1]
+
+    def get(self, questionID: str) -> Any:
+        if self._offsets is None:
+            self.ids()
+        if questionID not in self._offsets:
+            raise KeyError(questionID)
+        with open(self._path, 'rb') as file:
+            file.seek(self._offsets[questionID])
+            return self._parse(file.readline())[1]
+
+class SQLiteSource(MCQSource):
+    """
+    Reads mcqs from a SQLite table of (questionID, mcq json) rows.
+    """
+
+    def __init__(self, path: str,
+                 table: str = "mcqs") -> None:
+        """
+        Args:
+            path (str): Path to the SQLite database.
+            table (str, optional): Table holding the mcqs. Defaults to "mcqs".
+        """
+        if not table.isidentifier():
+            raise ValueError(f"Invalid mcq table name '{table}'.")
+        self._table = table
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+
+    def ids(self) -> Set[str]:
+        return {str(row[0]) for row in
+                self._connection.execute(f"SELECT questionID FROM {self._table}")}
+
+    def iter_mcqs(self, questionIDs: Collection[str]) -> Iterator[Tuple[str, Any]]:
+        wanted = set(questionIDs)
+        cursor = self._connection.execute(f"SELECT questionID, mcq FROM {self._table} ORDER BY rowid")
+        for questionID, mcq in cursor:
+            questionID = str(questionID)
+            if questionID in wanted:
+                wanted.discard(questionID)
+                yield questionID, json.loads(mcq)
+
+    def get(self, questionID: str) -> Any:
+        row = self._connection.execute(f"SELECT mcq FROM {self._table} WHERE questionID = ?",
+                                       (questionID,)).fetchone()
+        if row is None:
+            raise KeyError(questionID)
+        return json.loads(row[0])
+
+    def close(self) -> None:
+        self._connection.close()
+
+def open_mcq_source(path: str) -> MCQSource:
+    """
+    Opens the mcq source at path: a directory, a .jsonl file, or a SQLite
+    database (.sqlite, .sqlite3 or .db, optionally followed by ":table").
+
+    Args:
+        path (str): Path to the mcqs.
+
+    Raises:
+        FileNotFoundError: If nothing exists at path.
+        ValueError: If the file type is not supported.
+
+    Returns:
+        MCQSource: Source reading from path.
+    """
+    table = "mcqs"
+    base, _, suffix = path.rpartition(":")
+    if base and os.path.splitext(base)[1] in (".sqlite", ".sqlite3", ".db") and not os.path.exists(path):
+        path, table = base, suffix
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"mcq path '{path}' does not exist.")
+    if os.path.isdir(path):
+        return DirectorySource(path)
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        return JSONLSource(path)
+    if extension in (".sqlite", ".sqlite3", ".db"):
+        return SQLiteSource(path, table)
+    raise ValueError(f"Unsupported mcq source '{path}'. Use a directory, a .jsonl file or a SQLite database.")
@@ -0,0 +1,217 @@
+"""
+merge.py
+
+This file implements the merge command, which combines the output
+directories of a sharded experiment (main.py --shard i/n) into a single
+experiment output, as if one process had run every shard.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python src/merge.py --help"
+  for a list of required parameters. Required parameters are:
+    - output_path: Directory to save the merged experiment output to.
+    - shard_paths: Output directories of the shards.
+
+  Example:
+    "python
+     src/merge.py
+     data/model_labels/gpt-4-0613
+     data/temp/shard_1 data/temp/shard_2 data/temp/shard_3 data/temp/shard_4
+    "
+    Would combine the four shards' "evaluation.csv" files (including any
+    ratings only recorded in their journals) into
+    "data/model_labels/gpt-4-0613/evaluation.csv", and copy their
+    "responses/" trees into "data/model_labels/gpt-4-0613/responses/".
+"""
+
+###############################################################################
+
+import typer
+import os
+import shutil
+import pandas as pd
+import utils
+from typing import *
+
+###############################################################################
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def load_shard(shard_path: str) -> pd.DataFrame:
+    """
+    Loads a shard's evaluations, including ratings that were journaled but
+    never made it into its csv (e.g. because the shard was interrupted).
+    The index columns earlier saves of the csv added are dropped.
+
+    Args:
+        shard_path (str): Output directory of the shard.
+
+    Raises:
+        FileNotFoundError: If the shard has no "evaluation.csv".
+
+    Returns:
+        pd.DataFrame: The shard's evaluations dataframe.
+    """
+    csv_path = os.path.join(shard_path, "evaluation.csv")
+    if not os.path.isfile(csv_path):
+        raise FileNotFoundError(f"Shard '{shard_path}' has no evaluation.csv.")
+    df = pd.read_csv(csv_path, dtype=str)
+    df = df.drop(columns=[col for col in df.columns if col.startswith("Unnamed:")]) # (Saved indices)
+    utils.replay_journal(df, os.path.join(shard_path, "journal.jsonl"))
+    return df
+
+def result_columns(df: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    Lists the columns a run added to the gold labels sheet, by criterion:
+    "auto k" and the additional evaluation columns ("cheap k", "cascade k",
+    "rule k", "confidence k", "votes k", ...) of every criterion k the run
+    evaluated (has an "auto k" column for). Gold labels ("criteria k") and
+    questionID are not result columns.
+
+    Args:
+        df (pd.DataFrame): Evaluations dataframe of a shard.
+
+    Returns:
+        Dict[str, List[str]]: Result columns by criterion.
+    """
+    criteria = {col[len("auto "):] for col in df.columns if col.startswith("auto ")}
+    columns = {}
+    for col in df.columns:
+        name, _, crit = col.rpartition(" ")
+        if name not in ("", "criteria") and crit in criteria:
+            columns.setdefault(crit, []).append(col)
+    return columns
+
+def merge_evaluations(shards: List[pd.DataFrame]) -> Tuple[pd.DataFrame, int]:
+    """
+    Combines the evaluations of several shards. Every shard holds the full
+    gold labels sheet, so the result columns are merged row by row. A pair's
+    columns are taken together from the first shard given that has any of
+    them, so a rating is never mixed with another shard's cascade or vote
+    columns.
+
+    Args:
+        shards (List[pd.DataFrame]): Evaluations dataframes of the shards.
+
+    Raises:
+        ValueError: If the shards were run against different gold labels.
+
+    Returns:
+        Tuple[pd.DataFrame, int]: Merged dataframe and the number of pairs
+                                  that shards rated differently.
+    """
+    merged = shards[0].copy()
+    conflicts = 0
+    for df in shards[1:]:
+        if (len(df) != len(merged) or
+            not (df["questionID"].to_numpy() == merged["questionID"].to_numpy()).all()):
+            raise ValueError("Shards were run against different gold labels and can't be merged.")
+
+        for crit, cols in result_columns(df).items():
+            for col in cols:
+                if col not in merged.columns:
+                    merged[col] = None
+
+            # Rows this shard has results for that earlier shards don't
+            taken = merged[result_columns(merged)[crit]].notna().any(axis=1)
+            new = df[cols].notna().any(axis=1) & ~taken
+            for col in cols:
+                merged[col] = merged[col].where(~new, df[col])
+
+            auto = f"auto {crit}"
+            if auto in df.columns:
+                both = merged[auto].notna() & df[auto].notna()
+                conflicts += int((both & (merged[auto] != df[auto])).sum())
+    return merged, conflicts
+
+def merge_responses(shard_paths: List[str],
+                    output_path: str) -> int:
+    """
+    Copies the message logs in every shard's "responses/" tree into
+    "output_path/responses/". A log that already exists is kept, matching
+    merge_evaluations' preference for earlier shards.
+
+    Args:
+        shard_paths (List[str]): Output directories of the shards.
+        output_path (str): Merged output directory.
+
+    Returns:
+        int: Number of message logs copied.
+    """
+    copied = 0
+    for shard_path in shard_paths:
+        responses = os.path.join(shard_path, "responses")
+        if not os.path.isdir(responses):
+            continue
+        for criteria_dir in sorted(os.listdir(responses)):
+            out_directory = os.path.join(output_path, "responses", criteria_dir)
+            os.makedirs(out_directory, exist_ok=True)
+            for name in os.listdir(os.path.join(responses, criteria_dir)):
+                destination = os.path.join(out_directory, name)
+                if not os.path.exists(destination):
+                    shutil.copy2(os.path.join(responses, criteria_dir, name), destination)
+                    copied += 1
+    return copied
+
+###############################################################################
+
+#################
+# Main function #
+#################
+
+app = typer.Typer()
+
+@app.command()
+def main(output_path: str,
+         shard_paths: List[str]
+         ) -> None:
+    """
+    Combines the output directories of a sharded experiment into
+    output_path: one "evaluation.csv" holding every shard's ratings and one
+    "responses/" tree holding every shard's message logs.
+
+    USAGE:
+      From the mcq-eval/ directory, run
+        "python src/merge.py --help"
+      for a list of required parameters. Required parameters are:
+        - output_path: Directory to save the merged experiment output to.
+        - shard_paths: Output directories of the shards.
+
+      Example:
+        "python
+        src/merge.py
+        data/model_labels/gpt-4-0613
+        data/temp/shard_1 data/temp/shard_2 data/temp/shard_3 data/temp/shard_4
+        "
+
+    Args:
+        output_path (str): Path to the merged output directory. Must not
+                           already hold an "evaluation.csv".
+        shard_paths (List[str]): Paths to the shards' output directories.
+
+    Raises:
+        FileExistsError: If output_path already holds an "evaluation.csv".
+    """
+
+    # Never overwrite an existing experiment
+    csv_path = os.path.join(output_path, "evaluation.csv")
+    if os.path.exists(csv_path):
+        raise FileExistsError(f"'{csv_path}' already exists. Merge into a new directory.")
+
+    # Merge ratings, then message logs
+    merged, conflicts = merge_evaluations([load_shard(path) for path in shard_paths])
+    os.makedirs(output_path, exist_ok=True)
+    utils.write_csv_atomic(merged, csv_path)
+    copied = merge_responses(shard_paths, output_path)
+
+    auto_cols = [col for col in merged.columns if col.startswith("auto ")]
+    print(f"Merged {len(shard_paths)} shards: {int(merged[auto_cols].notna().sum().sum())} ratings, "
+          f"{copied} message logs.")
+    if conflicts > 0:
+        print(f"Warning: {conflicts} pairs were rated differently by different shards "
+              f"(kept the rating of the first shard given).")
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,162 @@
+"""
+metrics.py
+
+This file implements the per-request instrumentation of a run. Every
+Model.get_response call appends one json line to "output_path/metrics.jsonl"
+with its wall latency, token usage, retries and rate-limit waits, tagged
+with the model, questionID and criterion it was made for.
+src/analysis/report.py summarizes the file.
+
+It also keeps the run's accuracy and f1 scores against the gold labels up
+to date as ratings arrive (RunningScores), for the progress bar and
+"output_path/status.json".
+
+The following are implemented:
+  - MetricsRecorder: Thread-safe writer of metrics.jsonl.
+  - tagged: Context manager tagging the requests made by the current thread
+            (e.g. with the questionID and criterion being evaluated).
+  - current_tags: The tags set by tagged for the current thread.
+  - RunningScores: Running accuracy and f1 scores per criterion.
+"""
+
+###############################################################################
+
+import contextlib
+import json
+import threading
+import time
+from collections import Counter
+from typing import *
+
+# Tags of the requests made by each thread, see tagged
+_thread_tags = threading.local()
+
+class MetricsRecorder:
+    """
+    Appends one json record per model request to a metrics file. Shared by
+    all worker threads of a run.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Opens the metrics file at path for appending.
+
+        Args:
+            path (str): Path to the metrics .jsonl file.
+        """
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding="utf-8")
+
+    def record(self, **fields: Any) -> None:
+        """
+        Writes one record, adding the current thread's tags and the time.
+
+        Args:
+            **fields (Any): Measurements of the request.
+        """
+        record = {"time": time.time(), **current_tags(), **fields}
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self) -> None:
+        """
+        Closes the metrics file.
+        """
+        with self._lock:
+            self._file.close()
+
+@contextlib.contextmanager
+def tagged(**tags: Any) -> Iterator[None]:
+    """
+    Tags every request the current thread makes inside the with block, on
+    top of any enclosing tags.
+
+    Args:
+        **tags (Any): Tags to add, e.g. questionID="...", criterion="3".
+    """
+    previous = current_tags()
+    _thread_tags.tags = {**previous, **tags}
+    try:
+        yield
+    finally:
+        _thread_tags.tags = previous
+
+def current_tags() -> Dict[str, Any]:
+    """
+    Returns the tags set for the current thread.
+
+    Returns:
+        Dict[str, Any]: Tags, empty outside of tagged.
+    """
+    return getattr(_thread_tags, "tags", {})
+
+class RunningScores:
+    """
+    Accuracy and f1 scores of a run's ratings against the gold labels, per
+    criterion. Adding a rating only updates a few counters, so the scores
+    can be shown while the run is in progress.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes the counters, empty for every criterion.
+        """
+        self._counts: Dict[str, dict] = {}
+
+    def add(self,
+            crit: str,
+            gold: str,
+            rating: str) -> None:
+        """
+        Counts one rating of a pair with a gold label.
+
+        Args:
+            crit (str): Criterion that was rated.
+            gold (str): Gold label of the pair.
+            rating (str): Rating given.
+        """
+        counts = self._counts.setdefault(crit, {"n": 0, "correct": 0, "gold": Counter(),
+                                                "rated": Counter(), "agreed": Counter()})
+        counts["n"] += 1
+        counts["gold"][gold] += 1
+        counts["rated"][rating] += 1
+        if rating == gold:
+            counts["correct"] += 1
+            counts["agreed"][gold] += 1
+
+    def scores(self) -> Dict[str, dict]:
+        """
+        Computes the current scores. f1 scores are given for every label
+        seen in the gold labels or the ratings, as in predictions.py, and
+        macro_f1 is their mean.
+
+        Returns:
+            Dict[str, dict]: "n", "accuracy", "f1" (by label) and "macro_f1"
+                             of each criterion.
+        """
+        scores = {}
+        for crit, counts in sorted(self._counts.items()):
+            labels = sorted(set(counts["gold"]) | set(counts["rated"]))
+            f1 = {label: 2 * counts["agreed"][label] / (counts["gold"][label] + counts["rated"][label])
+                  for label in labels}
+            scores[crit] = {"n": counts["n"],
+                            "accuracy": counts["correct"] / counts["n"],
+                            "f1": f1,
+                            "macro_f1": sum(f1.values()) / len(f1)}
+        return scores
+
+    def postfix(self) -> str:
+        """
+        Summarizes the accuracy and macro f1 score of each criterion for a
+        progress bar.
+
+        Returns:
+            str: E.g. "acc 1:0.62 2:0.55 f1 1:0.58 2:0.41".
+        """
+        scores = self.scores()
+        if len(scores) == 0:
+            return ""
+        return ("acc " + " ".join(f"{crit}:{score['accuracy']:.2f}" for crit, score in scores.items()) +
+                " f1 " + " ".join(f"{crit}:{score['macro_f1']:.2f}" for crit, score in scores.items()))
@@ -6,20 +6,72 @@ inherit from.
 
 To add a new model
   - Create a new class inheriting from Model.
-  - Implement get_response to prompt the language model and get a resopnse.
-  - Update self._client and self._model_params in __init__ to handle importing
-      API key and model parameters.
+  - Implement generate to prompt the language model with a message history
+      and get a resopnse. (get_response builds the history, consults the
+      response cache and calls generate on a miss.) generate should raise
+      rate_limit.RateLimitExceeded (or RetryableError for other transient
+      failures) instead of sleeping and retrying itself; get_response
+      retries with backoff and keeps all conversations under the shared
+      rate limit.
+  - Implement create_client to handle importing API key and model parameters.
+      It is called once per process and the result is shared by every
+      instance, so a model is cheap to construct for each conversation.
 """
 
 ###############################################################################
 
+import json
+import threading
+import time
+from rate_limit import RateLimiter, RetryableError, RateLimitExceeded, backoff_delay
 from typing import *
 
+class Completion(NamedTuple):
+    """
+    A response from the language model, together with the token usage the
+    provider reported for it. generate may return one of these instead of a
+    plain string. usage has "input_tokens" and "output_tokens", and
+    optionally "cache_read_tokens" and "cache_write_tokens"; input_tokens
+    leaves out the tokens counted as cache reads or writes.
+    """
+    text: str
+    usage: Optional[dict] = None
+
 class Model:
     """
     Abstract parent class for models to inherit from.
+
+    An instance holds the state of a single conversation. The client and
+    model parameters it uses are created once per subclass and shared by
+    all of its instances (and threads), so connections are reused across
+    conversations.
     """
 
+    # (client, model params) per Model subclass, see get_shared_client
+    _shared_clients: Dict[type, Tuple[Any, Any]] = {}
+    _shared_clients_lock = threading.Lock()
+
+    # Rate limiter per Model subclass, see get_rate_limiter
+    _rate_limiters: Dict[type, RateLimiter] = {}
+
+    # Model parameters that don't influence responses (left out of cache keys)
+    NON_SAMPLING_PARAMS = ("requests_per_minute", "tokens_per_minute", "base_url", "prompt_caching",
+                           "api_key", "n_threads", "n_batch", "n_gpu_layers", "prompt_cache_bytes",
+                           "max_retries")
+
+    # Retries of a failed request when the model parameters set no "max_retries"
+    DEFAULT_MAX_RETRIES = 8
+
+    # Response cache shared by all models, see set_response_cache
+    _response_cache = None
+
+    # Provider limits of one batch job (None for no limit), see split_batch
+    BATCH_MAX_REQUESTS: Optional[int] = None
+    BATCH_MAX_BYTES: Optional[int] = None
+
+    # Metrics recorder shared by all models, see set_metrics_recorder
+    _metrics = None
+
     def __init__(self, system_prompt: str) -> None:
         """ 
         Initializes a model with: 
@@ -31,12 +83,109 @@ class Model:
         Args:
             system_prompt (str): System prompt for the model instance.
         """
-        self._client = None # Replace this line with LLM Client.
-        self._model_params = None # Replace this line with model params.
+        self._client, self._model_params = self.get_shared_client()
 
         self._system_prompt = system_prompt
         self._messages = []
+        self._usage = [] # (one entry per assistant message)
+        self._call_stats = {"retries": 0, "rate_limit_wait": 0.0} # (of the last request)
+        self._sample = None # (index among several sampled conversations, see set_sampling)
+        self._attempt = 1 # (of the evaluation this conversation belongs to, see set_attempt)
+        self._follow_up = False # (whether another turn builds on the current request, see get_response)
+
+    # Abstract
+    @classmethod
+    def create_client(cls) -> Tuple[Any, Any]:
+        """
+        Creates the long-lived client running the language model and loads
+        the model parameters. Should be implemented in model subclass.
 
+        Returns:
+            Any: Client running the language model and handling API key.
+            Any: Model parameters.
+        """
+        return None, None
+
+    @classmethod
+    def get_shared_client(cls) -> Tuple[Any, Any]:
+        """
+        Returns the client and model parameters shared by every instance of
+        this class, creating them on first use.
+
+        Returns:
+            Any: Client running the language model and handling API key.
+            Any: Model parameters.
+        """
+        with Model._shared_clients_lock:
+            if cls not in Model._shared_clients:
+                Model._shared_clients[cls] = cls.create_client()
+            return Model._shared_clients[cls]
+
+    @classmethod
+    def get_rate_limiter(cls) -> RateLimiter:
+        """
+        Returns the rate limiter shared by every instance of this class. Its
+        limits come from the optional "requests_per_minute" and
+        "tokens_per_minute" model parameters.
+
+        Returns:
+            RateLimiter: Shared rate limiter.
+        """
+        _, model_params = cls.get_shared_client()
+        with Model._shared_clients_lock:
+            if cls not in Model._rate_limiters:
+                model_params = model_params if isinstance(model_params, dict) else {}
+                Model._rate_limiters[cls] = RateLimiter(model_params.get("requests_per_minute"),
+                                                        model_params.get("tokens_per_minute"))
+            return Model._rate_limiters[cls]
+
+    def sampling_params(self) -> Any:
+        """
+        Returns the model parameters that influence responses, i.e. without
+        rate limits and endpoint settings, plus the sample index of sampled
+        conversations and the attempt index of retried evaluations.
+
+        Returns:
+            Any: Model parameters used to identify requests.
+        """
+        if not isinstance(self._model_params, dict):
+            return self._model_params
+        params = {name: value for name, value in self._model_params.items()
+                  if name not in self.NON_SAMPLING_PARAMS}
+        if self._sample is not None:
+            params["sample"] = self._sample
+        if self._attempt > 1:
+            params["attempt"] = self._attempt
+        return params
+
+    def set_sampling(self, temperature: float, sample: int) -> None:
+        """
+        Makes this conversation one of several independent samples of the
+        same request: it is generated at the given temperature, and the
+        sample index is part of its cache keys so every sample gets its own
+        cached response.
+
+        Args:
+            temperature (float): Sampling temperature of this conversation.
+            sample (int): Index of the sample.
+        """
+        model_params = self._model_params if isinstance(self._model_params, dict) else {}
+        self._model_params = {**model_params, "temperature": temperature}
+        self._sample = sample
+
+    def set_attempt(self, attempt: int) -> None:
+        """
+        Makes this conversation a retry of an evaluation whose earlier
+        attempts gave no valid rating. The attempt index is part of its
+        cache keys, so a retry asks the model again instead of getting the
+        cached response that failed.
+
+        Args:
+            attempt (int): Index of the attempt, from 1.
+        """
+        if not isinstance(self._model_params, dict):
+            self._model_params = {}
+        self._attempt = attempt
 
     def get_chat_log(self) -> Tuple[str, list]:
         """
@@ -48,23 +197,289 @@ class Model:
         """
         return (self._system_prompt, self._messages)
 
-    # Abstract
-    def get_response(self, new_message: str) -> str:
-        """ 
-        Abstract method. Must be implemented in model subclass.
+    def get_usage_log(self) -> List[Optional[dict]]:
+        """
+        Returns the token usage reported for each assistant message, in
+        order. Entries are None when the provider reported nothing, and
+        {"cached_response": True} for responses from the response cache.
+
+        Returns:
+            List[Optional[dict]]: Usage of each assistant message.
+        """
+        return self._usage
+
+    def rewind(self) -> None:
+        """
+        Removes the last user message and the model's response to it, so
+        that turn can be asked again without resending the rest of the
+        conversation.
+        """
+        if len(self._messages) >= 2 and self._messages[-1]["role"] == "assistant":
+            del self._messages[-2:]
+            self._usage.pop()
+            self.history_truncated(len(self._messages))
+
+    def history_truncated(self, length: int) -> None:
+        """
+        Called after messages were removed from the end of the conversation,
+        so subclasses that keep state derived from the message history can
+        drop what belongs to the removed messages. Does nothing by default.
+
+        Args:
+            length (int): Number of messages left in the conversation.
+        """
+        pass
+
+    @staticmethod
+    def set_response_cache(cache) -> None:
+        """
+        Sets the response cache consulted by get_response for every model.
+        Pass None to disable caching.
+
+        Args:
+            cache (cache.ResponseCache): Cache to use, or None.
+        """
+        Model._response_cache = cache
+
+    @staticmethod
+    def set_metrics_recorder(recorder) -> None:
+        """
+        Sets the recorder that get_response reports every request to (see
+        metrics.py). Pass None to disable metrics.
+
+        Args:
+            recorder (metrics.MetricsRecorder): Recorder to use, or None.
+        """
+        Model._metrics = recorder
 
+    def get_response(self,
+                     new_message: str,
+                     follow_up: bool = False) -> str:
+        """ 
         Given a new message, 
          - Updates the messages list with the user's new message and the 
            assistant's response. 
          - Returns the assistant's response.
 
-        NOTE: Don't forget to properly incorporate self._system_prompt
-        when prompting the model, but do not add it to self._messages.
+        If a response cache is set, a response to the exact same request
+        (model, parameters, system prompt and message history) is returned
+        from the cache instead of prompting the model. If a metrics recorder
+        is set, the request's latency, token usage, retries and rate-limit
+        waits are recorded.
 
         Args:
             new_message (str): Message sent by the user.
+            follow_up (bool, optional): Another turn of this conversation
+                                        will build on this one, so backends
+                                        with explicit prompt caching may
+                                        mark it for reuse. Defaults to False.
 
         Returns:
             str: Assistant's response to the user's message.
         """
-        raise NotImplementedError("Subclasses must implement get_response()")
+        # Append the user message to the conversation. The message list is
+        # only ever appended to, so it is passed to generate without copying
+        # and backends can reuse whatever they computed for earlier turns.
+        self._messages.append({"role": "user", "content": new_message})
+        self._follow_up = follow_up
+        start = time.monotonic()
+        self._call_stats = {"retries": 0, "rate_limit_wait": 0.0}
+
+        try:
+            # Look the request up in the cache, prompt the model on a miss
+            cache, key, response, usage = Model._response_cache, None, None, None
+            if cache is not None:
+                key = cache.make_key(type(self).__name__, self.sampling_params(),
+                                     self._system_prompt, self._messages)
+                response = cache.get(key)
+                usage = {"cached_response": True}
+            if response is None:
+                completion = self.generate_with_retries(self._messages)
+                response, usage = ((completion.text, completion.usage) if isinstance(completion, Completion)
+                                   else (completion, None))
+                if cache is not None and response is not None:
+                    cache.put(key, response)
+        except BaseException:
+            # Leave the conversation as it was before the failed turn
+            self._messages.pop()
+            self.history_truncated(len(self._messages))
+            raise
+
+        # Update the message log
+        self._messages.append({"role": "assistant", "content": response})
+        self._usage.append(usage)
+
+        # Report the request
+        if Model._metrics is not None:
+            usage = dict(usage or {})
+            model_params = self._model_params if isinstance(self._model_params, dict) else {}
+            Model._metrics.record(model=type(self).__name__,
+                                  model_name=model_params.get("model"),
+                                  turn=len(self._usage),
+                                  latency=time.monotonic() - start,
+                                  time_to_first_token=usage.pop("time_to_first_token", None),
+                                  cached_response=usage.pop("cached_response", False),
+                                  **self._call_stats,
+                                  **usage)
+        return response
+
+    def generate_with_retries(self, messages: list) -> Union[str, Completion]:
+        """
+        Calls generate within the model's shared rate limit, retrying
+        transient failures with jittered exponential backoff (or the wait
+        the provider asked for). A rate-limit error pauses every
+        conversation of this model, not just this one. Gives up after the
+        "max_retries" model parameter's number of retries (null retries
+        forever), DEFAULT_MAX_RETRIES if it isn't set.
+
+        Args:
+            messages (list): Message list history between user and
+                             assistant, ending with the new user message.
+
+        Raises:
+            RetryableError: The last failure, once the retries are used up.
+
+        Returns:
+            Union[str, Completion]: Result of generate.
+        """
+        limiter = self.get_rate_limiter()
+        model_params = self._model_params if isinstance(self._model_params, dict) else {}
+        max_retries = model_params.get("max_retries", self.DEFAULT_MAX_RETRIES)
+
+        # Roughly 4 characters per token
+        estimated_tokens = (len(self._system_prompt) +
+                            sum(len(message["content"]) for message in messages)) // 4
+
+        attempt = 0
+        while True:
+            self._call_stats["rate_limit_wait"] += limiter.acquire(estimated_tokens)
+            try:
+                return self.generate(messages)
+            except RetryableError as e:
+                if max_retries is not None and attempt >= max_retries:
+                    print(f"{type(self).__name__}: {e} Giving up after {attempt} retries.")
+                    raise
+                delay = backoff_delay(attempt, e.retry_after)
+                if isinstance(e, RateLimitExceeded):
+                    limiter.pause(delay)
+                    self._call_stats["rate_limit_wait"] += delay
+                print(f"{type(self).__name__}: {e} Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+                attempt += 1
+                self._call_stats["retries"] = attempt
+
+    # Abstract
+    def generate(self, messages: list) -> Union[str, Completion]:
+        """ 
+        Abstract method. Must be implemented in model subclass (unless the
+        subclass overrides get_response itself).
+
+        Given the message history ending with the user's new message,
+        prompts the language model and returns the assistant's response.
+        messages is the conversation's own (append-only) message list, so
+        it must not be modified; earlier messages never change between
+        calls, which lets backends keep state for the prefix.
+
+        NOTE: Don't forget to properly incorporate self._system_prompt
+        when prompting the model. It is not part of messages.
+
+        Args:
+            messages (list): Message list history between user and
+                             assistant, ending with the new user message.
+
+        Returns:
+            Union[str, Completion]: Assistant's response to the last user
+                                    message, optionally with token usage
+                                    (and "time_to_first_token" in seconds
+                                    for streaming backends).
+        """
+        raise NotImplementedError("Subclasses must implement generate()")
+
+    # Abstract (optional)
+    @classmethod
+    def batch_entry(cls,
+                    custom_id: str,
+                    system_prompt: str,
+                    messages: list) -> dict:
+        """
+        Optional. Implemented by model subclasses alongside submit_batch.
+
+        Builds the entry of one request in a batch job, as it is sent to
+        the provider.
+
+        Args:
+            custom_id (str): ID of the request within the batch.
+            system_prompt (str): System prompt of the request.
+            messages (list): Messages of the request.
+
+        Returns:
+            dict: Batch entry.
+        """
+        raise NotImplementedError(f"{cls.__name__} does not support batch submission")
+
+    @classmethod
+    def split_batch(cls, requests: List[Tuple[str, str, list]]) -> List[List[Tuple[str, str, list]]]:
+        """
+        Splits requests into as few batch jobs as the provider's limits on
+        the number of requests (BATCH_MAX_REQUESTS) and size in bytes
+        (BATCH_MAX_BYTES) of one job allow, keeping their order. A request's
+        size is that of its json-encoded batch_entry line.
+
+        Args:
+            requests (List[Tuple[str, str, list]]): (custom_id, system
+                                                    prompt, messages) of
+                                                    every request.
+
+        Returns:
+            List[List[Tuple[str, str, list]]]: Requests of each batch job.
+        """
+        max_requests = cls.BATCH_MAX_REQUESTS or len(requests)
+        max_bytes = cls.BATCH_MAX_BYTES or float("inf")
+        jobs, job_bytes = [[]], 0
+        for request in requests:
+            request_bytes = len(json.dumps(cls.batch_entry(*request)).encode("utf-8")) + 1 # (newline)
+            if jobs[-1] and (len(jobs[-1]) == max_requests or job_bytes + request_bytes > max_bytes):
+                jobs.append([])
+                job_bytes = 0
+            jobs[-1].append(request)
+            job_bytes += request_bytes
+        return [job for job in jobs if job]
+
+    # Abstract (optional)
+    @classmethod
+    def submit_batch(cls, requests: List[Tuple[str, str, list]]) -> str:
+        """
+        Optional. Implemented by model subclasses whose provider offers an
+        asynchronous batch API (see batch.py).
+
+        Submits many independent requests as one batch job. batch.py keeps
+        each job within the provider's limits with split_batch.
+
+        Args:
+            requests (List[Tuple[str, str, list]]): (custom_id, system
+                                                    prompt, messages) of
+                                                    every request. messages
+                                                    ends with a user message.
+
+        Returns:
+            str: ID of the submitted batch, passed to poll_batch.
+        """
+        raise NotImplementedError(f"{cls.__name__} does not support batch submission")
+
+    # Abstract (optional)
+    @classmethod
+    def poll_batch(cls, batch_id: str) -> Optional[Dict[str, Optional[str]]]:
+        """
+        Optional. Implemented by model subclasses alongside submit_batch.
+
+        Checks on a batch job and collects its results once it has ended.
+
+        Args:
+            batch_id (str): ID from submit_batch.
+
+        Returns:
+            Optional[Dict[str, Optional[str]]]: None while the batch is still
+                running. Afterwards, the response of every request by
+                custom_id (None for requests that did not succeed).
+        """
+        raise NotImplementedError(f"{cls.__name__} does not support batch submission")
@@ -7,34 +7,91 @@ parent class "Model".
 
 ###############################################################################
 
-from models.model_abstract import Model
+from models.model_abstract import Model, Completion
 import anthropic
-import time
 from utils import read_json, read_yaml
-import copy
+from rate_limit import RateLimitExceeded, RetryableError, parse_retry_after
 from typing import *
 
 class Claude(Model):
     """
     Sublass of "Model" implementing necessary functions for prompting Claude.
     """
+
+    # Message Batches API limits of one job (requests, total request size)
+    BATCH_MAX_REQUESTS = 100_000
+    BATCH_MAX_BYTES = 256_000_000
         
-    def __init__(self, system_prompt: str) -> None:
+    @classmethod
+    def create_client(cls) -> Tuple[anthropic.Anthropic, dict]:
         """ 
-        Initializes a model with: 
-          - System prompt. 
-          - Messages list containing message log between user and assistant.
-          - Client running the language model and handling API key.
+        Creates the client shared by every Claude conversation and loads
+        the model parameters.
+
+        Returns:
+            anthropic.Anthropic: Client handling the API key and connections.
+            dict: Model parameters.
+        """
+        model_params = read_yaml("./config/model_params/claude_params.yaml")
+        client = anthropic.Anthropic(
+            api_key     = read_json("./api_keys.json")['anthropic_api_key'],
+            base_url    = model_params.get("base_url"), # (None selects the Anthropic API)
+            max_retries = 0 # (Retries are handled by Model.generate_with_retries)
+        )
+        return client, model_params
+
+    def __init__(self, system_prompt: str) -> None:
+        """
+        Initializes the conversation.
 
         Args:
             system_prompt (str): System prompt for the model instance.
         """
         super().__init__(system_prompt)
+        self._cached_prefix = 0 # (Number of messages an earlier request marked for prompt caching)
 
-        self._client = anthropic.Anthropic(
-            api_key = read_json("./api_keys.json")['anthropic_api_key']
-        )
-        self._model_params = read_yaml("./config/model_params/claude_params.yaml")
+    @staticmethod
+    def request_params(model_params: dict,
+                       system_prompt: str,
+                       messages: list,
+                       cache_marks: Collection[int] = ()) -> dict:
+        """
+        Builds the messages request body for a conversation. Shared by
+        synchronous requests and batch submissions.
+
+        With the "prompt_caching" model parameter, the messages at
+        cache_marks end prefixes marked for Anthropic's prompt caching: a
+        prefix that a later turn will repeat (the question turn of a
+        two-turn evaluation) is written to the cache, and the later turn
+        reads it back instead of it being processed again.
+
+        Args:
+            model_params (dict): Model parameters.
+            system_prompt (str): System prompt of the conversation.
+            messages (list): Message list history between user and
+                             assistant, ending with the new user message.
+            cache_marks (Collection[int], optional): Indices of the messages
+                                                     ending a cached prefix.
+                                                     Defaults to () (none).
+
+        Returns:
+            dict: Keyword arguments / json body of the messages request.
+        """
+        if model_params.get("prompt_caching") and cache_marks:
+            messages = [message if i not in cache_marks else
+                        {"role": message["role"],
+                         "content": [{"type": "text", "text": message["content"],
+                                      "cache_control": {"type": "ephemeral"}}]}
+                        for i, message in enumerate(messages)]
+
+        return {
+            "model"       : model_params["model"],
+            "system"      : system_prompt,
+            "messages"    : messages,
+            "temperature" : model_params["temperature"],
+            "max_tokens"  : model_params["completion_len"],
+            "top_p"       : model_params["top_p"]
+        }
 
     def get_chat_log(self) -> Tuple[str, list]:
         """
@@ -46,45 +103,127 @@ class Claude(Model):
         """
         return self._system_prompt, self._messages
 
-    def get_response(self, new_message: str, wait_time: int = 4) -> str:
+    def history_truncated(self, length: int) -> None:
+        """
+        Forgets the cached prefix if it included removed messages.
+
+        Args:
+            length (int): Number of messages left in the conversation.
+        """
+        if self._cached_prefix > length:
+            self._cached_prefix = 0
+
+    def generate(self, messages: list) -> Completion:
         """ 
-        Given a new message, 
-         - Updates the messages list with the user's new message and the 
-           assistant's response. 
-         - Returns the assistant's response.
+        Given the message history ending with the user's new message,
+        prompts Claude and returns the assistant's response. With prompt
+        caching, the conversation is marked for caching when a follow-up
+        turn will repeat it, and the prefix an earlier turn cached is
+        marked so it is read back.
 
         Args:
-            new_message (str): Message sent by the user.
+            messages (list): Message list history between user and
+                             assistant, ending with the new user message.
+
+        Raises:
+            RateLimitExceeded: If the Claude rate limit was exceeded.
+            RetryableError: If the request failed for a transient reason
+                            (connection error or server-side error).
 
         Returns:
-            str: Assistant's response to the user's message.
+            Completion: Assistant's response to the last user message, with
+                        token usage including prompt cache reads/writes.
         """
 
         try:
-            # Update message input with user message
-            messages_input = copy.deepcopy(self._messages)
-            messages_input.append({"role": "user", "content": new_message})
-
             # Get completion
+            cache_marks = set()
+            if self._cached_prefix: # (Read back the prefix an earlier turn cached)
+                cache_marks.add(self._cached_prefix - 1)
+            if self._follow_up: # (Cache this request for the turn that follows)
+                cache_marks.add(len(messages) - 1)
             message = self._client.messages.create(
-                model       = self._model_params["model"],
-                system      = self._system_prompt,
-                messages    = messages_input,
-                temperature = self._model_params["temperature"],
-                max_tokens  = self._model_params["completion_len"],
-                top_p       = self._model_params["top_p"]
+                **self.request_params(self._model_params, self._system_prompt, messages, cache_marks)
             )
+            if self._follow_up:
+                self._cached_prefix = len(messages)
 
-            # Extract Claude's response
-            response = message.content[0].text
-            
-            # Update the message log
-            self._messages = messages_input + [{"role": "assistant", 
-                                                "content": response}]
-
-            return response
+            # Extract Claude's response and token usage
+            usage = {
+                "input_tokens"       : message.usage.input_tokens,
+                "output_tokens"      : message.usage.output_tokens,
+                "cache_read_tokens"  : getattr(message.usage, "cache_read_input_tokens", None) or 0,
+                "cache_write_tokens" : getattr(message.usage, "cache_creation_input_tokens", None) or 0
+            }
+            return Completion(message.content[0].text, usage)
         
         except anthropic.RateLimitError as e:
-            print(f"Claude rate limit exceeded. Waiting {wait_time} seconds...")
-            time.sleep(wait_time)
-            return self.get_response(new_message, min(wait_time*2, 60))
+            raise RateLimitExceeded("Claude rate limit exceeded.", parse_retry_after(e.response.headers))
+        except anthropic.APIConnectionError as e:
+            raise RetryableError(f"Claude request failed to connect: {e}")
+        except anthropic.APIStatusError as e:
+            if e.status_code < 500:
+                raise
+            raise RetryableError(f"Claude server error {e.status_code}.", parse_retry_after(e.response.headers))
+
+    @classmethod
+    def batch_entry(cls,
+                    custom_id: str,
+                    system_prompt: str,
+                    messages: list) -> dict:
+        """
+        Builds the entry of one request in a Message Batches job.
+
+        Args:
+            custom_id (str): ID of the request within the batch.
+            system_prompt (str): System prompt of the request.
+            messages (list): Messages of the request.
+
+        Returns:
+            dict: Batch request.
+        """
+        _, model_params = cls.get_shared_client()
+        return {"custom_id": custom_id,
+                "params": cls.request_params(model_params, system_prompt, messages)}
+
+    @classmethod
+    def submit_batch(cls, requests: List[Tuple[str, str, list]]) -> str:
+        """
+        Submits requests as one job to the Anthropic Message Batches API.
+
+        Args:
+            requests (List[Tuple[str, str, list]]): (custom_id, system
+                                                    prompt, messages) of
+                                                    every request.
+
+        Returns:
+            str: ID of the submitted batch.
+        """
+        client, _ = cls.get_shared_client()
+        batch = client.messages.batches.create(requests=[cls.batch_entry(*request) for request in requests])
+        return batch.id
+
+    @classmethod
+    def poll_batch(cls, batch_id: str) -> Optional[Dict[str, Optional[str]]]:
+        """
+        Checks on a batch job and collects its results once it has ended.
+
+        Args:
+            batch_id (str): ID from submit_batch.
+
+        Returns:
+            Optional[Dict[str, Optional[str]]]: None while the batch is still
+                running. Afterwards, the response of every request by
+                custom_id (None for requests that did not succeed).
+        """
+        client, _ = cls.get_shared_client()
+        if client.messages.batches.retrieve(batch_id).processing_status != "ended":
+            return None
+
+        results = {}
+        for entry in client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                results[entry.custom_id] = entry.result.message.content[0].text
+            else:
+                results[entry.custom_id] = None
+        return results
@@ -7,34 +7,67 @@ parent class "Model".
 
 ###############################################################################
 
-from models.model_abstract import Model
+from models.model_abstract import Model, Completion
 import openai
-import time
+import io
+import json
 from utils import read_json, read_yaml
-import copy
+from rate_limit import RateLimitExceeded, RetryableError, parse_retry_after
 from typing import *
 
 class GPT(Model):
     """
     Sublass of "Model" implementing necessary functions for prompting GPT.
     """
+
+    # OpenAI Batch API limits of one job (requests per input file, file size)
+    BATCH_MAX_REQUESTS = 50_000
+    BATCH_MAX_BYTES = 200_000_000
     
-    def __init__(self, system_prompt: str) -> None:
+    @classmethod
+    def create_client(cls) -> Tuple[openai.OpenAI, dict]:
         """ 
-        Initializes a model with: 
-          - System prompt. 
-          - Messages list containing message log between user and assistant.
-          - Client running the language model and handling API key.
+        Creates the client shared by every GPT conversation and loads the
+        model parameters.
 
-        Args:
-            system_prompt (str): System prompt for the model instance.
+        Returns:
+            openai.OpenAI: Client handling the API key and connections.
+            dict: Model parameters.
         """
-        super().__init__(system_prompt)
-
-        self._client = openai.OpenAI(
-            api_key = read_json("./api_keys.json")["openai_api_key"]
+        model_params = read_yaml("./config/model_params/gpt_params.yaml")
+        client = openai.OpenAI(
+            api_key     = read_json("./api_keys.json")["openai_api_key"],
+            base_url    = model_params.get("base_url"), # (None selects the OpenAI API)
+            max_retries = 0 # (Retries are handled by Model.generate_with_retries)
         )
-        self._model_params = read_yaml("./config/model_params/gpt_params.yaml")
+        return client, model_params
+
+    @staticmethod
+    def request_params(model_params: dict,
+                       system_prompt: str,
+                       messages: list) -> dict:
+        """
+        Builds the chat completion request body for a conversation. Shared
+        by synchronous requests and batch submissions.
+
+        Args:
+            model_params (dict): Model parameters.
+            system_prompt (str): System prompt of the conversation.
+            messages (list): Message list history between user and
+                             assistant, ending with the new user message.
+
+        Returns:
+            dict: Keyword arguments / json body of the completion request.
+        """
+        return {
+            "model"             : model_params["model"],
+            "messages"          : [{"role": "system", "content": system_prompt}] + messages,
+            "temperature"       : model_params["temperature"],
+            "max_tokens"        : model_params["completion_len"],
+            "top_p"             : model_params["top_p"],
+            "frequency_penalty" : model_params["frequency_penalty"],
+            "presence_penalty"  : model_params["presence_penalty"]
+        }
 
     def get_chat_log(self) -> Tuple[str, list]:
         """
@@ -46,48 +79,133 @@ class GPT(Model):
         """
         return self._system_prompt, self._messages
 
-    def get_response(self, new_message: str, wait_time: int = 4) -> str:
+    def generate(self, messages: list) -> Completion:
         """ 
-        Given a new message, 
-         - Updates the messages list with the user's new message and the 
-           assistant's response. 
-         - Returns the assistant's response.
+        Given the message history ending with the user's new message,
+        prompts GPT and returns the assistant's response.
 
         Args:
-            new_message (str): Message sent by the user.
-            wait_time (int): Cooldown before prompting model again.
+            messages (list): Message list history between user and
+                             assistant, ending with the new user message.
+
+        Raises:
+            RateLimitExceeded: If the GPT rate limit was exceeded.
+            RetryableError: If the request failed for a transient reason
+                            (connection error or server-side error).
 
         Returns:
-            str: Assistant's response to the user's message.
+            Completion: Assistant's response to the last user message, with
+                        token usage. OpenAI caches long prompt prefixes
+                        automatically and counts the cached part in
+                        prompt_tokens; it is reported as cache_read_tokens
+                        and not as input_tokens, as for Claude.
         """
 
         try:
-            # Update message input with user message
-            messages_input = copy.deepcopy(self._messages)
-            messages_input.insert(0, {"role": "system", "content": self._system_prompt})
-            messages_input.append({"role": "user", "content": new_message})
-
             # Get completion
             completion = self._client.chat.completions.create(
-                model             = self._model_params["model"],
-                messages          = messages_input,
-                temperature       = self._model_params["temperature"],
-                max_tokens        = self._model_params["completion_len"],
-                top_p             = self._model_params["top_p"],
-                frequency_penalty = self._model_params["frequency_penalty"],
-                presence_penalty  = self._model_params["presence_penalty"]
+                **self.request_params(self._model_params, self._system_prompt, messages)
             )
 
-            # Extract GPT's response
-            response = completion.choices[0].message.content
-            
-            # Update the message log (without system prompt)
-            self._messages = messages_input[1:] + [{"role": "assistant", 
-                                                "content": response}]
-
-            return response
+            # Extract GPT's response and token usage
+            details = getattr(completion.usage, "prompt_tokens_details", None)
+            cached_tokens = getattr(details, "cached_tokens", None) or 0
+            usage = {
+                "input_tokens"      : completion.usage.prompt_tokens - cached_tokens,
+                "output_tokens"     : completion.usage.completion_tokens,
+                "cache_read_tokens" : cached_tokens
+            }
+            return Completion(completion.choices[0].message.content, usage)
         
-        except openai.RateLimitError:
-            print(f"GPT rate limit exceeded. Waiting {wait_time} seconds...")
-            time.sleep(wait_time)
-            return self.get_response(new_message, min(wait_time*2, 60))
+        except openai.RateLimitError as e:
+            raise RateLimitExceeded("GPT rate limit exceeded.", parse_retry_after(e.response.headers))
+        except openai.APIConnectionError as e:
+            raise RetryableError(f"GPT request failed to connect: {e}")
+        except openai.APIStatusError as e:
+            if e.status_code < 500:
+                raise
+            raise RetryableError(f"GPT server error {e.status_code}.", parse_retry_after(e.response.headers))
+
+    @classmethod
+    def batch_entry(cls,
+                    custom_id: str,
+                    system_prompt: str,
+                    messages: list) -> dict:
+        """
+        Builds the line of one request in a batch input file, see
+        https://platform.openai.com/docs/guides/batch
+
+        Args:
+            custom_id (str): ID of the request within the batch.
+            system_prompt (str): System prompt of the request.
+            messages (list): Messages of the request.
+
+        Returns:
+            dict: Batch input line.
+        """
+        _, model_params = cls.get_shared_client()
+        return {"custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": cls.request_params(model_params, system_prompt, messages)}
+
+    @classmethod
+    def submit_batch(cls, requests: List[Tuple[str, str, list]]) -> str:
+        """
+        Uploads requests as a JSONL file and submits it as one batch job to
+        the OpenAI Batch API.
+
+        Args:
+            requests (List[Tuple[str, str, list]]): (custom_id, system
+                                                    prompt, messages) of
+                                                    every request.
+
+        Returns:
+            str: ID of the submitted batch.
+        """
+        client, _ = cls.get_shared_client()
+        lines = [json.dumps(cls.batch_entry(*request)) for request in requests]
+        payload = io.BytesIO("\n".join(lines).encode("utf-8"))
+
+        batch_file = client.files.create(file=("batch.jsonl", payload), purpose="batch")
+        batch = client.batches.create(input_file_id=batch_file.id,
+                                      endpoint="/v1/chat/completions",
+                                      completion_window="24h")
+        return batch.id
+
+    @classmethod
+    def poll_batch(cls, batch_id: str) -> Optional[Dict[str, Optional[str]]]:
+        """
+        Checks on a batch job and collects its results once it has ended.
+
+        Args:
+            batch_id (str): ID from submit_batch.
+
+        Raises:
+            RuntimeError: If the batch failed validation.
+
+        Returns:
+            Optional[Dict[str, Optional[str]]]: None while the batch is still
+                running. Afterwards, the response of every request by
+                custom_id (None for requests that did not succeed).
+        """
+        client, _ = cls.get_shared_client()
+        batch = client.batches.retrieve(batch_id)
+        if batch.status == "failed":
+            raise RuntimeError(f"GPT batch {batch_id} failed: {batch.errors}")
+        if batch.status not in ("completed", "expired", "cancelled"):
+            return None
+
+        # Expired and cancelled batches still return what finished in time
+        results = {}
+        if batch.output_file_id is not None:
+            for line in client.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if response.get("status_code") == 200:
+                    results[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+                else:
+                    results[result["custom_id"]] = None
+        return results
@@ -8,9 +8,9 @@ parent class "Model".
 ###############################################################################
 
 from models.model_abstract import Model
-import requests, time
+import requests
 from utils import read_json, read_yaml
-import copy
+from rate_limit import RateLimitExceeded, RetryableError, parse_retry_after
 from typing import *
 
 class Llama3(Model):
@@ -18,25 +18,72 @@ class Llama3(Model):
     Sublass of "Model" implementing necessary functions for prompting Llama3.
     """
     
-    def __init__(self, system_prompt: str) -> None:
+    API_URL = "https://api-inference.huggingface.co/models/meta-llama/Meta-Llama-3-8B-Instruct"
+
+    @classmethod
+    def create_client(cls) -> Tuple[requests.Session, dict]:
         """ 
-        Initializes a model with: 
-          - System prompt. 
-          - Messages list containing message log between user and assistant.
-          - Client running the language model and handling API key.
+        Creates the HTTP session shared by every Llama3 conversation and
+        loads the model parameters. The session keeps connections to the
+        inference API alive between requests.
+
+        Returns:
+            requests.Session: Session carrying the API token.
+            dict: Model parameters.
+        """
+        session = requests.Session()
+        session.headers.update({"Authorization": f"Bearer {read_json('./api_keys.json')['llama3_hgface_api']}"})
+
+        # Keep enough pooled connections for concurrent conversations
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=64)
+        session.mount("https://", adapter)
+
+        model_params = read_yaml("./config/model_params/llama3_params.yaml")
+        return session, model_params
+
+    def __init__(self, system_prompt: str) -> None:
+        """
+        Initializes the conversation and the rendered llama 3 prompt, which
+        starts with the system prompt.
 
         Args:
             system_prompt (str): System prompt for the model instance.
         """
         super().__init__(system_prompt)
+        self._prompt_parts = [f"<|begin_of_text|><|start_header_id|>system<|end_header_id|> {system_prompt} "]
+        self._rendered = 0 # (Number of messages in _prompt_parts)
+
+    def render_prompt(self, messages: list) -> str:
+        """
+        Builds the llama 3 query for the message history. Messages rendered
+        for an earlier turn are kept and only the new ones are formatted
+        (history_truncated drops the rendering of removed messages).
 
-        self.API_URL = "https://api-inference.huggingface.co/models/meta-llama/Meta-Llama-3-8B-Instruct"
-       
-        self.API_TOKEN = read_json("./api_keys.json")["llama3_hgface_api"]
-        
-        self.headers = {"Authorization": f"Bearer {self.API_TOKEN}"}
+        Args:
+            messages (list): Message list history between user and
+                             assistant, ending with the new user message.
 
-        self._model_params = read_yaml("./config/model_params/llama3_params.yaml")
+        Returns:
+            str: Prompt ending with the assistant header.
+        """
+        for message in messages[self._rendered:]:
+            if message["role"] == "user":
+                self._prompt_parts.append(f"<|eot_id|><|start_header_id|>user<|end_header_id|> {message['content']} ")
+            elif message["role"] == "assistant":
+                self._prompt_parts.append(f"<|eot_id|><|start_header_id|>assistant<|end_header_id|> {message['content']} ")
+        self._rendered = len(messages)
+        return "".join(self._prompt_parts) + "<|eot_id|><|start_header_id|>assistant<|end_header_id|>"
+
+    def history_truncated(self, length: int) -> None:
+        """
+        Drops the rendering of messages removed from the conversation (a
+        rewound or failed turn), so they aren't sent with the next query.
+
+        Args:
+            length (int): Number of messages left in the conversation.
+        """
+        del self._prompt_parts[1 + length:] # (One part per message after the system prompt)
+        self._rendered = min(self._rendered, length)
 
     def get_chat_log(self) -> Tuple[str, list]:
         """
@@ -48,57 +95,53 @@ class Llama3(Model):
         """
         return self._system_prompt, self._messages
 
-    def get_response(self, new_message: str, wait_time: int = 4) -> str:
+    def generate(self, messages: list) -> str:
         """ 
-        Given a new message, 
-         - Updates the messages list with the user's new message and the 
-           assistant's response. 
-         - Returns the assistant's response.
+        Given the message history ending with the user's new message,
+        prompts Llama3 and returns the assistant's response.
 
         Args:
-            new_message (str): Message sent by the user.
-            wait_time (int): Cooldown before prompting model again.
+            messages (list): Message list history between user and
+                             assistant, ending with the new user message.
+
+        Raises:
+            RateLimitExceeded: If the inference API's rate limit was
+                               exceeded.
+            RetryableError: If the request failed for a transient reason
+                            (connection error, model still loading,
+                            malformed response).
 
         Returns:
-            str: Assistant's response to the user's message.
+            str: Assistant's response to the last user message.
         """
 
+        query = {
+                "inputs": self.render_prompt(messages),
+                "parameters" : {"temperature": self._model_params["temperature"]+1e-3, 
+                                "top_p": self._model_params["top_p"]-1e-3, 
+                                "max_length": self._model_params["completion_len"]}}
+
+        # Get completion
+        try:
+            response = self._client.post(self.API_URL, json=query)
+        except requests.RequestException as e:
+            raise RetryableError(f"Llama3 request failed to connect: {e}")
+
+        if response.status_code == 429:
+            raise RateLimitExceeded("Hugging Face inference API for Llama3 rate limit exceeded.",
+                                    parse_retry_after(response.headers))
+        if response.status_code >= 500:
+            # (503 while the model is loading, with an estimate of how long)
+            try:
+                estimated_time = response.json().get("estimated_time")
+            except (ValueError, AttributeError):
+                estimated_time = None
+            raise RetryableError(f"Hugging Face inference API for Llama3 unavailable ({response.status_code}).",
+                                 parse_retry_after(response.headers) or estimated_time)
+        response.raise_for_status()
+
+        # Extract llama's response
         try:
-            # Update message input with user message
-            messages_input = copy.deepcopy(self._messages)
-            messages_input.insert(0, {"role": "system", "content": self._system_prompt})
-            messages_input.append({"role": "user", "content": new_message})
-
-            # Parse the messages log to generate llama 3 query
-            query_input = ""
-            for message in messages_input:
-                if message["role"] == "system":
-                    query_input += f"<|begin_of_text|><|start_header_id|>system<|end_header_id|> {message["content"]} "
-                elif message["role"] == "user":
-                    query_input += f"<|eot_id|><|start_header_id|>user<|end_header_id|> {message["content"]} "
-                elif message["role"] == "assistant":
-                    query_input += f"<|eot_id|><|start_header_id|>assistant<|end_header_id|> {message["content"]} "
-            query_input += "<|eot_id|><|start_header_id|>assistant<|end_header_id|>"
-
-            query = {
-                    "inputs": query_input,
-                    "parameters" : {"temperature": self._model_params["temperature"]+1e-3, 
-                                    "top_p": self._model_params["top_p"]-1e-3, 
-                                    "max_length": self._model_params["completion_len"]}}
-
-            # Get completion
-            completion = requests.post(self.API_URL, headers=self.headers, json=query).json()
-            
-            # Extract llama's response
-            response = completion[0]['generated_text'][len(query['inputs'])+2:]
-            
-            # Update the message log (without system prompt)
-            self._messages = messages_input[1:] + [{"role": "assistant", 
-                                                "content": response}]
-            return response
-
-        except:
-            print(f"Hugging Face inference API for Llama3 rate limit exceeded. Waiting {wait_time} seconds...")
-            time.sleep(wait_time)
-            return self.get_response(new_message, min(wait_time*2, 60))
-        
\ No newline at end of file
+            return response.json()[0]['generated_text'][len(query['inputs'])+2:]
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise RetryableError("Hugging Face inference API for Llama3 returned an unexpected response.")
@@ -0,0 +1,100 @@
+"""
+model_llamacpp.py
+
+This file implements the class "LlamaCpp" which inherits from abstract
+parent class "Model". It runs a quantized GGUF model in-process on the CPU
+through llama-cpp-python ("pip install llama-cpp-python"), for offline runs
+on machines without an inference server.
+
+The model weights are loaded once and shared by every conversation. A
+llama.cpp context evaluates one sequence at a time, so concurrent
+conversations take turns; to batch conversations across forward passes,
+serve the model instead and use models.model_local. The KV state computed
+for each turn is kept in a RAM cache, so a follow-up turn only evaluates
+the tokens added since.
+"""
+
+###############################################################################
+
+from models.model_abstract import Model, Completion
+import llama_cpp
+import threading
+from utils import read_yaml
+from typing import *
+
+class LlamaCpp(Model):
+    """
+    Sublass of "Model" implementing necessary functions for prompting a
+    model through llama-cpp-python.
+    """
+
+    # A llama.cpp context is not safe to use from several threads at once
+    _inference_lock = threading.Lock()
+
+    @classmethod
+    def create_client(cls) -> Tuple[llama_cpp.Llama, dict]:
+        """
+        Loads the model weights shared by every conversation and the model
+        parameters.
+
+        Returns:
+            llama_cpp.Llama: Loaded model.
+            dict: Model parameters.
+        """
+        model_params = read_yaml("./config/model_params/llamacpp_params.yaml")
+        llm = llama_cpp.Llama(
+            model_path   = model_params["model_path"],
+            n_ctx        = model_params["n_ctx"],
+            n_threads    = model_params.get("n_threads"), # (None uses all cores)
+            n_batch      = model_params.get("n_batch", 512),
+            n_gpu_layers = model_params.get("n_gpu_layers", 0),
+            verbose      = False
+        )
+
+        # Keep the KV state of finished turns, so the principle turn of a
+        # conversation resumes from its reasoning turn instead of processing
+        # the whole prompt again (conversations interleave on the context)
+        if model_params.get("prompt_cache_bytes"):
+            llm.set_cache(llama_cpp.LlamaRAMCache(capacity_bytes=model_params["prompt_cache_bytes"]))
+        return llm, model_params
+
+    def get_chat_log(self) -> Tuple[str, list]:
+        """
+        Returns the system prompt and messages list.
+
+        Returns:
+            str: System prompt
+            list: Message list history between user and assistant.
+        """
+        return self._system_prompt, self._messages
+
+    def generate(self, messages: list) -> Completion:
+        """
+        Given the message history ending with the user's new message,
+        prompts the model and returns the assistant's response. The chat
+        template stored in the GGUF file is applied by llama-cpp-python.
+
+        Args:
+            messages (list): Message list history between user and
+                             assistant, ending with the new user message.
+
+        Returns:
+            Completion: Assistant's response to the last user message, with
+                        token usage.
+        """
+
+        # Get completion
+        with self._inference_lock:
+            completion = self._client.create_chat_completion(
+                messages    = [{"role": "system", "content": self._system_prompt}] + messages,
+                temperature = self._model_params["temperature"],
+                max_tokens  = self._model_params["completion_len"],
+                top_p       = self._model_params["top_p"]
+            )
+
+        # Extract the response and token usage
+        usage = {
+            "input_tokens"  : completion["usage"]["prompt_tokens"],
+            "output_tokens" : completion["usage"]["completion_tokens"]
+        }
+        return Completion(completion["choices"][0]["message"]["content"], usage)
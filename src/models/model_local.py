@@ -0,0 +1,107 @@
+"""
+model_local.py
+
+This file implements the class "LocalServer" which inherits from abstract
+parent class "Model". It prompts a model served on our own machines through
+an OpenAI-compatible chat completions endpoint, such as vLLM
+("vllm serve meta-llama/Meta-Llama-3-8B-Instruct") or the llama.cpp server.
+
+The server applies the model's own chat template, so no prompt string is
+built here. One HTTP client with pooled keep-alive connections is shared by
+every conversation, and conversations sent concurrently (main.py --workers)
+are batched together by the server into shared forward passes. Every turn
+resends the conversation unchanged plus the new message, so servers with
+prefix caching only process the new tokens (see local_params.yaml).
+"""
+
+###############################################################################
+
+from models.model_abstract import Model, Completion
+import openai
+from utils import read_yaml
+from rate_limit import RateLimitExceeded, RetryableError, parse_retry_after
+from typing import *
+
+class LocalServer(Model):
+    """
+    Sublass of "Model" implementing necessary functions for prompting a
+    local OpenAI-compatible inference server.
+    """
+
+    @classmethod
+    def create_client(cls) -> Tuple[openai.OpenAI, dict]:
+        """
+        Creates the client shared by every conversation and loads the model
+        parameters. Local servers normally need no API key, so none is read
+        from api_keys.json.
+
+        Returns:
+            openai.OpenAI: Client pooling connections to the local server.
+            dict: Model parameters.
+        """
+        model_params = read_yaml("./config/model_params/local_params.yaml")
+        client = openai.OpenAI(
+            api_key     = model_params.get("api_key") or "EMPTY",
+            base_url    = model_params["base_url"],
+            max_retries = 0 # (Retries are handled by Model.generate_with_retries)
+        )
+        return client, model_params
+
+    def get_chat_log(self) -> Tuple[str, list]:
+        """
+        Returns the system prompt and messages list.
+
+        Returns:
+            str: System prompt
+            list: Message list history between user and assistant.
+        """
+        return self._system_prompt, self._messages
+
+    def generate(self, messages: list) -> Completion:
+        """
+        Given the message history ending with the user's new message,
+        prompts the local model and returns the assistant's response.
+
+        Args:
+            messages (list): Message list history between user and
+                             assistant, ending with the new user message.
+
+        Raises:
+            RateLimitExceeded: If the server rejected the request as
+                               overloaded.
+            RetryableError: If the request failed for a transient reason
+                            (server not up yet or server-side error).
+
+        Returns:
+            Completion: Assistant's response to the last user message, with
+                        token usage when the server reports it.
+        """
+
+        try:
+            # Get completion
+            completion = self._client.chat.completions.create(
+                model       = self._model_params["model"],
+                messages    = [{"role": "system", "content": self._system_prompt}] + messages,
+                temperature = self._model_params["temperature"],
+                max_tokens  = self._model_params["completion_len"],
+                top_p       = self._model_params["top_p"],
+                extra_body  = self._model_params.get("extra_body")
+            )
+
+            # Extract the response and, if reported, token usage
+            usage = None
+            if completion.usage is not None:
+                usage = {
+                    "input_tokens"  : completion.usage.prompt_tokens,
+                    "output_tokens" : completion.usage.completion_tokens
+                }
+            return Completion(completion.choices[0].message.content, usage)
+
+        except openai.RateLimitError as e:
+            raise RateLimitExceeded("Local server is overloaded.", parse_retry_after(e.response.headers))
+        except openai.APIConnectionError as e:
+            raise RetryableError(f"Local server at {self._model_params['base_url']} is unreachable: {e}")
+        except openai.APIStatusError as e:
+            if e.status_code < 500:
+                raise
+            raise RetryableError(f"Local server error {e.status_code}.", parse_retry_after(e.response.headers))
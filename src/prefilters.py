@@ -0,0 +1,123 @@
+"""
+prefilters.py
+
+This file implements the deterministic rules of the pre-filter stage
+(main.py --prefilter). Before a question-criterion pair is sent to the
+model, the rules of its criterion look at the mcq itself; when a rule can
+decide the rating, the model is not asked at all.
+
+The following rules are implemented:
+  - Criterion 3, "duplicate_choices": Two choices are the same text after
+      normalization (case, spacing and a trailing period), so the options
+      are repeated choices (rating 3).
+  - Criterion 5, "no_code": Neither the question nor any choice contains
+      anything resembling code (rating 4, "There is no code in the
+      question"). Code detection errs on the side of finding code, so the
+      rule only fires on plain prose.
+  - Criterion 2, "no_answer_marked": No choice is marked correct. The rating
+      can't be 1, but whether a correct choice exists (2, 3 or 4) still
+      needs the model, so the rule is only recorded.
+
+The following functions are implemented:
+  - apply_prefilter: Runs the rules of a criterion on an mcq.
+  - normalize_choice: Normalizes a choice's text for comparison.
+  - contains_code: Heuristic check for code in a text.
+"""
+
+###############################################################################
+
+import re
+from typing import *
+
+class RuleResult(NamedTuple):
+    """
+    A rule that fired for a question-criterion pair, and the rating it
+    decided (None if the pair still needs the model).
+    """
+    rule: str
+    rating: Optional[str] = None
+
+# Anything that may be code: fences or inline code, indented lines, calls,
+# operators and statement punctuation, and common keywords
+CODE_PATTERN = re.compile(
+    r"```|`[^`]+`"
+    r"|\n[ \t]{2,}\S"
+    r"|[A-Za-z_]\w*\s*\("
+    r"|==|!=|<=|>=|\+=|-=|\*=|/=|=>|->|&&|\|\||::"
+    r"|[;{}\[\]]"
+    r"|\b(def|class|import|return|print|lambda|elif|None|True|False|self|"
+    r"int|float|str|list|dict|tuple|set|range|len|void|public|static|var|let|const|null)\b"
+    r"|\w\s*=\s*\S"
+)
+
+def normalize_choice(text: Any) -> str:
+    """
+    Normalizes a choice for comparison: case-folded, runs of spaces and
+    tabs collapsed, and surrounding spaces and a trailing period removed.
+    Line breaks are kept, as they matter in code output choices.
+
+    Args:
+        text (Any): Text of a choice.
+
+    Returns:
+        str: Normalized text.
+    """
+    text = re.sub(r"[ \t]+", " ", str(text).casefold())
+    return text.strip(" \t").rstrip(".").strip(" \t")
+
+def contains_code(text: str) -> bool:
+    """
+    Checks whether a text may contain code.
+
+    Args:
+        text (str): Text to check.
+
+    Returns:
+        bool: True if anything in text resembles code.
+    """
+    return CODE_PATTERN.search(text) is not None
+
+def _duplicate_choices(mcq) -> Optional[RuleResult]:
+    choices = [normalize_choice(choice.get("choice")) for choice in mcq.get("choices", [])]
+    if len(set(choices)) < len(choices):
+        return RuleResult("duplicate_choices", "3")
+    return None
+
+def _no_code(mcq) -> Optional[RuleResult]:
+    texts = [str(mcq.get("question", ""))] + [str(choice.get("choice")) for choice in mcq.get("choices", [])]
+    if not any(contains_code(text) for text in texts):
+        return RuleResult("no_code", "4")
+    return None
+
+def _no_answer_marked(mcq) -> Optional[RuleResult]:
+    if not any(str(choice.get("correct")).strip().lower() == "true" for choice in mcq.get("choices", [])):
+        return RuleResult("no_answer_marked")
+    return None
+
+# Rules of each criterion, tried in order
+PREFILTERS: Dict[str, List[Callable[[Any], Optional[RuleResult]]]] = {
+    "2": [_no_answer_marked],
+    "3": [_duplicate_choices],
+    "5": [_no_code],
+}
+
+def apply_prefilter(mcq,
+                    crit: str) -> Optional[RuleResult]:
+    """
+    Runs the rules of a criterion on an mcq and returns the first one that
+    fires.
+
+    Args:
+        mcq (_type_): Multiple-choice question data.
+        crit (str): Criterion being evaluated.
+
+    Returns:
+        Optional[RuleResult]: Rule that fired, or None.
+    """
+    if not isinstance(mcq, dict):
+        return None
+    for rule in PREFILTERS.get(crit, []):
+        result = rule(mcq)
+        if result is not None:
+            return result
+    return None
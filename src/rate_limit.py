@@ -0,0 +1,174 @@
+"""
+rate_limit.py
+
+This file implements the rate limiting shared by all conversations of a
+model (and therefore by all worker threads of a run).
+
+  - RetryableError / RateLimitExceeded: Raised by Model.generate
+      implementations for failed requests that should be retried later.
+      They carry the provider's Retry-After hint when there is one.
+  - RateLimiter: Token buckets for requests per minute and tokens per
+      minute. Every request waits for capacity before it is sent, and a
+      rate-limit response pauses all requests of the model at once.
+  - backoff_delay: Jittered exponential backoff that honors Retry-After.
+  - parse_retry_after: Reads a Retry-After value from response headers.
+
+Limits are configured per model in config/model_params/*.yaml with the
+optional keys "requests_per_minute" and "tokens_per_minute".
+"""
+
+###############################################################################
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import *
+
+class RetryableError(Exception):
+    """
+    A request failed for a transient reason and should be retried later.
+    """
+
+    def __init__(self, message: str,
+                 retry_after: Optional[float] = None) -> None:
+        """
+        Args:
+            message (str): Description of the failure.
+            retry_after (Optional[float], optional): Seconds the provider
+                                                     asked us to wait, if it
+                                                     said. Defaults to None.
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class RateLimitExceeded(RetryableError):
+    """
+    The provider rejected a request because a rate limit was exceeded.
+    """
+
+class RateLimiter:
+    """
+    Thread-safe token buckets limiting requests per minute and (estimated)
+    input tokens per minute. A limit of None is unlimited.
+    """
+
+    def __init__(self,
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None) -> None:
+        """
+        Args:
+            requests_per_minute (Optional[float], optional): Request quota.
+            tokens_per_minute (Optional[float], optional): Token quota.
+        """
+        self._capacity = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self._level = {name: capacity for name, capacity in self._capacity.items()}
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        """
+        Adds the capacity earned since the last refill. Caller holds the lock.
+
+        Args:
+            now (float): Current time.monotonic().
+        """
+        elapsed = now - self._updated
+        self._updated = now
+        for name, capacity in self._capacity.items():
+            if capacity is not None:
+                self._level[name] = min(capacity, self._level[name] + elapsed * capacity / 60)
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        Blocks until one request of the given size fits in the quota (and
+        any pause has ended), then takes it from the buckets.
+
+        Args:
+            tokens (int, optional): Estimated tokens of the request.
+                                    Defaults to 0.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        start = time.monotonic()
+        need = {"requests": 1, "tokens": tokens}
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                # Seconds until every bucket holds enough (requests larger
+                # than a whole minute of quota only wait for a full bucket)
+                wait = self._paused_until - now
+                for name, capacity in self._capacity.items():
+                    if capacity is not None:
+                        missing = min(need[name], capacity) - self._level[name]
+                        wait = max(wait, missing * 60 / capacity)
+
+                if wait <= 0:
+                    for name, capacity in self._capacity.items():
+                        if capacity is not None:
+                            self._level[name] -= min(need[name], capacity)
+                    return now - start
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Holds back every request of this limiter for the given time, e.g.
+        after the provider answered with a rate-limit error.
+
+        Args:
+            seconds (float): Length of the pause.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+def backoff_delay(attempt: int,
+                  retry_after: Optional[float] = None,
+                  base: float = 2,
+                  cap: float = 60) -> float:
+    """
+    Computes how long to wait before retrying a failed request. The
+    provider's Retry-After is used when given; otherwise "full jitter"
+    exponential backoff spreads retries of concurrent workers apart.
+
+    Args:
+        attempt (int): Number of failed attempts so far (0-based).
+        retry_after (Optional[float], optional): Provider's requested wait.
+        base (float, optional): Backoff of the first retry. Defaults to 2.
+        cap (float, optional): Longest backoff. Defaults to 60.
+
+    Returns:
+        float: Seconds to wait.
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 1)
+    return random.uniform(base / 2, min(cap, base * 2 ** attempt))
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Reads the requested wait from "retry-after-ms" or "retry-after"
+    response headers (seconds or an HTTP date).
+
+    Args:
+        headers (Mapping[str, str]): Response headers.
+
+    Returns:
+        Optional[float]: Seconds to wait, or None if not given.
+    """
+    if headers is None:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after") is not None:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
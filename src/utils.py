@@ -1,7 +1,7 @@
 """
 utils.py
 
-This file has two major sections:
+This file has four major sections:
 
 FILE READ/WRITE HELPERS:
   This section implements various helper functions for reading and writing
@@ -11,6 +11,38 @@ FILE READ/WRITE HELPERS:
     - write_json: Saving .json.
     - read_yaml: Loading .yaml.
     - read_file: Loading .txt.
+    - write_csv_atomic: Saving a dataframe as .csv without ever leaving a
+                        partially written file behind.
+    - write_json_atomic: Saving .json the same way.
+    - write_response_log: Saving a conversation's full message log.
+
+RESULT JOURNAL:
+  This section implements the append-only journal that records every
+  finished rating of a run. The journal, not "evaluation.csv", is the source
+  of truth while a run is in progress.
+  The following functions are implemented:
+    - append_journal: Durably records one finished rating.
+    - replay_journal: Applies journaled ratings to an evaluations dataframe.
+    - question_rows: Lists the rows of every question in an evaluations
+                     dataframe.
+    - write_values: Writes evaluation columns to every row of a question.
+
+PROMPT TEMPLATES:
+  This section implements loading the three prompt files that make up a
+  criterion (see config/README.md) into a validated, cached bundle.
+  The following are implemented:
+    - CriterionBundle: The system, question and principle prompts of one
+                       criterion.
+    - load_criterion_bundle: Loads and validates one criterion's prompts.
+    - load_criterion_bundles: Loads the bundles for all selected criteria.
+    - parse_rating: Reads a criterion's evaluation key from a free-form
+                    reply.
+    - parse_structured_response: Reads the rating from a json response.
+    - parse_structured_confidence: Reads the confidence from a json
+                                   response.
+    - fuse_system_prompts: Merges the system prompts of several criteria.
+    - render_fused: Builds the prompt rating one mcq for several criteria.
+    - parse_fused_response: Reads per-criterion ratings from a json response.
 
 MODEL-RUNNING FUNCTIONS:
   This section implements functions required for running a model and generating
@@ -18,20 +50,54 @@ MODEL-RUNNING FUNCTIONS:
   The following functions are implemented:
     - get_model: Fetches the model constructor for the experiment.
     - run_model: Performs experiment and generates output.
+    - load_evaluations: Loads the gold labels or an in-progress results csv.
+    - plan_tasks: Lists the question-criterion pairs still to be evaluated.
+    - eligible_rows: Finds the questions a run may evaluate.
+    - build_active_sampler: Sets up adaptive evaluation (--target-ci-width).
+    - parse_shard: Reads a "--shard i/n" argument.
+    - shard_of: Assigns a question to one of n shards.
+    - print_plan: Summarizes a work plan (used by --dry-run).
+    - eval_task: Evaluates one question-criterion pair on a worker thread.
+    - eval_samples: Majority vote over several sampled conversations
+                    (self-consistency mode).
+    - votes_needed: Number of further samples that could decide a vote.
+    - vote_result: The winning rating and vote columns of a criterion.
+    - sampled_model: Constructor for the conversations of one sample.
+    - retried_model: Constructor for the conversations of one attempt.
+    - build_message_log: Builds the response log of a finished conversation.
     - eval: Helper used by run_model to compute model's criterion rating 
             for question.
+    - eval_structured: Single-request alternative to eval that asks for
+                       reasoning and rating as one json object.
+    - eval_confidence: eval_structured that also asks for a confidence
+                       (cheap model of cascade mode).
+    - eval_fused: Rates one question for several criteria in a single
+                  request.
 """
 
 ###############################################################################
 
 import json
 import yaml
+import hashlib
+import re
 import importlib
 import inspect
 from models.model_abstract import Model
+from rate_limit import RetryableError
+from mcq_sources import open_mcq_source
+from cascade import CascadeRule, should_escalate
+from prefilters import apply_prefilter
+from active import ActiveSampler
+import metrics
 import pandas as pd
+import numpy as np
 import os
+import threading
+import time
 from tqdm import tqdm
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import *
 
 ###############################################################################
@@ -94,6 +160,461 @@ def read_file(path: str) -> str:
     with open(path, 'r') as file:
         return file.read()
     
+def write_csv_atomic(df: pd.DataFrame,
+                     path: str) -> None:
+    """
+    Writes a dataframe to a csv file at path. The csv is first written to a
+    temporary file next to path and then moved into place, so an interrupt
+    leaves either the old or the new file, never a truncated one.
+
+    Args:
+        df (pd.DataFrame): Dataframe to save.
+        path (str): Path to csv file.
+    """
+    tmp_path = f"{path}.tmp"
+    df.to_csv(tmp_path)
+    os.replace(tmp_path, path)
+
+def write_json_atomic(path: str,
+                      contents) -> None:
+    """
+    Writes contents to a json file at path through a temporary file, like
+    write_csv_atomic, so readers never see a partially written file.
+
+    Args:
+        path (str): Path to json file.
+        contents (_type_): Data to be written to json file.
+    """
+    tmp_path = f"{path}.tmp"
+    write_json(tmp_path, contents)
+    os.replace(tmp_path, path)
+
+def write_response_log(out_directory: str,
+                       crit: str,
+                       questionID: str,
+                       model_output: list) -> None:
+    """
+    Saves the full message log of a question-criterion conversation to
+    "out_directory/responses/criteria_{crit}/{questionID}.json".
+
+    Args:
+        out_directory (str): Path to the experiment's output directory.
+        crit (str): Criterion that was evaluated.
+        questionID (str): Question that was evaluated.
+        model_output (list): Message log, starting with the system prompt.
+    """
+    # Create output response directory if it doesn't exist
+    out_response_path = os.path.join(out_directory, f"responses/criteria_{crit}")
+    if not os.path.exists(out_response_path):
+        os.makedirs(out_response_path, exist_ok=True)
+
+    write_json(os.path.join(out_response_path, f"{questionID}.json"), model_output)
+
+###############################################################################
+
+##################
+# RESULT JOURNAL #
+##################
+
+def append_journal(journal_file: TextIO,
+                   questionID: str,
+                   values: Dict[str, str]) -> None:
+    """
+    Appends one record to a run's journal and flushes it to disk before
+    returning. A record is a single json line, so a crash can at worst lose
+    the line being written, which replay_journal then ignores.
+
+    Args:
+        journal_file (TextIO): Journal opened in append mode.
+        questionID (str): Question the values belong to.
+        values (Dict[str, str]): Evaluation columns and their new values,
+                                 e.g. {"auto 3": "1"}.
+    """
+    journal_file.write(json.dumps({"questionID": questionID, "values": values}) + "\n")
+    journal_file.flush()
+    os.fsync(journal_file.fileno())
+
+def question_rows(df: pd.DataFrame) -> Dict[str, list]:
+    """
+    Lists the rows of every question in an evaluations dataframe. A gold
+    labels sheet may hold a questionID more than once; its ratings go to
+    every one of its rows.
+
+    Args:
+        df (pd.DataFrame): Evaluations dataframe.
+
+    Returns:
+        Dict[str, list]: Index labels of the rows of each questionID, in
+                         order.
+    """
+    rows_of = {}
+    for questionID, row in zip(df["questionID"], df.index):
+        rows_of.setdefault(questionID, []).append(row)
+    return rows_of
+
+def write_values(df: pd.DataFrame,
+                 rows: list,
+                 values: Dict[str, str]) -> None:
+    """
+    Writes evaluation columns to the rows of one question, adding columns
+    the dataframe doesn't have yet.
+
+    Args:
+        df (pd.DataFrame): Evaluations dataframe, updated in place.
+        rows (list): Index labels of the question's rows (see
+                     question_rows).
+        values (Dict[str, str]): Evaluation columns and their new values.
+    """
+    for col, value in values.items():
+        if col not in df.columns:
+            df[col] = None
+        df.loc[rows, col] = value
+
+def replay_journal(df: pd.DataFrame,
+                   journal_path: str) -> int:
+    """
+    Applies every record in the journal at journal_path to the evaluations
+    dataframe, in the order they were written. Missing journals and
+    incomplete trailing lines are ignored.
+
+    Args:
+        df (pd.DataFrame): Evaluations dataframe, updated in place.
+        journal_path (str): Path to the run's journal.
+
+    Returns:
+        int: Number of records applied.
+    """
+    if not os.path.isfile(journal_path):
+        return 0
+    rows_of = question_rows(df)
+
+    applied = 0
+    with open(journal_path, 'r', encoding="utf-8") as journal_file:
+        for line in journal_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # (Torn write from an interrupted run)
+            if record["questionID"] not in rows_of:
+                continue
+            write_values(df, rows_of[record["questionID"]], record["values"])
+            applied += 1
+    return applied
+
+###############################################################################
+
+####################
+# PROMPT TEMPLATES #
+####################
+
+# Appended to the combined prompt of the structured strategy
+STRUCTURED_INSTRUCTIONS = """
+
+Instead of returning only the evaluation key, first reason about the question and then give the evaluation key. Respond with a single JSON object and nothing else, in this form:
+{"reasoning": "<your assessment of the question>", "rating": <evaluation key>}"""
+
+# Replaces STRUCTURED_INSTRUCTIONS when the model should also say how sure it is
+CONFIDENCE_INSTRUCTIONS = """
+
+Instead of returning only the evaluation key, first reason about the question and then give the evaluation key and how confident you are in it, from 0 (guessing) to 1 (certain). Respond with a single JSON object and nothing else, in this form:
+{"reasoning": "<your assessment of the question>", "rating": <evaluation key>, "confidence": <number from 0 to 1>}"""
+
+# Appended to the prompt of the fused strategy, followed by an example object
+FUSED_INSTRUCTIONS = """
+
+Ignore any instruction above to return only the evaluation key. For each criterion, first reason about the question and then give its evaluation key. Respond with a single JSON object and nothing else, with one entry per criterion, in this form:"""
+
+# Conversations started per question-criterion pair before giving up on a
+# valid rating, and re-asks of the principle turn within a two-turn one
+RATING_ATTEMPTS = 5
+PRINCIPLE_REASKS = 2
+
+class CriterionBundle(NamedTuple):
+    """
+    The prompts making up one criterion, read from
+    "config/prompts/criteria_k/".
+    """
+    criterion: str
+    system: str
+    question: str
+    principle: str
+    labels: Tuple[str, ...] = () # (Evaluation keys listed in the principle, e.g. ("1", "2"))
+
+    def render_question(self, mcq) -> str:
+        """
+        Fills the question prompt's "{QUESTION}" placeholder with the mcq.
+
+        Args:
+            mcq (_type_): Multiple-choice question data.
+
+        Returns:
+            str: Question prompt for this mcq.
+        """
+        return self.question.replace("{QUESTION}", json.dumps(mcq, sort_keys=False, indent=4))
+
+    def render_structured(self, mcq,
+                          with_confidence: bool = False) -> str:
+        """
+        Builds the single prompt of the structured strategy: the question
+        prompt and the principle, followed by STRUCTURED_INSTRUCTIONS (or
+        CONFIDENCE_INSTRUCTIONS).
+
+        Args:
+            mcq (_type_): Multiple-choice question data.
+            with_confidence (bool, optional): Also ask for a confidence.
+                                              Defaults to False.
+
+        Returns:
+            str: Combined prompt asking for reasoning and rating as json.
+        """
+        instructions = CONFIDENCE_INSTRUCTIONS if with_confidence else STRUCTURED_INSTRUCTIONS
+        return f"{self.render_question(mcq)}\n\n{self.principle.rstrip()}{instructions}"
+
+    def render_reask(self) -> str:
+        """
+        Builds the principle prompt sent again when the model's reply to it
+        had no readable evaluation key, reminding it of the valid keys.
+
+        Returns:
+            str: Principle prompt with a reminder of the evaluation keys.
+        """
+        keys = ", ".join(self.labels) if self.labels else "a number"
+        return f"{self.principle.rstrip()}\n\nReply with only the evaluation key ({keys}) and nothing else."
+
+# Bundles already read this process, keyed by (prompts directory, criterion)
+_bundle_cache: Dict[Tuple[str, str], Tuple[tuple, CriterionBundle]] = {}
+_bundle_cache_lock = threading.Lock()
+
+def load_criterion_bundle(crit: str,
+                          prompts_root: str = "./config/prompts") -> CriterionBundle:
+    """
+    Returns the prompt bundle for a criterion. Files are only read again if
+    one of their modification times changed since they were last loaded.
+
+    Args:
+        crit (str): Criterion to load.
+        prompts_root (str, optional): Directory holding the criteria_k
+                                      directories. Defaults to
+                                      "./config/prompts".
+
+    Raises:
+        FileNotFoundError: If one of the three prompt files is missing.
+        ValueError: If the question prompt has no "{QUESTION}" placeholder.
+
+    Returns:
+        CriterionBundle: The criterion's system, question and principle
+                         prompts, and the evaluation keys listed in the
+                         principle.
+    """
+    prompts_directory = os.path.join(prompts_root, f"criteria_{crit}")
+    paths = [os.path.join(prompts_directory, f"{kind}_{crit}.txt")
+             for kind in ("system", "question", "principle")]
+
+    # Check all three files exist before reading any of them
+    for path in paths:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Prompt file '{path}' for criterion {crit} does not exist.")
+    mtimes = tuple(os.path.getmtime(path) for path in paths)
+
+    with _bundle_cache_lock:
+        cached = _bundle_cache.get((prompts_root, crit))
+        if cached is not None and cached[0] == mtimes:
+            return cached[1]
+
+        system, question, principle = (read_file(path) for path in paths)
+        if "{QUESTION}" not in question:
+            raise ValueError(f"Question prompt '{paths[1]}' must contain the {{QUESTION}} placeholder.")
+
+        # Evaluation keys are the principle's "k: description" lines
+        labels = tuple(dict.fromkeys(re.findall(r"^\s*(\d+)\s*:", principle, flags=re.MULTILINE)))
+        bundle = CriterionBundle(crit, system, question, principle, labels)
+
+        _bundle_cache[(prompts_root, crit)] = (mtimes, bundle)
+        return bundle
+
+def load_criterion_bundles(criteria: List[str],
+                           prompts_root: str = "./config/prompts") -> Dict[str, CriterionBundle]:
+    """
+    Loads the prompt bundle of every selected criterion. Called once at the
+    start of a run so that a missing or malformed prompt fails before any
+    model is called.
+
+    Args:
+        criteria (List[str]): Criteria selected for this run.
+        prompts_root (str, optional): Directory holding the criteria_k
+                                      directories. Defaults to
+                                      "./config/prompts".
+
+    Returns:
+        Dict[str, CriterionBundle]: Bundles keyed by criterion.
+    """
+    return {crit: load_criterion_bundle(crit, prompts_root) for crit in criteria}
+
+def parse_rating(response: str,
+                 labels: Sequence[str] = ()) -> str:
+    """
+    Extracts a criterion rating from a free-form reply, accepting only the
+    criterion's evaluation keys. Replies such as "2", "2.", "**2**",
+    "Rating: 2" or "2: There are minor syntax issues" all give "2". When
+    the reply mentions several keys, one given after "rating", "key",
+    "answer", "option" or "evaluation", or at the very start, is used;
+    otherwise the reply must mention exactly one key.
+
+    Args:
+        response (str): Model's reply.
+        labels (Sequence[str], optional): Valid evaluation keys. Defaults
+                                          to (), which accepts any number.
+
+    Returns:
+        str: The rating, or "" if the reply has no unambiguous valid key.
+    """
+    if response is None:
+        return ""
+    valid = (lambda key: key in labels) if labels else (lambda key: True)
+
+    # Numbers not part of a larger number or a decimal
+    numbers = [match.group(1) for match in re.finditer(r"(?<![\d.])(\d+)(?![\d]|\.\d)", response)]
+    candidates = [number for number in numbers if valid(number)]
+    if len(candidates) == 0:
+        return ""
+
+    # A key right after a keyword or at the start of the reply
+    for pattern in (r"^\W*(\d+)(?![\d]|\.\d)",
+                    r"(?:rating|key|answer|option|evaluation)\W*(?:is\W*)?(\d+)(?![\d]|\.\d)"):
+        match = re.search(pattern, response, flags=re.IGNORECASE)
+        if match is not None and valid(match.group(1)):
+            return match.group(1)
+
+    # Otherwise only an unambiguous mention
+    if len(set(candidates)) == 1:
+        return candidates[0]
+    return ""
+
+def parse_structured_response(response: str) -> str:
+    """
+    Extracts the rating from a response to a structured prompt, i.e. the
+    "rating" field of the json object in it. Models sometimes wrap the
+    object in text or code fences, so the outermost braces are used.
+
+    Args:
+        response (str): Model's response.
+
+    Returns:
+        str: The rating, or "" if the response has no readable rating.
+    """
+    if response is None:
+        return ""
+    start, end = response.find("{"), response.rfind("}")
+    if start == -1 or end < start:
+        return ""
+    try:
+        parsed = json.loads(response[start:end + 1])
+    except json.JSONDecodeError:
+        return ""
+    if not isinstance(parsed, dict) or parsed.get("rating") is None:
+        return ""
+    return str(parsed["rating"]).strip()
+
+def parse_structured_confidence(response: str) -> Optional[float]:
+    """
+    Extracts the "confidence" field from a response to a structured prompt
+    that asked for one (see CONFIDENCE_INSTRUCTIONS).
+
+    Args:
+        response (str): Model's response.
+
+    Returns:
+        Optional[float]: Confidence clipped to 0 to 1, or None if missing.
+    """
+    if response is None:
+        return None
+    start, end = response.find("{"), response.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        parsed = json.loads(response[start:end + 1])
+        return min(1.0, max(0.0, float(parsed["confidence"])))
+    except (json.JSONDecodeError, TypeError, KeyError, ValueError):
+        return None
+
+def fuse_system_prompts(bundles: List[CriterionBundle]) -> str:
+    """
+    Merges the system prompts of several criteria into one. The prompts
+    share most of their text (the description of an mcq and its json
+    format), so they are merged paragraph by paragraph: every distinct
+    paragraph is kept once, in the order it first appears.
+
+    Args:
+        bundles (List[CriterionBundle]): Criteria being evaluated together.
+
+    Returns:
+        str: Merged system prompt.
+    """
+    paragraphs = []
+    for bundle in bundles:
+        for paragraph in bundle.system.split("\n\n"):
+            paragraph = paragraph.strip()
+            if paragraph and paragraph not in paragraphs:
+                paragraphs.append(paragraph)
+    return "\n\n".join(paragraphs)
+
+def render_fused(mcq,
+                 bundles: List[CriterionBundle]) -> str:
+    """
+    Builds the prompt of the fused strategy. The mcq is included once,
+    followed by each criterion's question (the text after its {QUESTION}
+    placeholder) and principle, and FUSED_INSTRUCTIONS.
+
+    Args:
+        mcq (_type_): Multiple-choice question data.
+        bundles (List[CriterionBundle]): Criteria being evaluated together.
+
+    Returns:
+        str: Prompt asking for every criterion's reasoning and rating.
+    """
+    # Text before the placeholder introduces the mcq, e.g. "Here is a ... question in JSON format."
+    introduction = bundles[0].question.split("{QUESTION}", 1)[0]
+    sections = [f"{introduction}{json.dumps(mcq, sort_keys=False, indent=4)}",
+                "Evaluate this multiple-choice question against each of the following criteria."]
+    for bundle in bundles:
+        question = bundle.question.split("{QUESTION}", 1)[1].strip()
+        sections.append(f"Criterion {bundle.criterion}:\n{question}\n\n{bundle.principle.strip()}")
+
+    example = ", ".join(f'"{bundle.criterion}": {{"reasoning": "<...>", "rating": <evaluation key>}}'
+                        for bundle in bundles)
+    return "\n\n".join(sections) + FUSED_INSTRUCTIONS + f"\n{{{example}}}"
+
+def parse_fused_response(response: str,
+                         criteria: List[str]) -> Dict[str, str]:
+    """
+    Extracts every criterion's rating from a response to a fused prompt.
+
+    Args:
+        response (str): Model's response.
+        criteria (List[str]): Criteria that were asked about.
+
+    Returns:
+        Dict[str, str]: Rating of each criterion ("" if missing).
+    """
+    ratings = {crit: "" for crit in criteria}
+    if response is None:
+        return ratings
+    start, end = response.find("{"), response.rfind("}")
+    if start == -1 or end < start:
+        return ratings
+    try:
+        parsed = json.loads(response[start:end + 1])
+    except json.JSONDecodeError:
+        return ratings
+    if not isinstance(parsed, dict):
+        return ratings
+
+    for crit in criteria:
+        entry = parsed.get(crit, parsed.get(f"criterion {crit}"))
+        if isinstance(entry, dict) and entry.get("rating") is not None:
+            ratings[crit] = str(entry["rating"]).strip()
+    return ratings
+
 ###############################################################################
 
 ###########################
@@ -128,25 +649,54 @@ def get_model(model_module_name: str) -> Type[Model]:
     # No subclass of model found in model module.
     raise NotImplementedError(f"Module {model_module_name} doesn't implement Model subclass.")
 
+# Seconds between rewrites of a run's status.json
+STATUS_SECONDS = 10
+
 def run_model(Model_Class: Type[Model], 
-              in_directory: str, 
+              mcq_path: str, 
               out_directory: str,
               gold_path: str, 
               criteria_string: str,
-              force_eval: bool) -> None:
+              force_eval: bool,
+              workers: int = 1,
+              dry_run: bool = False,
+              checkpoint_every: int = 50,
+              strategy: str = "two-turn",
+              shard: Optional[Tuple[int, int]] = None,
+              cascade: Optional[Tuple[Type[Model], Dict[str, CascadeRule]]] = None,
+              prefilter: bool = False,
+              sampling: Optional[Tuple[int, float]] = None,
+              active: Optional[Tuple[float, int]] = None) -> None:
     """
-    Main method for running an experiment. Given a model, a directory of mcqs,
+    Main method for running an experiment. Given a model, a source of mcqs,
     an output directory, and criteria, this method will use the model to
     generate evaluations for any question-criteria pair which have a
     corresponding label in the human-generated gold labels.
 
-    Progress is saved after each evaluation. Running this method will not
-    generate any evaluations if they already exist in the output directory.
+    Question-criterion pairs are independent conversations, so up to `workers`
+    of them are sent to the model at the same time. Results are still
+    recorded one at a time by the calling thread. mcqs are streamed from the
+    source as workers free up, and each is parsed once for all of its
+    criteria.
+
+    Progress is saved after each evaluation by appending it to
+    "out_directory/journal.jsonl". The results csv is rebuilt from the
+    in-memory evaluations every checkpoint_every ratings and when the run
+    ends. Running this method will not generate any evaluations if they
+    already exist in the output directory (in the csv or the journal).
     In other words, progress is saved if a run is interrupted.
 
+    The accuracy and f1 scores of the ratings against the gold labels are
+    kept up to date as ratings arrive. Each criterion's accuracy is shown in
+    the progress bar, and all scores are written to
+    "out_directory/status.json" every STATUS_SECONDS seconds (and with each
+    checkpoint), so a clearly bad configuration can be stopped early.
+
     Args:
         Model_Class (Type[Model]): Constructor for model to use for experiment.
-        in_directory (str): Path to directory containing multiple-choice questions (mcqs)
+        mcq_path (str): Path to the multiple-choice questions (mcqs): a directory of
+                        question.json files, a .jsonl file or a SQLite database
+                        (see mcq_sources.open_mcq_source).
         out_directory (str): Path to directory to store results from experiment. If path
                              doesn't exist, it will be created at runtime.
         gold_path (str): Path to gold labels CSV.
@@ -156,10 +706,55 @@ def run_model(Model_Class: Type[Model],
                            for every question. Otherwise, for each question, 
                            only criteria with a corresponding gold label will
                            be evaluated.
+        workers (int, optional): Maximum number of conversations evaluated
+                                 concurrently. Defaults to 1, which evaluates
+                                 pairs one after another.
+        dry_run (bool, optional): When True, only print the size of the work
+                                  plan without calling the model. Defaults
+                                  to False.
+        checkpoint_every (int, optional): Number of ratings between rewrites
+                                          of the results csv. Defaults to 50.
+        strategy (str, optional): Name of the evaluation strategy in
+                                  EVAL_STRATEGIES. Defaults to "two-turn",
+                                  the protocol used in the paper.
+        shard (Optional[Tuple[int, int]], optional): (i, n) to only evaluate
+                                                     the questions of shard i
+                                                     of n (see parse_shard).
+                                                     Defaults to None, which
+                                                     evaluates all questions.
+        cascade (Optional[Tuple[Type[Model], Dict[str, CascadeRule]]], optional):
+            Cheap model and cascade rules by criterion (see cascade.py).
+            The cheap model's rating and whether it was escalated are
+            recorded in the "cheap k" and "cascade k" columns. Defaults to
+            None (no cascade).
+        prefilter (bool, optional): When True, pairs the rules in
+                                    prefilters.py can decide are rated
+                                    without a model, and the rule that fired
+                                    is recorded in the "rule k" column.
+                                    Defaults to False.
+        sampling (Optional[Tuple[int, float]], optional): (samples,
+            temperature) to rate each pair by majority vote over up to
+            that many conversations at that temperature (see eval_samples).
+            The winning rating's share of the votes and the vote counts are
+            recorded in the "confidence k" and "votes k" columns. Defaults
+            to None (one conversation at the configured temperature).
+        active (Optional[Tuple[float, int]], optional): (target width, seed)
+            for adaptive evaluation: pairs with a gold label are evaluated
+            in a random order stratified by criterion and gold label, and
+            each criterion stops once the confidence interval of its
+            accuracy is narrower than the target width (see active.py).
+            Defaults to None, which evaluates every planned pair.
+
+    Raises:
+        ValueError: If strategy is unknown, or fused is combined with a
+                    cascade or adaptive evaluation, or adaptive evaluation
+                    with force_eval.
 
     Side Effects:
         If out_directory does not exist, it will be created.
         Results csv is stored in "out_directory/evaluation.csv".
+        Journal of finished ratings is stored in "out_directory/journal.jsonl".
+        Running scores are stored in "out_directory/status.json".
         Full message logs are stored in "out_directory/responses/criteria_*/".
     """
 
@@ -167,8 +762,197 @@ def run_model(Model_Class: Type[Model],
     criteria = sorted(list({c for c in criteria_string if c.isdigit()}))
     if len(criteria) == 0:
         return
+    if strategy not in EVAL_STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}'. Choose from {list(EVAL_STRATEGIES)}.")
+    if strategy == "fused" and cascade is not None:
+        raise ValueError("Cascade mode does not support the fused strategy.")
+    if active is not None and (strategy == "fused" or force_eval):
+        raise ValueError("Adaptive evaluation does not support the fused strategy or force_eval.")
     
-    # Initialize evaluations dataframe 
+    # Read and validate every criterion's prompts once for the whole run
+    bundles = load_criterion_bundles(criteria)
+
+    # Initialize evaluations dataframe and build the work plan in one pass
+    df = load_evaluations(out_directory, gold_path, criteria)
+    source = open_mcq_source(mcq_path)
+    available = source.ids()
+    tasks = plan_tasks(df, available, criteria, force_eval, shard)
+    sampler = None if active is None else build_active_sampler(df, available, criteria, *active, shard)
+
+    if dry_run:
+        print_plan(tasks, criteria)
+        source.close()
+        return
+
+    # Rows of each question in the evaluations dataframe
+    rows_of = question_rows(df)
+
+    # Finished ratings are journaled immediately, the csv is rewritten periodically
+    os.makedirs(out_directory, exist_ok=True)
+    csv_path = os.path.join(out_directory, "evaluation.csv")
+    journal_file = open(os.path.join(out_directory, "journal.jsonl"), 'a', encoding="utf-8")
+    unsaved = 0
+
+    # Running scores against the gold labels, including earlier ratings
+    scores = metrics.RunningScores()
+    for crit in criteria:
+        if f"criteria {crit}" in df.columns:
+            rated = df[[f"criteria {crit}", f"auto {crit}"]].dropna()
+            for gold, rating in zip(rated[f"criteria {crit}"], rated[f"auto {crit}"]):
+                scores.add(crit, gold, rating)
+    status_path = os.path.join(out_directory, "status.json")
+    finished, status_written = 0, time.monotonic()
+
+    def write_status() -> None:
+        status = {"time": time.time(), "finished": finished, "planned": len(tasks), "criteria": scores.scores()}
+        if sampler is not None:
+            status["active"] = sampler.estimates()
+        write_json_atomic(status_path, status)
+
+    # Criteria still pending for each question, in plan order
+    pending = {}
+    for questionID, crit in tasks:
+        pending.setdefault(questionID, []).append(crit)
+
+    # Units of work: one conversation per pair, or per question when fused.
+    # Each mcq is read from the source once and shared by all of its units.
+    def units() -> Iterator[Tuple[str, Any, List[str]]]:
+        if sampler is not None:
+            # Adaptive: pairs in sampling order, until their criterion is done
+            planned = set(tasks)
+            for questionID, crit in sampler.order():
+                if (questionID, crit) in planned and not sampler.done(crit):
+                    yield questionID, source.get(questionID), [crit]
+            return
+        for questionID, mcq in source.iter_mcqs(pending):
+            if strategy == "fused":
+                yield questionID, mcq, pending[questionID]
+            else:
+                for crit in pending[questionID]:
+                    yield questionID, mcq, [crit]
+
+    # Send conversations to the model concurrently, record results as they
+    # finish. Only a bounded number of units is in flight at a time, so mcqs
+    # are streamed from the source rather than all loaded up front.
+    max_in_flight = 4 * max(1, workers)
+    cascaded = {"accepted": 0, "escalated": 0}
+    ruled = 0
+    sampled = {} # (conversations used by each sampled unit of work)
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        unit_iter = units()
+        in_flight = set()
+        unit_of = {} # (questionID and criteria of each future)
+        progress = tqdm(total=len(tasks))
+        while True:
+            for questionID, mcq, crits in unit_iter:
+                future = executor.submit(eval_task, Model_Class, questionID,
+                                         [bundles[crit] for crit in crits],
+                                         mcq, strategy, cascade, prefilter, sampling)
+                in_flight.add(future)
+                unit_of[future] = (questionID, crits)
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                questionID, crits = unit_of.pop(future)
+                try:
+                    results = future.result()
+                except RetryableError as e:
+                    # (A request ran out of retries; a later run evaluates the unit again)
+                    progress.update(len(crits))
+                    finished += len(crits)
+                    print(f"Model request failed on question {questionID} criteria {'+'.join(crits)}: {e} Skipping...")
+                    continue
+                for questionID, crit, model_output, mcq_eval, columns in results:
+                    progress.update(1)
+                    finished += 1
+                    if mcq_eval == None:
+                        print(f"Model failed to produce proper output on question {questionID} criterion {crit} after {RATING_ATTEMPTS} attempts. Skipping...")
+                        continue
+
+                    # Update evaluations dataframe
+                    values = {f"auto {crit}": mcq_eval, **columns}
+                    write_values(df, rows_of[questionID], values)
+                    
+                    # Create response file (full message log)
+                    write_response_log(out_directory, crit, questionID, model_output)
+
+                    # Record the rating, then occasionally refresh the results csv
+                    append_journal(journal_file, questionID, values)
+                    if f"cascade {crit}" in columns:
+                        cascaded[columns[f"cascade {crit}"]] += 1
+                    if model_output[0]["role"] == "prefilter":
+                        ruled += 1
+                    if model_output[0]["role"] == "votes":
+                        sampled[(questionID, model_output[0]["criteria"])] = model_output[0]["samples"]
+
+                    # Score the rating if the pair has a gold label
+                    gold = df.at[rows_of[questionID][0], f"criteria {crit}"] if f"criteria {crit}" in df.columns else None
+                    if not pd.isna(gold):
+                        scores.add(crit, gold, mcq_eval)
+                        if sampler is not None:
+                            sampler.add(crit, gold, mcq_eval)
+                        progress.set_postfix_str(scores.postfix(), refresh=False)
+
+                    unsaved += 1
+                    if unsaved >= checkpoint_every:
+                        write_csv_atomic(df, csv_path)
+                        unsaved = 0
+                        status_written = 0
+            if time.monotonic() - status_written >= STATUS_SECONDS:
+                write_status()
+                status_written = time.monotonic()
+        progress.close()
+        if prefilter:
+            print(f"Pre-filters: rated {ruled} of {len(tasks)} evaluations without a model.")
+        if cascade is not None:
+            print(f"Cascade: kept {cascaded['accepted']} cheap ratings, escalated "
+                  f"{cascaded['escalated']} to {Model_Class.__name__}.")
+        if sampler is not None:
+            for crit, estimate in sampler.estimates().items():
+                if estimate["ci"] is None:
+                    print(f"Criterion {crit}: no estimate yet ({estimate['rated']} of {estimate['population']} rated).")
+                    continue
+                print(f"Criterion {crit}: accuracy {estimate['accuracy']:.3f}, {sampler.confidence:.0%} CI "
+                      f"[{estimate['ci'][0]:.3f}, {estimate['ci'][1]:.3f}] from {estimate['rated']} of "
+                      f"{estimate['population']} pairs.")
+        if sampling is not None and len(sampled) > 0:
+            print(f"Self-consistency: {sum(sampled.values())} conversations for {len(sampled)} votes "
+                  f"({sum(sampled.values()) / len(sampled):.2f} per vote, at most {sampling[0]}).")
+    except BaseException:
+        # Don't start any queued conversations after a failure or interrupt
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        journal_file.close()
+        source.close()
+        write_csv_atomic(df, csv_path)
+        write_status()
+    executor.shutdown()
+
+def load_evaluations(out_directory: str,
+                     gold_path: str,
+                     criteria: List[str]) -> pd.DataFrame:
+    """
+    Loads the evaluations dataframe for an experiment. An in-progress
+    "evaluation.csv" in out_directory is resumed if one exists, otherwise
+    the gold labels are loaded and empty auto columns are added. Ratings
+    from the run's journal that never made it into the csv are replayed on
+    top.
+
+    Args:
+        out_directory (str): Path to the experiment's output directory.
+        gold_path (str): Path to gold labels CSV.
+        criteria (List[str]): Criteria selected for this run.
+
+    Returns:
+        pd.DataFrame: Evaluations dataframe with an "auto k" column for
+                      every criterion k.
+    """
     try: # (Try loading from in-progress csv from out_directory)
         df = pd.read_csv(os.path.join(out_directory, "evaluation.csv"), dtype=str)
     except:
@@ -178,83 +962,629 @@ def run_model(Model_Class: Type[Model],
         for col in auto_cols:
             df[col] = None
 
-    # Iterate over questions and generate responses for each criterion
-    for questionID in tqdm(df['questionID']):
-        for crit in criteria:
-
-            # Evaluate if:
-            # - questionID corresponds to a question.json file, and
-            # - questionID has not been auto evaluated for this criterion, and
-            # - questionID has corresponding gold label, OR force_eval enabled.
-            in_file_path = os.path.join(in_directory, f"{questionID}.json")
-            if (os.path.isfile(in_file_path) and 
-                pd.isna(df.loc[df["questionID"]==questionID,f"auto {crit}"].iloc[0]) and
-                ((not pd.isna(df.loc[df["questionID"]==questionID,f"criteria {crit}"].iloc[0])) 
-                  or force_eval)):
-    
-                # Get mcq
-                mcq = read_json(in_file_path)
-                
-                # Get model's evaluation for this mcq and criterion
-                model_output, mcq_eval = None, None
-                for _ in range(5):
-                    model_output, mcq_eval = eval(Model_Class, mcq, crit)
-                    
-                    # Make sure model's rating is indeed a number
-                    if mcq_eval.isdigit():
-                        break
-                if mcq_eval == None:
-                    print(f"Model failed to produce proper output on question {questionID} criterion {crit} after 5 attempts. Skipping...")
-                    continue
+    # Selected criteria beyond the default five also need an auto column
+    for crit in criteria:
+        if f"auto {crit}" not in df.columns:
+            df[f"auto {crit}"] = None
+
+    # Catch up on ratings journaled after the csv was last written
+    replay_journal(df, os.path.join(out_directory, "journal.jsonl"))
+
+    return df
+
+def plan_tasks(df: pd.DataFrame,
+               available: Collection[str],
+               criteria: List[str],
+               force_eval: bool,
+               shard: Optional[Tuple[int, int]] = None) -> List[Tuple[str, str]]:
+    """
+    Builds the list of question-criterion pairs that still need an
+    evaluation. The whole dataframe is checked at once per criterion rather
+    than looking up each pair, so planning stays linear in the number of
+    questions.
+
+    A pair is planned if:
+      - questionID is available from the mcq source, and
+      - questionID has not been auto evaluated for this criterion, and
+      - questionID has corresponding gold label, OR force_eval enabled, and
+      - questionID belongs to the selected shard, if any.
+
+    Args:
+        df (pd.DataFrame): Evaluations dataframe from load_evaluations.
+        available (Collection[str]): questionIDs of the mcq source
+                                     (MCQSource.ids()).
+        criteria (List[str]): Criteria selected for this run.
+        force_eval (bool): When True, ignore whether a gold label exists.
+        shard (Optional[Tuple[int, int]], optional): (i, n) to keep only the
+                                                     questions of shard i of
+                                                     n. Defaults to None.
+
+    Returns:
+        List[Tuple[str, str]]: (questionID, criterion) pairs, ordered by
+                               question and then by criterion.
+    """
+    questionIDs = df["questionID"]
+    eligible = eligible_rows(df, available, shard)
+
+    # Boolean matrix of pending pairs: rows are questions, columns criteria
+    pending = np.zeros((len(df), len(criteria)), dtype=bool)
+    for j, crit in enumerate(criteria):
+        not_evaluated = df[f"auto {crit}"].isna().to_numpy()
+        if force_eval:
+            labelled = np.ones(len(df), dtype=bool)
+        elif f"criteria {crit}" in df.columns:
+            labelled = df[f"criteria {crit}"].notna().to_numpy()
+        else:
+            labelled = np.zeros(len(df), dtype=bool)
+        pending[:, j] = eligible & not_evaluated & labelled
+
+    # np.nonzero walks the matrix row by row, i.e. question-major order
+    rows, cols = np.nonzero(pending)
+    questionIDs = questionIDs.to_numpy()
+    return [(questionIDs[r], criteria[c]) for r, c in zip(rows, cols)]
+
+def eligible_rows(df: pd.DataFrame,
+                  available: Collection[str],
+                  shard: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """
+    Finds the rows of the evaluations dataframe that may be evaluated: the
+    first row of each questionID available from the mcq source and, if
+    given, in the selected shard.
+
+    Args:
+        df (pd.DataFrame): Evaluations dataframe from load_evaluations.
+        available (Collection[str]): questionIDs of the mcq source.
+        shard (Optional[Tuple[int, int]], optional): (i, n) to keep only the
+                                                     questions of shard i of
+                                                     n. Defaults to None.
+
+    Returns:
+        np.ndarray: Boolean mask of the rows.
+    """
+    questionIDs = df["questionID"]
+    eligible = (questionIDs.isin(available) & ~questionIDs.duplicated()).to_numpy()
+    if shard is not None:
+        index, count = shard
+        in_shard = questionIDs.map(lambda questionID: shard_of(questionID, count)) == index - 1
+        eligible = eligible & in_shard.to_numpy()
+    return eligible
+
+def build_active_sampler(df: pd.DataFrame,
+                         available: Collection[str],
+                         criteria: List[str],
+                         target_width: float,
+                         seed: int = 0,
+                         shard: Optional[Tuple[int, int]] = None) -> ActiveSampler:
+    """
+    Builds the sampler of adaptive evaluation (see active.py) over every
+    pair with a gold label, and counts the pairs already rated.
+
+    Args:
+        df (pd.DataFrame): Evaluations dataframe from load_evaluations.
+        available (Collection[str]): questionIDs of the mcq source.
+        criteria (List[str]): Criteria selected for this run.
+        target_width (float): Confidence interval width at which a
+                              criterion stops.
+        seed (int, optional): Random seed of the sampling order. Defaults
+                              to 0.
+        shard (Optional[Tuple[int, int]], optional): (i, n) to keep only the
+                                                     questions of shard i of
+                                                     n. Defaults to None.
+
+    Returns:
+        ActiveSampler: Sampler of the run.
+    """
+    eligible = eligible_rows(df, available, shard)
+    population, rated = {}, []
+    for crit in criteria:
+        if f"criteria {crit}" not in df.columns:
+            population[crit] = []
+            continue
+        crit_df = df.loc[eligible & df[f"criteria {crit}"].notna().to_numpy(),
+                         ["questionID", f"criteria {crit}", f"auto {crit}"]]
+        population[crit] = list(zip(crit_df["questionID"], crit_df[f"criteria {crit}"]))
+        rated += [(crit, gold, rating) for gold, rating in zip(crit_df[f"criteria {crit}"], crit_df[f"auto {crit}"])
+                  if not pd.isna(rating)]
+
+    sampler = ActiveSampler(population, target_width, seed=seed)
+    for crit, gold, rating in rated:
+        sampler.add(crit, gold, rating)
+    return sampler
+
+def parse_shard(shard_string: str) -> Tuple[int, int]:
+    """
+    Parses a shard argument of the form "i/n", where shards are numbered
+    1 to n.
+
+    Args:
+        shard_string (str): Shard argument, e.g. "2/4".
+
+    Raises:
+        ValueError: If the argument is malformed or i is not in 1..n.
+
+    Returns:
+        Tuple[int, int]: (i, n)
+    """
+    try:
+        index, count = (int(part) for part in shard_string.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{shard_string}'. Expected the form i/n, e.g. 2/4.")
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard '{shard_string}'. i must be between 1 and n.")
+    return index, count
+
+def shard_of(questionID: str,
+             count: int) -> int:
+    """
+    Deterministically assigns a question to one of count shards (0-based),
+    so every process or machine derives the same partition from the
+    questionID alone. All criteria of a question land in the same shard.
+
+    Args:
+        questionID (str): ID of the question.
+        count (int): Number of shards.
+
+    Returns:
+        int: Shard of the question, from 0 to count - 1.
+    """
+    # Python's hash() is salted per process, so use a stable digest instead
+    digest = hashlib.md5(str(questionID).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+def print_plan(tasks: List[Tuple[str, str]],
+               criteria: List[str]) -> None:
+    """
+    Prints a summary of a work plan: the number of pending evaluations, the
+    number of distinct questions, and a breakdown per criterion.
+
+    Args:
+        tasks (List[Tuple[str, str]]): Work plan from plan_tasks.
+        criteria (List[str]): Criteria selected for this run.
+    """
+    per_criterion = {crit: 0 for crit in criteria}
+    for _, crit in tasks:
+        per_criterion[crit] += 1
+
+    print(f"Planned {len(tasks)} evaluations over {len({q for q, _ in tasks})} questions.")
+    for crit, count in per_criterion.items():
+        print(f"  criteria {crit}: {count}")
+
+def eval_task(Model_Class: Type[Model],
+              questionID: str,
+              bundles: List[CriterionBundle],
+              mcq,
+              strategy: str = "two-turn",
+              cascade: Optional[Tuple[Type[Model], Dict[str, CascadeRule]]] = None,
+              prefilter: bool = False,
+              sampling: Optional[Tuple[int, float]] = None
+              ) -> List[Tuple[str, str, list, str, Dict[str, str]]]:
+    """
+    Evaluates one question for one or more criteria. This is the unit of
+    work run_model hands to its worker threads, so it must not touch shared
+    state. The fused strategy covers all criteria in one conversation (and
+    only the criteria left without a valid rating in each retry); the other
+    strategies are given a single criterion per task. Model requests
+    are tagged with the questionID and criterion for the run's metrics.
+
+    With prefilter, the deterministic rules in prefilters.py run first and
+    criteria they decide are not sent to any model. In cascade mode,
+    criteria with a cascade rule are then rated by the cheap model (see
+    eval_confidence). Its rating is kept unless the rule escalates it to
+    Model_Class. With sampling, Model_Class's rating is the majority vote of
+    several sampled conversations (see eval_samples) instead of the first
+    valid one.
+
+    Args:
+        Model_Class (Type[Model]): Constructor for model used for evaluation.
+        questionID (str): ID of the question being evaluated.
+        bundles (List[CriterionBundle]): Prompts of the criteria being
+                                         evaluated.
+        mcq (_type_): Multiple-choice question data, as read from the mcq
+                      source.
+        strategy (str, optional): Key of EVAL_STRATEGIES. Defaults to
+                                  "two-turn".
+        cascade (Optional[Tuple[Type[Model], Dict[str, CascadeRule]]], optional):
+            Cheap model and cascade rules by criterion. Defaults to None
+            (no cascade).
+        prefilter (bool, optional): Apply the rule-based pre-filters.
+                                    Defaults to False.
+        sampling (Optional[Tuple[int, float]], optional): Maximum number of
+            samples and their temperature. Defaults to None (no sampling).
+
+    Returns:
+        List[Tuple[str, str, list, str, Dict[str, str]]]: questionID,
+            criterion, message log, criterion rating (None if the model
+            gave no valid evaluation key in RATING_ATTEMPTS conversations)
+            and additional evaluation columns (e.g. the rule that fired or
+            the cheap model's rating) for each criterion.
+    """
+
+    # Pre-filter: rules that decide a rating without asking a model
+    results, remaining, columns = [], [], {}
+    for bundle in bundles:
+        crit = bundle.criterion
+        ruled = apply_prefilter(mcq, crit) if prefilter else None
+        columns[crit] = {} if ruled is None else {f"rule {crit}": ruled.rule}
+        if ruled is not None and ruled.rating is not None:
+            model_output = [{"role": "prefilter", "rule": ruled.rule, "content": ruled.rating}]
+            results.append((questionID, crit, model_output, ruled.rating, columns[crit]))
+        else:
+            remaining.append(bundle)
+    if len(remaining) == 0:
+        return results
+
+    # Self-consistency: majority vote over sampled conversations
+    if sampling is not None and strategy == "fused":
+        model_output, votes = eval_samples(Model_Class, questionID, mcq, remaining, strategy, *sampling)
+        for bundle in remaining:
+            mcq_eval, vote_columns = vote_result(bundle.criterion, votes[bundle.criterion])
+            columns[bundle.criterion].update(vote_columns)
+            results.append((questionID, bundle.criterion, model_output, mcq_eval, columns[bundle.criterion]))
+        return results
+
+    # Fused: one conversation rates every remaining criterion
+    if strategy == "fused":
+        model_outputs, ratings = {}, {}
+        unrated = remaining
+        for attempt in range(1, RATING_ATTEMPTS + 1):
+            with metrics.tagged(questionID=questionID, strategy=strategy, attempt=attempt,
+                                criterion="+".join(bundle.criterion for bundle in unrated)):
+                model_output, attempt_ratings = eval_fused(retried_model(Model_Class, attempt), mcq, unrated)
+
+            # Keep valid ratings, and only ask again for criteria without one
+            # (each criterion keeps the log of the conversation that rated it)
+            for bundle in unrated:
+                model_outputs[bundle.criterion] = model_output
+                ratings[bundle.criterion] = attempt_ratings[bundle.criterion]
+            unrated = [bundle for bundle in unrated if ratings[bundle.criterion] == ""]
+            if len(unrated) == 0:
+                break
+        return results + [(questionID, bundle.criterion, model_outputs[bundle.criterion],
+                           ratings[bundle.criterion] or None, columns[bundle.criterion]) for bundle in remaining]
+
+    # Get model's evaluation for this mcq and each criterion
+    for bundle in remaining:
+        crit = bundle.criterion
+
+        # Cascade: keep the cheap model's rating unless the rule escalates it
+        rule = None if cascade is None else cascade[1].get(crit)
+        if rule is not None:
+            Cheap_Class = cascade[0]
+            with metrics.tagged(questionID=questionID, criterion=crit, strategy="cascade"):
+                model_output, cheap_eval, confidence = eval_confidence(Cheap_Class, mcq, bundle)
+            escalated = should_escalate(rule, cheap_eval, confidence)
+            columns[crit].update({f"cheap {crit}": cheap_eval,
+                                  f"cascade {crit}": "escalated" if escalated else "accepted"})
+            if not escalated:
+                results.append((questionID, crit, model_output, cheap_eval, columns[crit]))
+                continue
+
+        if sampling is not None:
+            model_output, votes = eval_samples(Model_Class, questionID, mcq, [bundle], strategy, *sampling)
+            mcq_eval, vote_columns = vote_result(crit, votes[crit])
+            columns[crit].update(vote_columns)
+            results.append((questionID, crit, model_output, mcq_eval, columns[crit]))
+            continue
+
+        model_output, mcq_eval = None, ""
+        for attempt in range(1, RATING_ATTEMPTS + 1):
+            with metrics.tagged(questionID=questionID, criterion=crit, strategy=strategy, attempt=attempt):
+                model_output, mcq_eval = EVAL_STRATEGIES[strategy](retried_model(Model_Class, attempt), mcq, bundle)
+            
+            # Make sure model's rating is a valid evaluation key
+            if mcq_eval != "":
+                break
+        results.append((questionID, crit, model_output, mcq_eval or None, columns[crit]))
 
-                # Update evaluations dataframe
-                df.loc[df["questionID"]==questionID,f"auto {crit}"] = mcq_eval
-                
-                # Create output response directory if it doesn't exist
-                out_response_path = os.path.join(out_directory, f"responses/criteria_{crit}")
-                if not os.path.exists(out_response_path):
-                    os.makedirs(out_response_path)
+    return results
 
-                # Create response file (full message log)
-                write_json(os.path.join(out_response_path, f"{questionID}.json"), model_output)
+def eval_samples(Model_Class: Type[Model],
+                 questionID: str,
+                 mcq,
+                 bundles: List[CriterionBundle],
+                 strategy: str,
+                 samples: int,
+                 temperature: float) -> Tuple[list, Dict[str, Counter]]:
+    """
+    Self-consistency: rates an mcq by majority vote over up to `samples`
+    independent conversations at the given temperature. Samples are sent
+    in parallel rounds, each just large enough to possibly decide the vote
+    (see votes_needed), and sampling stops as soon as no criterion's
+    leading rating can be overturned by the samples left. Samples without
+    a valid rating don't vote.
+
+    Args:
+        Model_Class (Type[Model]): Constructor for model used for evaluation.
+        questionID (str): ID of the question being evaluated.
+        mcq (_type_): Multiple-choice question data.
+        bundles (List[CriterionBundle]): Prompts of the criteria being
+                                         evaluated (one, unless fused).
+        strategy (str): Key of EVAL_STRATEGIES used for every sample.
+        samples (int): Maximum number of conversations.
+        temperature (float): Sampling temperature of the conversations.
+
+    Returns:
+        Tuple[list, Dict[str, Counter]]: Message log of every sample, and
+                                         the votes for each criterion's
+                                         ratings, in the order they were
+                                         first given.
+    """
+    criteria = [bundle.criterion for bundle in bundles]
+
+    def sample(index: int) -> Tuple[list, Dict[str, str]]:
+        # (Metrics tags are per thread, so they are set here)
+        with metrics.tagged(questionID=questionID, criterion="+".join(criteria),
+                            strategy=strategy, sample=index):
+            create = sampled_model(Model_Class, temperature, index)
+            if strategy == "fused":
+                return eval_fused(create, mcq, bundles)
+            messages, rating = EVAL_STRATEGIES[strategy](create, mcq, bundles[0])
+            return messages, {bundles[0].criterion: rating}
+
+    # Send rounds of samples until every vote is decided or samples run out
+    votes = {crit: Counter() for crit in criteria}
+    logs, taken = [], 0
+    while taken < samples:
+        count = max(votes_needed(votes[crit], samples - taken) for crit in criteria)
+        if count == 0:
+            break
+        indices = range(taken + 1, taken + count + 1)
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            for index, (messages, ratings) in zip(indices, executor.map(sample, indices)):
+                for crit, rating in ratings.items():
+                    if rating != "":
+                        votes[crit][rating] += 1
+                logs += [{"role": "sample", "sample": index, "content": ratings}] + messages
+        taken += count
+
+    summary = {"role": "votes", "criteria": "+".join(criteria), "samples": taken,
+               "content": {crit: dict(votes[crit]) for crit in criteria}}
+    return [summary] + logs, votes
+
+def votes_needed(votes: Counter,
+                 remaining: int) -> int:
+    """
+    Computes the fewest further samples that could decide a vote, i.e. give
+    the leading rating more votes than the runner-up could still reach.
+
+    Args:
+        votes (Counter): Votes so far.
+        remaining (int): Samples that may still be taken.
+
+    Returns:
+        int: Number of samples to take next, 0 if the vote is decided.
+    """
+    counts = [count for _, count in votes.most_common(2)] + [0, 0]
+    leader, runner_up = counts[0], counts[1]
+    if leader > runner_up + remaining:
+        return 0
+    return min(remaining, (runner_up + remaining - leader) // 2 + 1)
+
+def vote_result(crit: str,
+                votes: Counter) -> Tuple[Optional[str], Dict[str, str]]:
+    """
+    Reads the outcome of a criterion's vote. Ties go to the rating given
+    first.
+
+    Args:
+        crit (str): Criterion that was voted on.
+        votes (Counter): Votes for each rating.
+
+    Returns:
+        Tuple[Optional[str], Dict[str, str]]: Winning rating (None if no
+            sample gave a valid one) and the "confidence k" (the winner's
+            share of the votes) and "votes k" (json vote counts) columns.
+    """
+    if len(votes) == 0:
+        return None, {}
+    rating, count = votes.most_common(1)[0]
+    return rating, {f"confidence {crit}": f"{count / sum(votes.values()):.3f}",
+                    f"votes {crit}": json.dumps(dict(votes))}
+
+def sampled_model(Model_Class: Type[Model],
+                  temperature: float,
+                  sample: int) -> Callable[[str], Model]:
+    """
+    Wraps a model constructor so the conversations it starts are the given
+    sample (see Model.set_sampling). Can be passed to the eval functions in
+    place of Model_Class.
+
+    Args:
+        Model_Class (Type[Model]): Constructor for model used for evaluation.
+        temperature (float): Sampling temperature.
+        sample (int): Index of the sample.
+
+    Returns:
+        Callable[[str], Model]: Constructor taking the system prompt.
+    """
+    def create(system_prompt: str) -> Model:
+        model = Model_Class(system_prompt)
+        model.set_sampling(temperature, sample)
+        return model
+    return create
+
+def retried_model(Model_Class: Type[Model],
+                  attempt: int) -> Callable[[str], Model]:
+    """
+    Wraps a model constructor so the conversations it starts belong to the
+    given attempt at an evaluation (see Model.set_attempt). The first
+    attempt uses Model_Class itself, so its cache keys are unchanged.
+
+    Args:
+        Model_Class (Type[Model]): Constructor for model used for evaluation.
+        attempt (int): Index of the attempt, from 1.
+
+    Returns:
+        Callable[[str], Model]: Constructor taking the system prompt.
+    """
+    if attempt == 1:
+        return Model_Class
+    def create(system_prompt: str) -> Model:
+        model = Model_Class(system_prompt)
+        model.set_attempt(attempt)
+        return model
+    return create
 
-                # Update evaluation results csv
-                df.to_csv(os.path.join(out_directory, "evaluation.csv"))
+def build_message_log(model: Model) -> list:
+    """
+    Builds the full message log of a conversation as saved in the response
+    files: the system prompt followed by every message. Assistant messages
+    carry the token usage reported for them (including provider prompt
+    cache reads and writes) under "usage".
+
+    Args:
+        model (Model): Model instance holding the conversation.
+
+    Returns:
+        list: Message log.
+    """
+    system_prompt, messages = model.get_chat_log()
+    usage_log = iter(model.get_usage_log())
+
+    log = [{"role": "system", "content": system_prompt}]
+    for message in messages:
+        if message["role"] == "assistant":
+            usage = next(usage_log, None)
+            if usage is not None:
+                message = dict(message, usage=usage)
+        log.append(message)
+    return log
 
 # Generates response for criteria
 def eval(Model_Class: Type[Model], 
          mcq, 
-         crit: str) -> Tuple[list, str]:
+         bundle: CriterionBundle) -> Tuple[list, str]:
     """
-    Given a model, mcq, and criteria, this function computes the model's
-    evaluation of the mcq for this criteria.
+    Given a model, mcq, and criterion prompts, this function computes the
+    model's evaluation of the mcq for this criterion. When the answer to
+    the principle has no valid evaluation key (see parse_rating), it is
+    replaced by the principle with a reminder of the keys, which is
+    repeated up to PRINCIPLE_REASKS times, on top of the same reasoning
+    turn.
 
     Args:
         Model_Class (Type[Model]): Constructor for model used for evaluation.
         mcq (_type_): Multiple-choice question data. Type is normally a dict,
                       but this is not strictly required.
-        crit (str): Criterion being evaluated
+        bundle (CriterionBundle): Prompts of the criterion being evaluated.
 
     Returns:
-        Tuple[list, str]: Message log (list) and criterion rating (string)
+        Tuple[list, str]: Message log (list) and criterion rating (string,
+                          empty if no valid key was given)
     """
 
     # Initialize model with system prompt
-    prompts_directory = f"./config/prompts/criteria_{crit}"
-    system_prompt = read_file(f"{prompts_directory}/system_{crit}.txt")
-    model = Model_Class(system_prompt)
+    model = Model_Class(bundle.system)
     
     # Get model's reasoning to the first user prompt
-    user_question_prompt = read_file(f"{prompts_directory}/question_{crit}.txt")
-    user_question_prompt = user_question_prompt.replace("{QUESTION}", json.dumps(mcq, sort_keys=False, indent=4))
-    model.get_response(user_question_prompt)
+    model.get_response(bundle.render_question(mcq), follow_up=True)
     
-    # Get model's answer for final criterion rating
-    principle = read_file(f"{prompts_directory}/principle_{crit}.txt")
-    rating = model.get_response(principle)
-    _, messages = model.get_chat_log()
-    messages.insert(0, {"role": "system", "content": system_prompt})
+    # Get model's answer for final criterion rating. If it has no valid
+    # evaluation key, only this turn is asked again; the reasoning is kept.
+    # Further re-asks follow up on the failed one, so each is a new request
+    # (and not a hit in the response cache).
+    rating = parse_rating(model.get_response(bundle.principle), bundle.labels)
+    for reask in range(1, PRINCIPLE_REASKS + 1):
+        if rating != "":
+            break
+        if reask == 1:
+            model.rewind()
+        with metrics.tagged(reask=reask):
+            rating = parse_rating(model.get_response(bundle.render_reask()), bundle.labels)
+    messages = build_message_log(model)
+
+    return messages, rating
+
+def eval_structured(Model_Class: Type[Model],
+                    mcq,
+                    bundle: CriterionBundle) -> Tuple[list, str]:
+    """
+    Single-request alternative to eval. The question prompt and principle
+    are sent together and the model answers with its reasoning and rating
+    as one json object, which halves the number of requests and avoids
+    resending the reasoning turn.
+
+    Args:
+        Model_Class (Type[Model]): Constructor for model used for evaluation.
+        mcq (_type_): Multiple-choice question data.
+        bundle (CriterionBundle): Prompts of the criterion being evaluated.
+
+    Returns:
+        Tuple[list, str]: Message log (list) and criterion rating (string,
+                          empty if the response couldn't be parsed)
+    """
+
+    # Initialize model with system prompt and ask for reasoning and rating at once
+    model = Model_Class(bundle.system)
+    response = model.get_response(bundle.render_structured(mcq))
+    messages = build_message_log(model)
+
+    return messages, parse_rating(parse_structured_response(response), bundle.labels)
+
+def eval_confidence(Model_Class: Type[Model],
+                    mcq,
+                    bundle: CriterionBundle) -> Tuple[list, str, Optional[float]]:
+    """
+    Variant of eval_structured that also asks the model how confident it is
+    in its rating. Used for the cheap model in cascade mode.
+
+    Args:
+        Model_Class (Type[Model]): Constructor for model used for evaluation.
+        mcq (_type_): Multiple-choice question data.
+        bundle (CriterionBundle): Prompts of the criterion being evaluated.
+
+    Returns:
+        Tuple[list, str, Optional[float]]: Message log (list), criterion
+                                           rating (string, empty if not
+                                           parsed) and confidence (None if
+                                           not given)
+    """
+
+    # Initialize model with system prompt and ask for rating and confidence at once
+    model = Model_Class(bundle.system)
+    response = model.get_response(bundle.render_structured(mcq, with_confidence=True))
+    messages = build_message_log(model)
+
+    return (messages, parse_rating(parse_structured_response(response), bundle.labels),
+            parse_structured_confidence(response))
+
+def eval_fused(Model_Class: Type[Model],
+               mcq,
+               bundles: List[CriterionBundle]) -> Tuple[list, Dict[str, str]]:
+    """
+    Evaluates an mcq for several criteria in a single conversation. The
+    criteria's system prompts are merged (see fuse_system_prompts) and the
+    mcq is sent once, together with every criterion's question and
+    principle. The model answers with one json object holding a reasoning
+    and rating per criterion.
+
+    Args:
+        Model_Class (Type[Model]): Constructor for model used for evaluation.
+        mcq (_type_): Multiple-choice question data.
+        bundles (List[CriterionBundle]): Prompts of the criteria being
+                                         evaluated.
+
+    Returns:
+        Tuple[list, Dict[str, str]]: Message log (list) and rating of each
+                                     criterion (empty if not parsed)
+    """
+
+    # Initialize model with the merged system prompt and ask about every criterion
+    system_prompt = fuse_system_prompts(bundles)
+    model = Model_Class(system_prompt)
+    response = model.get_response(render_fused(mcq, bundles))
+    messages = build_message_log(model)
+
+    ratings = parse_fused_response(response, [bundle.criterion for bundle in bundles])
+    return messages, {bundle.criterion: parse_rating(ratings[bundle.criterion], bundle.labels)
+                      for bundle in bundles}
 
-    return messages, rating.strip()
+# Evaluation strategies selectable with --strategy. "fused" is called once
+# per question with all of its criteria (see eval_task).
+EVAL_STRATEGIES = {
+    "two-turn": eval,
+    "structured": eval_structured,
+    "fused": eval_fused,
+}
 
 ###############################################################################
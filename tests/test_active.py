@@ -0,0 +1,106 @@
+"""
+test_active.py
+
+Checks the sampling order and the stopping rule of adaptive evaluation
+(src/active.py) on a synthetic population of gold labels.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python -m pytest tests"
+"""
+
+###############################################################################
+
+import os
+import sys
+from collections import Counter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+import active
+import numpy as np
+import pytest
+from active import ActiveSampler
+
+def population(counts: dict) -> list:
+    """
+    (questionID, gold label) pairs with counts[label] pairs of each label.
+    """
+    return [(f"q{label}-{i}", label) for label, size in counts.items() for i in range(size)]
+
+def rate(sampler: ActiveSampler,
+         crit: str,
+         pairs: list,
+         accuracy: float,
+         seed: int = 0) -> int:
+    """
+    Adds ratings of the pairs in order, each correct with the given
+    probability, until the criterion is done. Returns the number added.
+    """
+    rng = np.random.default_rng(seed)
+    gold = dict(pairs)
+    for rated, (questionID, _) in enumerate(pair for pair in sampler.order() if pair[1] == crit):
+        if sampler.done(crit):
+            return rated
+        correct = rng.random() < accuracy
+        sampler.add(crit, gold[questionID], gold[questionID] if correct else "wrong")
+    return len(pairs)
+
+###############################################################################
+
+#########
+# TESTS #
+#########
+
+def test_order_keeps_labels_in_proportion():
+    pairs = population({"1": 600, "2": 300, "3": 100})
+    order = ActiveSampler({"1": pairs}, 0.1, seed=4).order()
+    assert sorted(order) == sorted((questionID, "1") for questionID, _ in pairs)
+
+    # Every prefix holds each label within two pairs of its share
+    gold = dict(pairs)
+    seen = Counter()
+    for k, (questionID, _) in enumerate(order, start=1):
+        seen[gold[questionID]] += 1
+        for label, size in {"1": 600, "2": 300, "3": 100}.items():
+            assert abs(seen[label] - k * size / len(pairs)) <= 2
+
+def test_order_depends_only_on_seed():
+    criteria = {"1": population({"1": 50, "2": 50}), "3": population({"1": 30, "2": 20, "3": 10})}
+    assert ActiveSampler(criteria, 0.1, seed=1).order() == ActiveSampler(criteria, 0.1, seed=1).order()
+    assert ActiveSampler(criteria, 0.1, seed=1).order() != ActiveSampler(criteria, 0.1, seed=2).order()
+
+def test_every_label_needs_its_minimum():
+    pairs = population({"1": 100, "2": 100, "3": 3})
+    sampler = ActiveSampler({"1": pairs}, target_width=1.0)
+    for label, rated in (("1", 50), ("2", 50), ("3", 2)):
+        for _ in range(rated):
+            sampler.add("1", label, label)
+    assert not sampler.done("1")
+
+    # A label with fewer pairs than the minimum only needs all of them
+    sampler.add("1", "3", "3")
+    assert active.MIN_PER_LABEL > 3 and sampler.done("1")
+
+def test_interval_closes_when_everything_is_rated():
+    pairs = population({"1": 20, "2": 10})
+    sampler = ActiveSampler({"1": pairs}, target_width=0.0)
+    for i, (_, label) in enumerate(pairs):
+        assert not sampler.done("1")
+        sampler.add("1", label, label if i % 3 else "wrong")
+
+    estimate = sampler.estimate("1")
+    assert estimate["width"] == 0 and estimate["rated"] == estimate["population"] == 30
+    assert estimate["accuracy"] == pytest.approx(sum(1 for i in range(30) if i % 3) / 30)
+    assert sampler.done("1")
+
+def test_stops_once_interval_is_narrow_enough():
+    pairs = population({"1": 2000, "2": 1000})
+    sampler = ActiveSampler({"1": pairs}, target_width=0.1)
+    rated = rate(sampler, "1", pairs, accuracy=0.8)
+    assert rated < len(pairs)
+
+    estimate = sampler.estimates()["1"]
+    assert estimate["done"] and estimate["rated"] == rated and estimate["width"] <= 0.1
+    assert estimate["accuracy"] == pytest.approx(0.8, abs=0.1)
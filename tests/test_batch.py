@@ -0,0 +1,199 @@
+"""
+test_batch.py
+
+Runs batch mode (batch.py) end to end against a local stub of the OpenAI
+Batch API and the Anthropic Message Batches API, with the models' clients
+pointed at it through base_url. Job limits are lowered so that every stage
+is split into several jobs.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python -m pytest tests"
+"""
+
+###############################################################################
+
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import anthropic
+import openai
+import pandas as pd
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+import batch
+from models.model_abstract import Model
+from models.model_claude import Claude
+from models.model_gpt import GPT
+from utils import read_yaml
+
+MAX_REQUESTS = 20 # (Per job, so each stage of 50 requests needs 3 jobs)
+
+###############################################################################
+
+#################
+# STUB ENDPOINT #
+#################
+
+def reply(conversation: list) -> str:
+    """
+    Answers a batch request: reasoning for the question prompt, rating "1"
+    for the principle prompt that follows it.
+    """
+    return "1" if any(message["role"] == "assistant" for message in conversation) else "Some reasoning."
+
+class BatchStub(BaseHTTPRequestHandler):
+    """
+    Serves the batch endpoints of both providers. Every batch is still in
+    progress the first time it is retrieved and has ended afterwards.
+    """
+
+    files, batches, polls, jobs = {}, {}, {}, []
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def send_json(self, body, content_type: str = "application/json") -> None:
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+
+        # OpenAI: upload of the JSONL input file (multipart form)
+        if self.path == "/v1/files":
+            lines = [json.loads(line) for line in body.decode("utf-8").splitlines()
+                     if line.startswith('{"custom_id"')]
+            file_id = f"file-{len(BatchStub.files)}"
+            BatchStub.files[file_id] = lines
+            self.send_json({"id": file_id, "object": "file", "bytes": len(body), "created_at": 0,
+                            "filename": "batch.jsonl", "purpose": "batch", "status": "processed"})
+
+        # OpenAI: batch of an uploaded file
+        elif self.path == "/v1/batches":
+            lines = BatchStub.files[json.loads(body)["input_file_id"]]
+            BatchStub.jobs.append(len(lines))
+            output_id = f"file-{len(BatchStub.files)}"
+            BatchStub.files[output_id] = [
+                {"custom_id": line["custom_id"],
+                 "response": {"status_code": 200, "body": {"choices": [
+                     {"message": {"role": "assistant", "content": reply(line["body"]["messages"])}}]}}}
+                for line in lines]
+            batch_id = f"batch_{len(BatchStub.batches)}"
+            BatchStub.batches[batch_id] = output_id
+            self.send_json(self.openai_batch(batch_id))
+
+        # Anthropic: message batch
+        elif self.path == "/v1/messages/batches":
+            requests = json.loads(body)["requests"]
+            BatchStub.jobs.append(len(requests))
+            batch_id = f"msgbatch_{len(BatchStub.batches)}"
+            BatchStub.batches[batch_id] = [
+                {"custom_id": request["custom_id"],
+                 "result": {"type": "succeeded", "message": {
+                     "id": "msg", "type": "message", "role": "assistant", "model": "stub",
+                     "content": [{"type": "text", "text": reply(request["params"]["messages"])}],
+                     "stop_reason": "end_turn", "stop_sequence": None,
+                     "usage": {"input_tokens": 1, "output_tokens": 1}}}}
+                for request in requests]
+            self.send_json(self.anthropic_batch(batch_id))
+        else:
+            self.send_error(404)
+
+    def do_GET(self) -> None:
+        parts = self.path.strip("/").split("/")
+        if parts[:2] == ["v1", "batches"]:
+            self.send_json(self.openai_batch(parts[2]))
+        elif parts[:2] == ["v1", "files"] and parts[3:] == ["content"]:
+            self.send_json("\n".join(json.dumps(line) for line in BatchStub.files[parts[2]]),
+                           "application/octet-stream")
+        elif parts[:3] == ["v1", "messages", "batches"] and parts[4:] == ["results"]:
+            self.send_json("\n".join(json.dumps(entry) for entry in BatchStub.batches[parts[3]]),
+                           "application/binary")
+        elif parts[:3] == ["v1", "messages", "batches"]:
+            self.send_json(self.anthropic_batch(parts[3]))
+        else:
+            self.send_error(404)
+
+    def ended(self, batch_id: str) -> bool:
+        BatchStub.polls[batch_id] = BatchStub.polls.get(batch_id, -1) + 1
+        return BatchStub.polls[batch_id] > 1 # (The first retrieve is the create response)
+
+    def openai_batch(self, batch_id: str) -> dict:
+        ended = self.ended(batch_id)
+        return {"id": batch_id, "object": "batch", "endpoint": "/v1/chat/completions",
+                "input_file_id": "file-in", "completion_window": "24h", "created_at": 0,
+                "status": "completed" if ended else "in_progress",
+                "output_file_id": BatchStub.batches[batch_id] if ended else None}
+
+    def anthropic_batch(self, batch_id: str) -> dict:
+        ended = self.ended(batch_id)
+        host, port = self.server.server_address
+        return {"id": batch_id, "type": "message_batch", "created_at": "2024-01-01T00:00:00Z",
+                "expires_at": "2024-01-02T00:00:00Z", "archived_at": None, "cancel_initiated_at": None,
+                "ended_at": "2024-01-01T01:00:00Z" if ended else None,
+                "processing_status": "ended" if ended else "in_progress",
+                "request_counts": {"processing": 0, "succeeded": len(BatchStub.batches[batch_id]),
+                                   "errored": 0, "canceled": 0, "expired": 0},
+                "results_url": f"http://{host}:{port}/v1/messages/batches/{batch_id}/results" if ended else None}
+
+@pytest.fixture
+def stub_url():
+    BatchStub.files, BatchStub.batches, BatchStub.polls, BatchStub.jobs = {}, {}, {}, []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BatchStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+###############################################################################
+
+#########
+# TESTS #
+#########
+
+def run_stubbed_batch(Model_Class, client, params_path, out_directory, monkeypatch) -> pd.DataFrame:
+    """
+    Runs batch mode for criterion 1 with Model_Class's shared client
+    replaced by one pointed at the stub, and returns the evaluations.
+    """
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.setitem(Model._shared_clients, Model_Class, (client, read_yaml(params_path)))
+    monkeypatch.setattr(Model_Class, "BATCH_MAX_REQUESTS", MAX_REQUESTS)
+
+    batch.run_batch(Model_Class, "./data/mcqs/initial_publication_mcqs", str(out_directory),
+                    "./data/gold_labels/initial_publication_labels.csv", "1", False, poll_seconds=0)
+    assert not os.path.exists(os.path.join(out_directory, batch.STATE_FILE))
+    return pd.read_csv(os.path.join(out_directory, "evaluation.csv"), dtype=str)
+
+def check_ratings(df: pd.DataFrame) -> None:
+    """
+    Checks that every pair with a gold label was submitted in jobs of at
+    most MAX_REQUESTS requests, and rated.
+    """
+    planned = int(df["criteria 1"].notna().sum())
+    stage_jobs = -(-planned // MAX_REQUESTS)
+    assert len(BatchStub.jobs) == 2 * stage_jobs > 2
+    assert max(BatchStub.jobs) <= MAX_REQUESTS and sum(BatchStub.jobs) == 2 * planned
+    assert (df.loc[df["criteria 1"].notna(), "auto 1"] == "1").all()
+
+def test_gpt_batch(stub_url, tmp_path, monkeypatch):
+    client = openai.OpenAI(api_key="test", base_url=f"{stub_url}/v1", max_retries=0)
+    df = run_stubbed_batch(GPT, client, "./config/model_params/gpt_params.yaml", tmp_path, monkeypatch)
+    check_ratings(df)
+
+def test_claude_batch(stub_url, tmp_path, monkeypatch):
+    client = anthropic.Anthropic(api_key="test", base_url=stub_url, max_retries=0)
+    df = run_stubbed_batch(Claude, client, "./config/model_params/claude_params.yaml", tmp_path, monkeypatch)
+    check_ratings(df)
@@ -0,0 +1,69 @@
+"""
+test_interrater.py
+
+Checks the Krippendorff's alpha of src/analysis/interrater.py against the
+krippendorff package (see requirements-dev.txt) on a fixed ratings table
+with missing ratings, and on the raters' ratings shipped with the repo.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python -m pytest tests"
+"""
+
+###############################################################################
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src", "analysis"))
+
+import interrater
+import krippendorff
+import numpy as np
+import pandas as pd
+import pytest
+
+RATER_RATINGS = os.path.join(REPO_ROOT, "data", "gold_labels", "interrater_agreement", "rater_ratings.csv")
+
+# Krippendorff's (2011) example: 4 raters (rows) of 12 items (columns)
+RATINGS = np.array([
+    [1,      2, 3, 3, 2, 1, 4, 1, 2, np.nan, np.nan, np.nan],
+    [1,      2, 3, 3, 2, 2, 4, 1, 2, 5,      np.nan, 3],
+    [np.nan, 3, 3, 3, 2, 3, 4, 2, 2, 5,      1,      np.nan],
+    [1,      2, 3, 3, 2, 4, 4, 1, 2, 5,      1,      np.nan],
+])
+
+def reference_alpha(table: pd.DataFrame,
+                    level: str) -> float:
+    """
+    Alpha of an items x raters table according to the krippendorff package.
+    """
+    return krippendorff.alpha(reliability_data=table.astype(float).to_numpy().T, level_of_measurement=level)
+
+###############################################################################
+
+#########
+# TESTS #
+#########
+
+@pytest.mark.parametrize("level", interrater.LEVELS)
+def test_alpha_matches_krippendorff(level):
+    table = pd.DataFrame(RATINGS.T).map(lambda rating: np.nan if np.isnan(rating) else str(int(rating)))
+    results, _ = interrater.compute_krippendorff_alpha({"criteria 1": table}, level)
+    assert results["criteria 1"] == pytest.approx(reference_alpha(table, level))
+
+@pytest.mark.parametrize("level", interrater.LEVELS)
+def test_alpha_of_rater_ratings_matches_krippendorff(level):
+    ratings = interrater.get_ratings(RATER_RATINGS)
+    results, _ = interrater.compute_krippendorff_alpha(ratings, level)
+    assert results.keys() == ratings.keys()
+    for crit, table in ratings.items():
+        assert results[crit] == pytest.approx(reference_alpha(table, level))
+
+def test_bootstrap_interval_contains_alpha():
+    ratings = interrater.get_ratings(RATER_RATINGS)
+    results, intervals = interrater.compute_krippendorff_alpha(ratings, bootstrap=500, seed=3)
+    for crit, (low, high) in intervals.items():
+        assert low <= results[crit] <= high
+    assert intervals == interrater.compute_krippendorff_alpha(ratings, bootstrap=500, seed=3)[1]
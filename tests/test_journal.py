@@ -0,0 +1,71 @@
+"""
+test_journal.py
+
+Checks how a run's journal of finished ratings (src/utils.py) is replayed
+into the evaluations sheet when resuming, including a journal cut off in
+the middle of a record and questions listed more than once.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python -m pytest tests"
+"""
+
+###############################################################################
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+import pandas as pd
+import utils
+
+def write_journal(journal_path: str,
+                  records: list) -> None:
+    """
+    Writes records to a journal the way a run does.
+    """
+    with open(journal_path, 'a', encoding="utf-8") as journal_file:
+        for questionID, values in records:
+            utils.append_journal(journal_file, questionID, values)
+
+###############################################################################
+
+#########
+# TESTS #
+#########
+
+def test_replay_skips_torn_last_record(tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    write_journal(journal_path, [("q1", {"auto 1": "1"}), ("q2", {"auto 1": "2"})])
+    with open(journal_path, 'a', encoding="utf-8") as journal_file:
+        journal_file.write('{"questionID": "q3", "values": {"auto') # (Run killed mid-write)
+
+    df = pd.DataFrame({"questionID": ["q1", "q2", "q3"]})
+    assert utils.replay_journal(df, journal_path) == 2
+    assert df["auto 1"].tolist() == ["1", "2", None]
+
+def test_replay_applies_records_in_order(tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    write_journal(journal_path, [("q1", {"auto 1": "1"}),
+                                 ("q1", {"auto 1": "2", "auto 1 confidence": "0.9"}),
+                                 ("unknown", {"auto 1": "1"})])
+
+    df = pd.DataFrame({"questionID": ["q1", "q2"]})
+    assert utils.replay_journal(df, journal_path) == 2
+    assert df["auto 1"].tolist() == ["2", None]
+    assert df["auto 1 confidence"].tolist() == ["0.9", None]
+
+def test_replay_writes_every_row_of_a_question(tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    write_journal(journal_path, [("q1", {"auto 1": "1"})])
+
+    df = pd.DataFrame({"questionID": ["q1", "q2", "q1"]}, index=[10, 20, 30])
+    utils.replay_journal(df, journal_path)
+    assert df["auto 1"].tolist() == ["1", None, "1"]
+
+def test_replay_without_journal(tmp_path):
+    df = pd.DataFrame({"questionID": ["q1"]})
+    assert utils.replay_journal(df, str(tmp_path / "journal.jsonl")) == 0
+    assert df.columns.tolist() == ["questionID"]
@@ -0,0 +1,36 @@
+"""
+test_metrics.py
+
+Checks the running scores shown while a run is in progress
+(src/metrics.py).
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python -m pytest tests"
+"""
+
+###############################################################################
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+import metrics
+
+###############################################################################
+
+#########
+# TESTS #
+#########
+
+def test_postfix_shows_accuracy_and_macro_f1():
+    scores = metrics.RunningScores()
+    assert scores.postfix() == ""
+    for gold, rating in [("1", "1"), ("2", "1"), ("2", "2"), ("1", "1")]:
+        scores.add("1", gold, rating)
+    scores.add("3", "1", "2")
+
+    # Criterion 1: f1 of label 1 is 4/5, of label 2 is 2/3
+    assert scores.postfix() == "acc 1:0.75 3:0.00 f1 1:0.73 3:0.00"
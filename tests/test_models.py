@@ -0,0 +1,70 @@
+"""
+test_models.py
+
+Checks conversation state kept by the model classes (src/models/) when a
+turn is rewound or fails, with generate replaced by a stub.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python -m pytest tests"
+"""
+
+###############################################################################
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+import pytest
+from models.model_abstract import Model
+from models.model_llama3 import Llama3
+
+class RenderedLlama3(Llama3):
+    """
+    Llama3 that records the prompts it renders instead of sending them.
+    """
+
+    prompts = []
+
+    def generate(self, messages: list) -> str:
+        RenderedLlama3.prompts.append(self.render_prompt(messages))
+        if messages[-1]["content"] == "fail":
+            raise KeyboardInterrupt
+        return f"reply {len(RenderedLlama3.prompts)}"
+
+@pytest.fixture(autouse=True)
+def stub_client(monkeypatch):
+    monkeypatch.setattr(Model, "_response_cache", None)
+    monkeypatch.setitem(Model._shared_clients, RenderedLlama3, (None, {"temperature": 0}))
+    monkeypatch.setattr(RenderedLlama3, "prompts", [])
+
+###############################################################################
+
+#########
+# TESTS #
+#########
+
+def test_llama3_prompt_after_rewind():
+    model = RenderedLlama3("system")
+    model.get_response("question")
+    model.get_response("principle")
+    model.rewind()
+    model.get_response("reask")
+
+    # The rewound principle and its reply are not sent again
+    prompt = RenderedLlama3.prompts[-1]
+    assert "principle" not in prompt and "reply 2" not in prompt
+    assert prompt == RenderedLlama3("system").render_prompt(
+        [{"role": "user", "content": "question"}, {"role": "assistant", "content": "reply 1"},
+         {"role": "user", "content": "reask"}])
+
+def test_llama3_prompt_after_failed_turn():
+    model = RenderedLlama3("system")
+    model.get_response("question")
+    with pytest.raises(KeyboardInterrupt):
+        model.get_response("fail")
+    model.get_response("principle")
+    assert "fail" not in RenderedLlama3.prompts[-1]
+    assert RenderedLlama3.prompts[-1].count("<|start_header_id|>user") == 2
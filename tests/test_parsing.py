@@ -0,0 +1,147 @@
+"""
+test_parsing.py
+
+Checks how ratings are read from model replies (src/utils.py), including
+replies without any text (e.g. a completion whose content is None).
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python -m pytest tests"
+"""
+
+###############################################################################
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+import utils
+from models.model_abstract import Model
+
+MCQ = {"question": "What is 2 + 2?", "choices": ["3", "4", "5"]}
+
+class EmptyModel(Model):
+    """
+    Model whose every completion has no content.
+    """
+
+    def generate(self, messages: list) -> None:
+        return None
+
+class ScriptedModel(Model):
+    """
+    Model that answers the question turn with a reasoning and every later
+    turn with the next reply of REPLIES, recording what it was sent.
+    """
+
+    REPLIES = []
+    requests = []
+
+    def generate(self, messages: list) -> str:
+        ScriptedModel.requests.append([message["content"] for message in messages])
+        if len(messages) == 1:
+            return "Some reasoning."
+        return ScriptedModel.REPLIES.pop(0)
+
+class FusedModel(Model):
+    """
+    Model that answers every fused prompt with the next reply of REPLIES,
+    recording the prompts it was sent.
+    """
+
+    REPLIES = []
+    prompts = []
+
+    def generate(self, messages: list) -> str:
+        FusedModel.prompts.append(messages[-1]["content"])
+        return FusedModel.REPLIES.pop(0)
+
+###############################################################################
+
+#########
+# TESTS #
+#########
+
+def test_parsers_accept_none():
+    assert utils.parse_rating(None, ("1", "2")) == ""
+    assert utils.parse_structured_response(None) == ""
+    assert utils.parse_structured_confidence(None) is None
+    assert utils.parse_fused_response(None, ["1", "3"]) == {"1": "", "3": ""}
+
+def test_strategies_rate_empty_completions_as_unreadable(monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.setattr(Model, "_response_cache", None)
+    bundles = utils.load_criterion_bundles(["1", "3"])
+
+    _, rating = utils.eval_structured(EmptyModel, MCQ, bundles["1"])
+    assert rating == ""
+    _, rating, confidence = utils.eval_confidence(EmptyModel, MCQ, bundles["1"])
+    assert rating == "" and confidence is None
+    _, ratings = utils.eval_fused(EmptyModel, MCQ, [bundles["1"], bundles["3"]])
+    assert ratings == {"1": "", "3": ""}
+
+def test_labels_read_from_principles(monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    bundles = utils.load_criterion_bundles(["1", "2", "3"])
+    assert bundles["1"].labels == ("1", "2")
+    assert bundles["2"].labels == ("1", "2", "3", "4")
+    assert bundles["3"].labels == ("1", "2", "3")
+
+def test_parse_rating_with_custom_labels():
+    labels = ("1", "2", "3")
+    assert utils.parse_rating("**2**", labels) == "2"
+    assert utils.parse_rating("Rating: 3", labels) == "3"
+    assert utils.parse_rating("2: There are minor syntax issues", labels) == "2"
+    assert utils.parse_rating("The answer is 1.", labels) == "1"
+    assert utils.parse_rating("Between 1 and 3, my rating is 3", labels) == "3"
+
+    # Keys the criterion doesn't have, ambiguous and non-integer replies
+    assert utils.parse_rating("4", labels) == ""
+    assert utils.parse_rating("I'd say 1 or 2", labels) == ""
+    assert utils.parse_rating("2.5", labels) == ""
+    assert utils.parse_rating("junk", labels) == ""
+
+    # Without labels any number is a key
+    assert utils.parse_rating("Rating: 7", ()) == "7"
+    assert utils.parse_rating("7", ("7", "8")) == "7"
+
+def test_unreadable_principle_reply_is_reasked(monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.setattr(Model, "_response_cache", None)
+    monkeypatch.setattr(ScriptedModel, "requests", [])
+    monkeypatch.setattr(ScriptedModel, "REPLIES", ["I'd say 1 or 2", "junk", "Rating: 2"])
+    bundle = utils.load_criterion_bundles(["1"])["1"]
+
+    messages, rating = utils.eval(ScriptedModel, MCQ, bundle)
+    assert rating == "2"
+
+    # The first re-ask replaces the failed principle turn on top of the same
+    # reasoning; the second follows up on the first
+    question, principle, first_reask, second_reask = ScriptedModel.requests
+    assert principle == question + ["Some reasoning.", bundle.principle]
+    assert first_reask == question + ["Some reasoning.", bundle.render_reask()]
+    assert second_reask == first_reask + ["junk", bundle.render_reask()]
+    assert [message["content"] for message in messages][-2:] == [bundle.render_reask(), "Rating: 2"]
+
+def test_fused_retry_keeps_valid_ratings(monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.setattr(Model, "_response_cache", None)
+    monkeypatch.setattr(FusedModel, "prompts", [])
+    monkeypatch.setattr(FusedModel, "REPLIES", [
+        '{"1": {"reasoning": "r", "rating": 2}, "3": {"reasoning": "r", "rating": "junk"}}',
+        '{"3": {"reasoning": "r", "rating": 3}}',
+    ])
+    bundles = utils.load_criterion_bundles(["1", "3"])
+
+    results = utils.eval_task(FusedModel, "q", [bundles["1"], bundles["3"]], MCQ, strategy="fused")
+    assert [(crit, rating) for _, crit, _, rating, _ in results] == [("1", "2"), ("3", "3")]
+
+    # Only the criterion without a valid rating is asked again, and each
+    # criterion keeps the log of the conversation that rated it
+    assert FusedModel.prompts == [utils.render_fused(MCQ, [bundles["1"], bundles["3"]]),
+                                  utils.render_fused(MCQ, [bundles["3"]])]
+    (_, _, first_log, _, _), (_, _, second_log, _, _) = results
+    assert first_log[-1]["content"].endswith('"junk"}}')
+    assert second_log[-1]["content"] == '{"3": {"reasoning": "r", "rating": 3}}'
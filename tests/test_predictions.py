@@ -0,0 +1,45 @@
+"""
+test_predictions.py
+
+Checks that the bootstrap confidence intervals and paired tests of
+src/analysis/predictions.py only depend on the seed and number of
+resamples, not on how many processes draw them.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python -m pytest tests"
+"""
+
+###############################################################################
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src", "analysis"))
+
+import predictions
+
+GPT_RUN = os.path.join(REPO_ROOT, "data", "model_labels", "gpt-4-0613", "evaluation.csv")
+CLAUDE_RUN = os.path.join(REPO_ROOT, "data", "model_labels", "claude-3-opus-20240229", "evaluation.csv")
+
+###############################################################################
+
+#########
+# TESTS #
+#########
+
+def test_intervals_independent_of_processes():
+    single = predictions.compute_bootstrap_intervals(GPT_RUN, 5, 1000, seed=7, processes=1)
+    pooled = predictions.compute_bootstrap_intervals(GPT_RUN, 5, 1000, seed=7, processes=4)
+    assert single == pooled
+
+def test_paired_tests_independent_of_processes():
+    single = predictions.compute_paired_tests(GPT_RUN, CLAUDE_RUN, 5, 1000, seed=7, processes=1)
+    pooled = predictions.compute_paired_tests(GPT_RUN, CLAUDE_RUN, 5, 1000, seed=7, processes=4)
+    assert single == pooled
+
+def test_seed_changes_intervals():
+    first = predictions.compute_bootstrap_intervals(GPT_RUN, 5, 1000, seed=1, processes=1)
+    second = predictions.compute_bootstrap_intervals(GPT_RUN, 5, 1000, seed=2, processes=1)
+    assert first != second
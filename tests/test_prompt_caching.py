@@ -0,0 +1,78 @@
+"""
+test_prompt_caching.py
+
+Checks which parts of a two-turn Claude conversation are marked for
+Anthropic's prompt caching, with a client that records the requests
+instead of sending them.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python -m pytest tests"
+"""
+
+###############################################################################
+
+import os
+import sys
+from types import SimpleNamespace
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+import pytest
+import utils
+from models.model_abstract import Model
+from models.model_claude import Claude
+
+class RecordingClient:
+    """
+    Stands in for anthropic.Anthropic, recording every messages request.
+    """
+
+    def __init__(self) -> None:
+        self.requests = []
+        self.messages = SimpleNamespace(create=self.create)
+
+    def create(self, **request):
+        self.requests.append(request)
+        usage = SimpleNamespace(input_tokens=1, output_tokens=1,
+                                cache_read_input_tokens=0, cache_creation_input_tokens=0)
+        return SimpleNamespace(content=[SimpleNamespace(text="1")], usage=usage)
+
+def marked(request: dict) -> list:
+    """
+    Indices of the messages of a request carrying a cache_control marker.
+    """
+    return [i for i, message in enumerate(request["messages"])
+            if isinstance(message["content"], list) and "cache_control" in message["content"][0]]
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.setattr(Model, "_response_cache", None)
+    recording = RecordingClient()
+    model_params = utils.read_yaml("./config/model_params/claude_params.yaml")
+    monkeypatch.setitem(Model._shared_clients, Claude, (recording, model_params))
+    return recording
+
+###############################################################################
+
+#########
+# TESTS #
+#########
+
+def test_caching_off_by_default(client):
+    bundle = utils.load_criterion_bundles(["1"])["1"]
+    utils.eval(Claude, {"question": "q", "choices": ["a", "b"]}, bundle)
+    assert [marked(request) for request in client.requests] == [[], []]
+
+def test_only_the_reused_question_turn_is_marked(client):
+    Model._shared_clients[Claude][1]["prompt_caching"] = True
+    bundle = utils.load_criterion_bundles(["1"])["1"]
+    utils.eval(Claude, {"question": "q", "choices": ["a", "b"]}, bundle)
+
+    # The question turn is written, then read back by the principle turn,
+    # which is not cached itself
+    question, principle = client.requests
+    assert marked(question) == [0] and marked(principle) == [0]
+    assert isinstance(question["system"], str)
@@ -0,0 +1,85 @@
+"""
+test_report.py
+
+Checks the token accounting behind the run report
+(src/analysis/report.py): the usage GPT reports for a request with cached
+input, and the cost computed from it.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python -m pytest tests"
+"""
+
+###############################################################################
+
+import os
+import sys
+from types import SimpleNamespace
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src", "analysis"))
+
+import pandas as pd
+import pytest
+import report
+from models.model_abstract import Model
+from models.model_gpt import GPT
+
+PRICES = {"gpt-4o": {"input": 2.50, "output": 10.00, "cache_read": 1.25},
+          "claude-3-opus-20240229": {"input": 15.00, "output": 75.00, "cache_read": 1.50, "cache_write": 18.75}}
+
+def openai_completion(prompt_tokens: int,
+                      cached_tokens: int,
+                      completion_tokens: int):
+    """
+    Builds a chat completion as the OpenAI client returns it.
+    """
+    usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                            prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens))
+    message = SimpleNamespace(content="1")
+    return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=message)])
+
+###############################################################################
+
+#########
+# TESTS #
+#########
+
+def test_gpt_input_tokens_leave_out_cache_reads(monkeypatch):
+    completion = openai_completion(prompt_tokens=3000, cached_tokens=2048, completion_tokens=100)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **_: completion)))
+    model_params = {"model": "gpt-4o", "temperature": 0, "completion_len": 10, "top_p": 1,
+                    "frequency_penalty": 0, "presence_penalty": 0}
+    monkeypatch.setitem(Model._shared_clients, GPT, (client, model_params))
+
+    usage = GPT("system").generate([{"role": "user", "content": "question"}]).usage
+    assert usage == {"input_tokens": 952, "output_tokens": 100, "cache_read_tokens": 2048}
+
+def test_request_costs():
+    df = pd.DataFrame({
+        "model_name": ["gpt-4o", "claude-3-opus-20240229", "gpt-4o", "unpriced"],
+        "input_tokens": [952, 1000, 952, 1000],
+        "output_tokens": [100, 200, 100, 200],
+        "cache_read_tokens": [2048, 4000, 2048, 0],
+        "cache_write_tokens": [0, 500, 0, 0],
+        "cached_response": [False, False, True, False],
+    })
+    costs = report.request_costs(df, PRICES)
+
+    # Cached input is billed once, at the cache read price
+    assert costs[0] == pytest.approx((952 * 2.50 + 100 * 10.00 + 2048 * 1.25) / 1e6)
+    assert costs[1] == pytest.approx((1000 * 15.00 + 200 * 75.00 + 4000 * 1.50 + 500 * 18.75) / 1e6)
+    # Responses from the response cache and unpriced models are free
+    assert costs[2] == 0 and costs[3] == 0
+
+def test_report_of_run_without_requests(tmp_path):
+    metrics_path = tmp_path / "metrics.jsonl"
+    metrics_path.write_text('{"time": 1.0, "latency"\n', encoding="utf-8") # (Only a torn line)
+    df = report.load_metrics(str(metrics_path))
+    df["cost"] = report.request_costs(df, PRICES)
+
+    summary = report.build_report(df)
+    assert summary["criteria"] == {}
+    assert summary["overall"]["requests"] == 0 and summary["overall"]["cost"] == 0
+    assert summary["overall"]["wall_seconds"] == 0 and summary["overall"]["requests_per_minute"] is None
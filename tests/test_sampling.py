@@ -0,0 +1,79 @@
+"""
+test_sampling.py
+
+Checks self-consistency mode (src/utils.py): how many samples are still
+needed to decide a vote, how the vote is read, and that eval_samples stops
+early once the vote is decided.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python -m pytest tests"
+"""
+
+###############################################################################
+
+import os
+import sys
+import threading
+from collections import Counter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+import json
+import utils
+from models.model_abstract import Model
+
+MCQ = {"question": "What is 2 + 2?", "choices": ["3", "4", "5"]}
+
+class ConstantModel(Model):
+    """
+    Model rating every mcq "1", counting its sampled conversations.
+    """
+
+    samples = set()
+    lock = threading.Lock()
+
+    def generate(self, messages: list) -> str:
+        with ConstantModel.lock:
+            ConstantModel.samples.add(self._sample)
+        return '{"reasoning": "...", "rating": 1}'
+
+###############################################################################
+
+#########
+# TESTS #
+#########
+
+def test_votes_needed():
+    # Nothing yet: a majority of all samples could decide the vote
+    assert utils.votes_needed(Counter(), 5) == 3
+    # 2-0 with 3 left: one more sample can make it unreachable
+    assert utils.votes_needed(Counter({"1": 2}), 3) == 1
+    assert utils.votes_needed(Counter({"1": 3}), 2) == 0
+    # A tie needs at least one more sample, capped by what is left
+    assert utils.votes_needed(Counter({"1": 1, "2": 1}), 3) == 2
+    assert utils.votes_needed(Counter({"1": 2, "2": 2}), 1) == 1
+    assert utils.votes_needed(Counter({"1": 2, "2": 2}), 0) == 0
+
+def test_vote_result():
+    assert utils.vote_result("3", Counter()) == (None, {})
+    rating, columns = utils.vote_result("3", Counter({"2": 3, "1": 1}))
+    assert rating == "2"
+    assert columns == {"confidence 3": "0.750", "votes 3": json.dumps({"2": 3, "1": 1})}
+
+    # Ties go to the rating given first
+    assert utils.vote_result("3", Counter({"1": 2, "2": 2}))[0] == "1"
+    assert utils.vote_result("3", Counter({"2": 2, "1": 2}))[0] == "2"
+
+def test_unanimous_samples_stop_early(monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.setattr(Model, "_response_cache", None)
+    monkeypatch.setattr(ConstantModel, "samples", set())
+    bundle = utils.load_criterion_bundles(["1"])["1"]
+
+    # 3 agreeing samples out of at most 5 decide the vote
+    log, votes = utils.eval_samples(ConstantModel, "q", MCQ, [bundle], "structured", 5, 0.7)
+    assert votes == {"1": Counter({"1": 3})}
+    assert ConstantModel.samples == {1, 2, 3}
+    assert log[0]["samples"] == 3
@@ -0,0 +1,89 @@
+"""
+test_sharding.py
+
+Checks that sharded runs split the questions into disjoint shards the same
+way in every process (src/utils.py), and that merging the shards' output
+(src/merge.py) recovers every rating.
+
+USAGE:
+  From the mcq-eval/ directory, run
+    "python -m pytest tests"
+"""
+
+###############################################################################
+
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "src"))
+
+import merge
+import pandas as pd
+import pytest
+import utils
+
+GOLD_PATH = os.path.join(REPO_ROOT, "data", "gold_labels", "initial_publication_labels.csv")
+SHARDS = 3
+
+def shard_rows(df: pd.DataFrame) -> list:
+    """
+    Eligible rows of every shard of df, numbered from 1 as on the command
+    line.
+    """
+    available = set(df["questionID"])
+    return [utils.eligible_rows(df, available, (index, SHARDS)) for index in range(1, SHARDS + 1)]
+
+###############################################################################
+
+#########
+# TESTS #
+#########
+
+def test_shards_partition_the_questions():
+    df = pd.read_csv(GOLD_PATH, dtype=str)
+    rows = shard_rows(df)
+    assert all(shard.any() for shard in rows)
+    assert (sum(shard.astype(int) for shard in rows) == utils.eligible_rows(df, set(df["questionID"]))).all()
+
+def test_shard_of_is_stable_across_processes():
+    questionIDs = pd.read_csv(GOLD_PATH, dtype=str)["questionID"].head(20).tolist()
+    script = ("import utils; "
+              f"print([utils.shard_of(questionID, {SHARDS}) for questionID in {questionIDs!r}])")
+    outputs = set()
+    for hash_seed in ("1", "2"):
+        env = {**os.environ, "PYTHONHASHSEED": hash_seed, "PYTHONPATH": os.path.join(REPO_ROOT, "src")}
+        outputs.add(subprocess.run([sys.executable, "-c", script], env=env, cwd=REPO_ROOT,
+                                   capture_output=True, text=True, check=True).stdout)
+    assert outputs == {f"{[utils.shard_of(questionID, SHARDS) for questionID in questionIDs]}\n"}
+
+def test_merge_recovers_every_shard(tmp_path):
+    gold = pd.read_csv(GOLD_PATH, dtype=str)
+    shard_paths = []
+    for index, rows in enumerate(shard_rows(gold), start=1):
+        # Each shard rates its own questions; the last one only in its journal
+        df = gold.copy()
+        df["auto 1"] = None
+        df.loc[rows, "auto 1"] = str(index)
+        shard_path = tmp_path / f"shard_{index}"
+        shard_path.mkdir()
+        if index < SHARDS:
+            df.to_csv(shard_path / "evaluation.csv") # (With its index column, as older runs saved it)
+        else:
+            gold.to_csv(shard_path / "evaluation.csv", index=False)
+            with open(shard_path / "journal.jsonl", 'w', encoding="utf-8") as journal_file:
+                for questionID in df.loc[rows, "questionID"]:
+                    utils.append_journal(journal_file, questionID, {"auto 1": str(index)})
+        shard_paths.append(str(shard_path))
+
+    merged, conflicts = merge.merge_evaluations([merge.load_shard(path) for path in shard_paths])
+    assert conflicts == 0
+    assert merged.columns.tolist() == gold.columns.tolist() + ["auto 1"]
+    expected = sum(rows.astype(int) * index for index, rows in enumerate(shard_rows(gold), start=1))
+    assert merged["auto 1"].fillna("0").astype(int).tolist() == expected.tolist()
+
+def test_merge_rejects_different_gold_labels():
+    gold = pd.read_csv(GOLD_PATH, dtype=str)
+    with pytest.raises(ValueError):
+        merge.merge_evaluations([gold, gold.iloc[::-1].reset_index(drop=True)])